@@ -25,3 +25,5 @@ from .bpp import Bpp as bpp
 from .sratools import SRA as sratools
 from .twiist import Twiist as twiist
 from .pca import PCA as pca
+from .locireader import LociReader as locireader
+from .genos import Genos as genos
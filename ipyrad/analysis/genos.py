@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+""" load snps from the step 7 genotype store (.genos.hdf5) """
+
+from __future__ import print_function
+import os
+import h5py
+import numpy as np
+from ipyrad.assemble.util import IPyradWarningExit
+
+
+## fields of the genotype store, laid out like scikit-allel callsets
+FIELDS = ["calldata/GT", "calldata/CATG", "variants/CHROM", "variants/POS",
+          "variants/REF", "variants/ALT", "variants/LOCUS"]
+
+
+class Genos(object):
+    """
+    Reads snps from the HDF5 genotype store written in step 7 when 'h' is
+    in output_formats. Arrays are returned in a dict keyed like the
+    callsets of allel.read_vcf(), e.g., callset["calldata/GT"] can be
+    passed to allel.GenotypeArray() without parsing a vcf.
+
+    Parameters:
+    -----------
+    data: str or Assembly
+        The .genos.hdf5 file, or an Assembly object that wrote one in step 7.
+
+    Attributes:
+    -----------
+    samples: ndarray
+        Sample names in the order of the calldata sample axis.
+    nsnps: int
+        The number of snps in the store.
+
+    Functions:
+    ----------
+    read(fields, samples, start, end)
+        returns a dict of arrays for a range of snps.
+    chunks(fields, samples, chunksize)
+        yields dicts of arrays for consecutive ranges of snps.
+    """
+
+    def __init__(self, data):
+
+        ## get file path from an Assembly or a path
+        if hasattr(data, "outfiles"):
+            if "genos" not in data.outfiles:
+                raise IPyradWarningExit(MISSING_GENOS_ERROR)
+            data = data.outfiles.genos
+        self.data = os.path.realpath(os.path.expanduser(data))
+        if not os.path.exists(self.data):
+            raise IPyradWarningExit(
+                "genos file not found: {}".format(self.data))
+
+        with h5py.File(self.data, 'r') as io5:
+            self.samples = io5["samples"][:].astype(str)
+            self.nsnps = io5["variants/POS"].shape[0]
+
+
+    def _sidx(self, samples):
+        """ returns the index of samples in the store or all samples """
+        if samples is None:
+            return np.arange(self.samples.shape[0])
+        missing = [i for i in samples if i not in self.samples]
+        if missing:
+            raise IPyradWarningExit(
+                "samples not in genos file: {}".format(missing))
+        return np.array([np.where(self.samples == i)[0][0] for i in samples])
+
+
+    def read(self, fields=None, samples=None, start=0, end=None):
+        """
+        Returns a dict of arrays for snps start to end. fields is a list of
+        keys such as "calldata/GT" or "variants/POS", default is all. The
+        calldata sample axis is subset and ordered by samples if given.
+        """
+        if fields is None:
+            fields = FIELDS
+        sidx = self._sidx(samples)
+        if end is None:
+            end = self.nsnps
+
+        callset = {"samples": self.samples[sidx]}
+        with h5py.File(self.data, 'r') as io5:
+            for key in fields:
+                if key == "samples":
+                    continue
+                if key not in io5:
+                    raise IPyradWarningExit(
+                        "field not in genos file: {}".format(key))
+                arr = io5[key][start:end]
+                if key.startswith("calldata"):
+                    arr = arr[:, sidx]
+                callset[key] = arr
+        return callset
+
+
+    def chunks(self, fields=None, samples=None, chunksize=100000):
+        """
+        Yields dicts of arrays as from read() for consecutive chunks of
+        chunksize snps, so that large stores can be processed in pieces.
+        """
+        for start in xrange(0, self.nsnps, chunksize):
+            yield self.read(fields, samples, start, start+chunksize)
+
+
+
+MISSING_GENOS_ERROR = """\
+    Assembly does not contain a genos file. Rerun step 7 with `h` included
+    in the `output_formats` parameter."""
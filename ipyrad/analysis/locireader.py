@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+""" random access to loci in a .loci file using the step 7 locus index """
+
+from __future__ import print_function
+import os
+import h5py
+import numpy as np
+from ipyrad.assemble.util import IPyradWarningExit
+
+
+class LociReader(object):
+    """
+    Reads loci from a .loci file by id, by sample coverage, or in batches,
+    without loading the whole file, using the companion index (.loci.h5)
+    written in step 7. Loci are returned as strings in the same form as
+    the elements of open(locifile).read().split("|\\n"), so they can be
+    passed to existing locus parsers.
+
+    Parameters:
+    -----------
+    data: str or Assembly
+        The .loci file, or an Assembly object that has finished step 7.
+    index: str
+        The locus index file. Default is the .loci file path with .h5
+        appended (e.g., name.loci.h5).
+
+    Attributes:
+    -----------
+    samples: list
+        Sample names in the order of the coverage bitsets.
+    locids: ndarray
+        The locus id of each locus in file order.
+    coverage: ndarray
+        A boolean (nloci, nsamples) array of samples present in each locus.
+    nvar, npis: ndarray
+        The number of variable and parsimony informative sites per locus.
+
+    Functions:
+    ----------
+    get(locids)
+        returns a list of loci by locus id.
+    select(include, mincov, minvar)
+        returns locus ids of loci matching sample coverage and snp counts.
+    batches(locids, batchsize)
+        yields lists of loci in file order.
+    """
+
+    def __init__(self, data, index=None):
+
+        ## get file paths from an Assembly or a path
+        if hasattr(data, "outfiles"):
+            self.locifile = data.outfiles.loci
+            if not index:
+                index = data.outfiles.get("locindex")
+        else:
+            self.locifile = data
+        self.locifile = os.path.realpath(os.path.expanduser(self.locifile))
+        if not index:
+            index = self.locifile+".h5"
+        self.index = os.path.realpath(os.path.expanduser(index))
+
+        if not os.path.exists(self.locifile):
+            raise IPyradWarningExit(
+                "loci file not found: {}".format(self.locifile))
+        if not os.path.exists(self.index):
+            raise IPyradWarningExit(
+                "locus index not found: {}\n".format(self.index)\
+               +"  The index is written when step 7 is run.")
+
+        ## the index is small, so load it all
+        with h5py.File(self.index, 'r') as io5:
+            self.locids = io5["locid"][:]
+            self.offsets = io5["offset"][:]
+            self.lengths = io5["length"][:]
+            self.nvar = io5["nvar"][:]
+            self.npis = io5["npis"][:]
+            self.samples = [i.decode() if isinstance(i, bytes) else i \
+                            for i in io5["samples"].attrs["names"]]
+            packed = io5["samples"][:]
+        self.coverage = np.unpackbits(packed, axis=1)[:, :len(self.samples)]\
+                          .astype(np.bool_)
+        self.nloci = self.locids.shape[0]
+
+
+    def __len__(self):
+        return self.nloci
+
+
+    def _rows(self, locids):
+        """ returns the file-order rows of locus ids """
+        locids = np.atleast_1d(np.asarray(locids, dtype=np.int64))
+        rows = np.searchsorted(self.locids, locids)
+        rows[rows >= self.nloci] = 0
+        missing = self.locids[rows] != locids
+        if np.any(missing):
+            raise IPyradWarningExit(
+                "locus ids not in loci file: {}".format(locids[missing][:10]))
+        return rows
+
+
+    def _read(self, infile, row, nrows):
+        """ reads nrows consecutive loci starting at row as one read """
+        end = row + nrows - 1
+        infile.seek(self.offsets[row])
+        block = infile.read(self.offsets[end] + self.lengths[end] \
+                            - self.offsets[row])
+        if not isinstance(block, str):
+            block = block.decode()
+        ## each record ends with |\n, drop it to match split("|\n")
+        return [i.lstrip("\n") for i in block.split("|\n") if i.strip()]
+
+
+    def get(self, locids):
+        """
+        Returns a list of loci for the locus ids, which are the numbers
+        printed after the snp string of each locus.
+        """
+        rows = self._rows(locids)
+        loci = []
+        with open(self.locifile, 'rb') as infile:
+            for row in rows:
+                loci.extend(self._read(infile, row, 1))
+        return loci
+
+
+    def select(self, include=None, mincov=0, minvar=0, minpis=0):
+        """
+        Returns the locus ids of loci that have all samples in 'include',
+        at least 'mincov' samples, and at least 'minvar' variable and
+        'minpis' parsimony informative sites.
+        """
+        mask = np.ones(self.nloci, dtype=np.bool_)
+        if include:
+            for name in include:
+                if name not in self.samples:
+                    raise IPyradWarningExit(
+                        "sample not in loci file: {}".format(name))
+                mask &= self.coverage[:, self.samples.index(name)]
+        if mincov:
+            mask &= self.coverage.sum(axis=1) >= mincov
+        if minvar:
+            mask &= self.nvar >= minvar
+        if minpis:
+            mask &= self.npis >= minpis
+        return self.locids[mask]
+
+
+    def batches(self, locids=None, batchsize=1000):
+        """
+        Yields lists of up to batchsize loci in file order. If locids is
+        None all loci are yielded. Consecutive loci are read in one read.
+        """
+        if locids is None:
+            rows = np.arange(self.nloci)
+        else:
+            rows = np.sort(self._rows(locids))
+
+        with open(self.locifile, 'rb') as infile:
+            for bidx in xrange(0, rows.shape[0], batchsize):
+                brows = rows[bidx:bidx+batchsize]
+                ## split the batch into runs of consecutive rows
+                breaks = np.where(np.diff(brows) != 1)[0] + 1
+                loci = []
+                for run in np.split(brows, breaks):
+                    loci.extend(self._read(infile, run[0], run.shape[0]))
+                yield loci
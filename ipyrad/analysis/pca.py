@@ -13,6 +13,7 @@ from __future__ import print_function, division
 ## ipyrad tools
 from ipyrad.assemble.util import IPyradWarningExit, IPyradError, progressbar
 from ipyrad import Assembly
+from .genos import Genos
 from collections import OrderedDict
 
 import matplotlib.pyplot as plt
@@ -81,10 +82,15 @@ class PCA(object):
         if isinstance(data, Assembly):
             self.assembly = data
             self.pops = data.populations
-            try:
-                self.data = data.outfiles.vcf
-            except AttributeError as inst:
-                raise IPyradError(MISSING_VCF_ERROR)  
+            ## prefer the genotype store, which loads without parsing text
+            genos = data.outfiles.get("genos")
+            if genos and os.path.exists(genos):
+                self.data = genos
+            else:
+                try:
+                    self.data = data.outfiles.vcf
+                except AttributeError as inst:
+                    raise IPyradError(MISSING_VCF_ERROR)  
         else:
             ## You need a dummy assembly because we use the machinery
             ## of _link_populations below to read in the pops data
@@ -143,7 +149,10 @@ class PCA(object):
     ## Load in the vcf and automatically remove multi-allelic snps
     ## and biallelic singletons.
     def _load_calldata(self):
-        callset = allel.read_vcf(self.data, fields=["samples", "GT"])
+        if self.data.endswith(".hdf5"):
+            callset = Genos(self.data).read(fields=["calldata/GT"])
+        else:
+            callset = allel.read_vcf(self.data, fields=["samples", "GT"])
         self.samples_vcforder = callset["samples"]
 
         gt = allel.GenotypeArray(callset['calldata/GT'])
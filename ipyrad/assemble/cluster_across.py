@@ -23,12 +23,15 @@ import shutil
 import random
 import select
 import socket
+import string
 import datetime
 import itertools
 import numpy as np
-import dask.array as da
+import pandas as pd
 import ipyrad
 from ipyrad.assemble.util import IPyradWarningExit, progressbar, clustdealer, fullcomp
+from ipyrad.assemble.util import encode_seqs
+from ipyrad.assemble.consens_se import build_refindex, get_maxspan, load_refindex
 #from ipyrad.assemble.cluster_within import muscle_call, parsemuscle
 
 try:
@@ -92,157 +95,175 @@ def persistent_popen_align3(data, samples, chunk):
             ## append counter to names because muscle doesn't retain order
             names = [">{};*{}".format(j[1:], i) for i, j in enumerate(names)]
 
-            try:
-                ## try to split names on nnnn splitter
-                clust1, clust2 = zip(*[i.split("nnnn") for i in seqs])
-
-                ## make back into strings
-                cl1 = "\n".join(itertools.chain(*zip(names, clust1)))
-                cl2 = "\n".join(itertools.chain(*zip(names, clust2)))
-
-                ## store allele (lowercase) info
-                shape = (len(seqs), max([len(i) for i in seqs]))
-                arrseqs = np.zeros(shape, dtype="S1")
-                for row in range(arrseqs.shape[0]):
-                    seqsrow = seqs[row]
-                    arrseqs[row, :len(seqsrow)] = list(seqsrow)
-                amask = np.char.islower(arrseqs)
-                save_alleles = np.any(amask)
-
-                ## send align1 to the bash shell
-                ## TODO: check for pipe-overflow here and use files for i/o                
-                cmd1 = "echo -e '{}' | {} -quiet -in - ; echo {}"\
-                       .format(cl1, ipyrad.bins.muscle, "//")
-                print(cmd1, file=proc.stdin)
-
-                ## read the stdout by line until splitter is reached
-                for line in iter(proc.stdout.readline, "//\n"):
-                    align1 += line
-
-                ## send align2 to the bash shell
-                ## TODO: check for pipe-overflow here and use files for i/o                
-                cmd2 = "echo -e '{}' | {} -quiet -in - ; echo {}"\
-                       .format(cl2, ipyrad.bins.muscle, "//")
-                print(cmd2, file=proc.stdin)
-
-                ## read the stdout by line until splitter is reached
-                for line in iter(proc.stdout.readline, "//\n"):
-                    align2 += line
-
-                ## join the aligned read1 and read2 and ensure name order match
-                la1 = align1[1:].split("\n>")
-                la2 = align2[1:].split("\n>")
-                dalign1 = dict([i.split("\n", 1) for i in la1])
-                dalign2 = dict([i.split("\n", 1) for i in la2])
-                keys = sorted(dalign1.keys(), key=DEREP)
-                keys2 = sorted(dalign2.keys(), key=DEREP)
-
-                ## Make sure R1 and R2 actually exist for each sample. If not
-                ## bail out of this cluster.
-                if not len(keys) == len(keys2):
-                    LOGGER.error("R1 and R2 results differ in length: "\
-                                    + "\nR1 - {}\nR2 - {}".format(keys, keys2))
-                    continue
+            ## collapse identical seqs so that each is only aligned once
+            allnames = names
+            seqs, uidxs = collapse_identical(seqs)
+            names = [allnames[uidxs.index(i)] for i in xrange(len(seqs))]
 
-                ## impute allele (lowercase) info back into alignments
-                for kidx, key in enumerate(keys):
-                    concatseq = dalign1[key].replace("\n", "")+\
-                                "nnnn"+dalign2[key].replace("\n", "")
-
-                    ## impute alleles
-                    if save_alleles:
-                        newmask = np.zeros(len(concatseq), dtype=np.bool_)                        
-                        ## check for indels and impute to amask
-                        indidx = np.where(np.array(list(concatseq)) == "-")[0]
-                        if indidx.size:
-                            allrows = np.arange(amask.shape[1])
-                            mask = np.ones(allrows.shape[0], dtype=np.bool_)
-                            for idx in indidx:
-                                if idx < mask.shape[0]:
-                                    mask[idx] = False
-                            not_idx = allrows[mask == 1]
-                            ## fill in new data into all other spots
-                            newmask[not_idx] = amask[kidx, :not_idx.shape[0]]
-                        else:
-                            newmask = amask[kidx]
-                        
-                        ## lower the alleles
-                        concatarr = np.array(list(concatseq))
-                        concatarr[newmask] = np.char.lower(concatarr[newmask])
-                        concatseq = concatarr.tostring()
-                        #LOGGER.info(concatseq)
+            ## clusters that are identical but for Ns need no gaps, skip
+            ## the aligner
+            if not needs_alignment(seqs):
+                aligned = ["{}\n{}".format(i[1:], j) for i, j in zip(names, seqs)]
+                keys = [i[1:] for i in names]
+
+            else:
+                try:
+                    ## try to split names on nnnn splitter
+                    clust1, clust2 = zip(*[i.split("nnnn") for i in seqs])
+
+                    ## make back into strings
+                    cl1 = "\n".join(itertools.chain(*zip(names, clust1)))
+                    cl2 = "\n".join(itertools.chain(*zip(names, clust2)))
+
+                    ## store allele (lowercase) info
+                    shape = (len(seqs), max([len(i) for i in seqs]))
+                    arrseqs = np.zeros(shape, dtype="S1")
+                    for row in range(arrseqs.shape[0]):
+                        seqsrow = seqs[row]
+                        arrseqs[row, :len(seqsrow)] = list(seqsrow)
+                    amask = np.char.islower(arrseqs)
+                    save_alleles = np.any(amask)
+
+                    ## send align1 to the bash shell
+                    ## TODO: check for pipe-overflow here and use files for i/o                
+                    cmd1 = "echo -e '{}' | {} -quiet -in - ; echo {}"\
+                           .format(cl1, ipyrad.bins.muscle, "//")
+                    print(cmd1, file=proc.stdin)
+
+                    ## read the stdout by line until splitter is reached
+                    for line in iter(proc.stdout.readline, "//\n"):
+                        align1 += line
+
+                    ## send align2 to the bash shell
+                    ## TODO: check for pipe-overflow here and use files for i/o                
+                    cmd2 = "echo -e '{}' | {} -quiet -in - ; echo {}"\
+                           .format(cl2, ipyrad.bins.muscle, "//")
+                    print(cmd2, file=proc.stdin)
+
+                    ## read the stdout by line until splitter is reached
+                    for line in iter(proc.stdout.readline, "//\n"):
+                        align2 += line
+
+                    ## join the aligned read1 and read2 and ensure name order match
+                    la1 = align1[1:].split("\n>")
+                    la2 = align2[1:].split("\n>")
+                    dalign1 = dict([i.split("\n", 1) for i in la1])
+                    dalign2 = dict([i.split("\n", 1) for i in la2])
+                    keys = sorted(dalign1.keys(), key=DEREP)
+                    keys2 = sorted(dalign2.keys(), key=DEREP)
+
+                    ## Make sure R1 and R2 actually exist for each sample. If not
+                    ## bail out of this cluster.
+                    if not len(keys) == len(keys2):
+                        LOGGER.error("R1 and R2 results differ in length: "\
+                                        + "\nR1 - {}\nR2 - {}".format(keys, keys2))
+                        continue
+
+                    ## impute allele (lowercase) info back into alignments
+                    for kidx, key in enumerate(keys):
+                        concatseq = dalign1[key].replace("\n", "")+\
+                                    "nnnn"+dalign2[key].replace("\n", "")
+
+                        ## impute alleles
+                        if save_alleles:
+                            newmask = np.zeros(len(concatseq), dtype=np.bool_)                        
+                            ## check for indels and impute to amask
+                            indidx = np.where(np.array(list(concatseq)) == "-")[0]
+                            if indidx.size:
+                                allrows = np.arange(amask.shape[1])
+                                mask = np.ones(allrows.shape[0], dtype=np.bool_)
+                                for idx in indidx:
+                                    if idx < mask.shape[0]:
+                                        mask[idx] = False
+                                not_idx = allrows[mask == 1]
+                                ## fill in new data into all other spots
+                                newmask[not_idx] = amask[kidx, :not_idx.shape[0]]
+                            else:
+                                newmask = amask[kidx]
                         
-                    ## fill list with aligned data
-                    aligned.append("{}\n{}".format(key, concatseq))
-
-                ## put into a dict for writing to file
-                #aligned = []
-                #for key in keys:
-                #    aligned.append("\n".join(
-                #        [key, 
-                #         dalign1[key].replace("\n", "")+"nnnn"+\
-                #         dalign2[key].replace("\n", "")]))
-            except IndexError as inst:
-                LOGGER.debug("Error in PE - ldx: {}".format())
-                LOGGER.debug("Vars: {}".format(dict(globals(), **locals())))
-                raise
-
-            except ValueError:
-                ## make back into strings
-                cl1 = "\n".join(["\n".join(i) for i in zip(names, seqs)])                
-
-                ## store allele (lowercase) info
-                shape = (len(seqs), max([len(i) for i in seqs]))
-                arrseqs = np.zeros(shape, dtype="S1")
-                for row in range(arrseqs.shape[0]):
-                    seqsrow = seqs[row]
-                    arrseqs[row, :len(seqsrow)] = list(seqsrow)
-                amask = np.char.islower(arrseqs)
-                save_alleles = np.any(amask)
-
-                ## send align1 to the bash shell (TODO: check for pipe-overflow)
-                cmd1 = "echo -e '{}' | {} -quiet -in - ; echo {}"\
-                       .format(cl1, ipyrad.bins.muscle, "//")
-                print(cmd1, file=proc.stdin)
-
-                ## read the stdout by line until splitter is reached
-                for line in iter(proc.stdout.readline, "//\n"):
-                    align1 += line
-
-                ## ensure name order match
-                la1 = align1[1:].split("\n>")
-                dalign1 = dict([i.split("\n", 1) for i in la1])
-                keys = sorted(dalign1.keys(), key=DEREP)
-
-                ## put into dict for writing to file
-                for kidx, key in enumerate(keys):
-                    concatseq = dalign1[key].replace("\n", "")
-                    ## impute alleles
-                    if save_alleles:
-                        newmask = np.zeros(len(concatseq), dtype=np.bool_)                        
-                        ## check for indels and impute to amask
-                        indidx = np.where(np.array(list(concatseq)) == "-")[0]
-                        if indidx.size:
-                            allrows = np.arange(amask.shape[1])
-                            mask = np.ones(allrows.shape[0], dtype=np.bool_)
-                            for idx in indidx:
-                                if idx < mask.shape[0]:
-                                    mask[idx] = False
-                            not_idx = allrows[mask == 1]
-                            ## fill in new data into all other spots
-                            newmask[not_idx] = amask[kidx, :not_idx.shape[0]]
-                        else:
-                            newmask = amask[kidx]
+                            ## lower the alleles
+                            concatarr = np.array(list(concatseq))
+                            concatarr[newmask] = np.char.lower(concatarr[newmask])
+                            concatseq = concatarr.tostring()
+                            #LOGGER.info(concatseq)
                         
-                        ## lower the alleles
-                        concatarr = np.array(list(concatseq))
-                        concatarr[newmask] = np.char.lower(concatarr[newmask])
-                        concatseq = concatarr.tostring()
+                        ## fill list with aligned data
+                        aligned.append("{}\n{}".format(key, concatseq))
+
+                    ## put into a dict for writing to file
+                    #aligned = []
+                    #for key in keys:
+                    #    aligned.append("\n".join(
+                    #        [key, 
+                    #         dalign1[key].replace("\n", "")+"nnnn"+\
+                    #         dalign2[key].replace("\n", "")]))
+                except IndexError as inst:
+                    LOGGER.debug("Error in PE - ldx: {}".format())
+                    LOGGER.debug("Vars: {}".format(dict(globals(), **locals())))
+                    raise
 
-                    ## fill list with aligned data
-                    aligned.append("{}\n{}".format(key, concatseq))
-                ## put aligned locus in list
-                #aligned.append("\n".join(inner_aligned))
+                except ValueError:
+                    ## make back into strings
+                    cl1 = "\n".join(["\n".join(i) for i in zip(names, seqs)])                
+
+                    ## store allele (lowercase) info
+                    shape = (len(seqs), max([len(i) for i in seqs]))
+                    arrseqs = np.zeros(shape, dtype="S1")
+                    for row in range(arrseqs.shape[0]):
+                        seqsrow = seqs[row]
+                        arrseqs[row, :len(seqsrow)] = list(seqsrow)
+                    amask = np.char.islower(arrseqs)
+                    save_alleles = np.any(amask)
+
+                    ## send align1 to the bash shell (TODO: check for pipe-overflow)
+                    cmd1 = "echo -e '{}' | {} -quiet -in - ; echo {}"\
+                           .format(cl1, ipyrad.bins.muscle, "//")
+                    print(cmd1, file=proc.stdin)
+
+                    ## read the stdout by line until splitter is reached
+                    for line in iter(proc.stdout.readline, "//\n"):
+                        align1 += line
+
+                    ## ensure name order match
+                    la1 = align1[1:].split("\n>")
+                    dalign1 = dict([i.split("\n", 1) for i in la1])
+                    keys = sorted(dalign1.keys(), key=DEREP)
+
+                    ## put into dict for writing to file
+                    for kidx, key in enumerate(keys):
+                        concatseq = dalign1[key].replace("\n", "")
+                        ## impute alleles
+                        if save_alleles:
+                            newmask = np.zeros(len(concatseq), dtype=np.bool_)                        
+                            ## check for indels and impute to amask
+                            indidx = np.where(np.array(list(concatseq)) == "-")[0]
+                            if indidx.size:
+                                allrows = np.arange(amask.shape[1])
+                                mask = np.ones(allrows.shape[0], dtype=np.bool_)
+                                for idx in indidx:
+                                    if idx < mask.shape[0]:
+                                        mask[idx] = False
+                                not_idx = allrows[mask == 1]
+                                ## fill in new data into all other spots
+                                newmask[not_idx] = amask[kidx, :not_idx.shape[0]]
+                            else:
+                                newmask = amask[kidx]
+                        
+                            ## lower the alleles
+                            concatarr = np.array(list(concatseq))
+                            concatarr[newmask] = np.char.lower(concatarr[newmask])
+                            concatseq = concatarr.tostring()
+
+                        ## fill list with aligned data
+                        aligned.append("{}\n{}".format(key, concatseq))
+                    ## put aligned locus in list
+                    #aligned.append("\n".join(inner_aligned))
+
+            ## expand unique alignments back to every member of the cluster
+            if len(allnames) > len(names):
+                useqs = [i.split("\n", 1)[1] for i in aligned]
+                keys = [i[1:] for i in allnames]
+                aligned = ["{}\n{}".format(i, useqs[j]) for i, j in zip(keys, uidxs)]
 
             ## enforce maxlen on aligned seqs
             aseqs = np.vstack([list(i.split("\n")[1]) for i in aligned])
@@ -291,6 +312,47 @@ def persistent_popen_align3(data, samples, chunk):
 DEREP = lambda x: int(x.split(";")[-1][1:])
 
 
+
+def collapse_identical(seqs):
+    """
+    Returns the unique seqs of a cluster in order of first appearance, and
+    the index of the unique seq for each input seq.
+    """
+    useqs = []
+    seen = {}
+    uidxs = []
+    for seq in seqs:
+        if seq not in seen:
+            seen[seq] = len(useqs)
+            useqs.append(seq)
+        uidxs.append(seen[seq])
+    return useqs, uidxs
+
+
+
+def needs_alignment(seqs):
+    """
+    Returns False only if seqs can be stacked without inserting any gaps,
+    which is when they are all the same length, have the nnnn splitter of 
+    paired data at the same position, and are identical at every site 
+    where both have a base (not N). A mismatch count cannot rule out an 
+    indel, e.g., a shifted tail of a few bases past an indel near the 3' end
+    looks like a few snps, so any cluster with a difference is aligned.
+    """
+    if len(seqs) < 2:
+        return False
+    if len(set(len(i) for i in seqs)) > 1:
+        return True
+    if len(set(i.find("nnnn") for i in seqs)) > 1:
+        return True
+
+    ## differences to the seed at sites where both have a base
+    arr = np.array([list(i.upper()) for i in seqs])
+    known = (arr != "N") & (arr[0] != "N")
+    return bool(np.any((arr != arr[0]) & known))
+
+
+
 def multi_muscle_align(data, samples, ipyclient):
     """
     Sends the cluster bits to nprocessors for muscle alignment. They return
@@ -402,7 +464,7 @@ def build_indels(data, samples, ipyclient):
     ## they exist. 
     snames = [i.name for i in samples]
     snames.sort()
-    smpios = [os.path.join(data.dirs.across, i+'.tmp.h5') for i in snames]
+    smpios = [get_smpio(data, i) for i in snames]
     for smpio in smpios:
         if os.path.exists(smpio):
             os.remove(smpio)
@@ -465,14 +527,11 @@ def sub_build_indels(data, samples):
 
 
 
-def call_cluster(data, noreverse, ipyclient):
+def get_hosts(ipyclient):
     """
-    distributes 'cluster()' function to an ipyclient to make sure it runs
-    on a high memory node. 
+    Returns a list of (hostname, [engine ids]) sorted by the number of
+    engines on each host, largest first. Skips busy engines.
     """
-    ## Find host with the most engines, for now just using first.
-    lbview = ipyclient.load_balanced_view()
-
     ## request engine data, skips busy engines.    
     asyncs = {}
     for eid in ipyclient.ids:
@@ -492,7 +551,22 @@ def call_cluster(data, noreverse, ipyclient):
             results[hostname] = [eid] 
 
     ## which is largest
-    hosts = sorted(results.items(), key=lambda x: len(x[1]), reverse=True)
+    return sorted(results.items(), key=lambda x: len(x[1]), reverse=True)
+
+
+
+def call_cluster(data, noreverse, ipyclient):
+    """
+    distributes 'cluster()' function to an ipyclient to make sure it runs
+    on a high memory node. 
+    """
+    ## split clustering across hosts if shards are requested
+    if data._hackersonly["cluster_across_shards"] > 1:
+        call_cluster_sharded(data, noreverse, ipyclient)
+        return
+
+    ## Find host with the most engines, for now just using first.
+    hosts = get_hosts(ipyclient)
     _, eids = hosts[0]
     bighost = ipyclient[eids[0]]
 
@@ -538,18 +612,10 @@ def call_cluster(data, noreverse, ipyclient):
 
 
 
-def cluster(data, noreverse, nthreads):
+def get_vsearch_params(data):
     """
-    Calls vsearch for clustering across samples.
+    Returns the (strand, query_cov) vsearch parameters for this datatype.
     """
-
-    ## input and output file handles
-    cathaplos = os.path.join(data.dirs.across, data.name+"_catshuf.tmp")
-    uhaplos = os.path.join(data.dirs.across, data.name+".utemp")
-    hhaplos = os.path.join(data.dirs.across, data.name+".htemp")
-    logfile = os.path.join(data.dirs.across, "s6_cluster_stats.txt")
-
-    ## parameters that vary by datatype
     ## (too low of cov values yield too many poor alignments)
     strand = "plus"
     cov = 0.75    ##0.90
@@ -559,6 +625,28 @@ def cluster(data, noreverse, nthreads):
     elif data.paramsdict["datatype"] == "pairgbs":
         strand = "both"
         cov = 0.75   ##0.90
+    return strand, cov
+
+
+
+def cluster(data, noreverse, nthreads, handles=None):
+    """
+    Calls vsearch for clustering across samples. Input and output files can
+    be set with handles=(cathaplos, uhaplos, hhaplos, logfile), which is used
+    to cluster shards of the input file in 'call_cluster_sharded()'.
+    """
+
+    ## input and output file handles
+    if handles:
+        cathaplos, uhaplos, hhaplos, logfile = handles
+    else:
+        cathaplos = os.path.join(data.dirs.across, data.name+"_catshuf.tmp")
+        uhaplos = os.path.join(data.dirs.across, data.name+".utemp")
+        hhaplos = os.path.join(data.dirs.across, data.name+".htemp")
+        logfile = os.path.join(data.dirs.across, "s6_cluster_stats.txt")
+
+    ## parameters that vary by datatype
+    strand, cov = get_vsearch_params(data)
 
     ## nthreads is calculated in 'call_cluster()'
     cmd = [ipyrad.bins.vsearch,
@@ -639,7 +727,366 @@ def cluster(data, noreverse, nthreads):
 
 
 
-def build_h5_array(data, samples, nloci):
+def shard_handles(data, shard):
+    """
+    Returns the (input, utemp, htemp, log) file handles for a cluster shard.
+    """
+    prefix = os.path.join(data.dirs.across, "{}_shard{}".format(data.name, shard))
+    return (prefix+"_cat.tmp", prefix+"_utemp.tmp",
+            prefix+"_htemp.tmp", prefix+"_log.tmp")
+
+
+
+def call_cluster_sharded(data, noreverse, ipyclient):
+    """
+    Splits the input file into shards by minimizer signature and clusters 
+    each shard with vsearch on a different host. Seeds from all shards are
+    then clustered in a final small pass on the largest host to merge 
+    clusters that were split across shards.
+    """
+    nshards = int(data._hackersonly["cluster_across_shards"])
+    hosts = get_hosts(ipyclient)
+    _, eids = hosts[0]
+    bighost = ipyclient[eids[0]]
+
+    ## track progress
+    start = time.time()
+    printstr = " clustering across     | {} | s6 |"
+    elapsed = datetime.timedelta(seconds=int(time.time() - start))
+    progressbar(nshards + 2, 0, printstr.format(elapsed), spacer=data._spacer)
+
+    ## partition the input file into shards 
+    async = bighost.apply(shard_catshuf, *(data, nshards))
+    while not async.ready():
+        time.sleep(0.5)
+    if not async.successful():
+        raise IPyradWarningExit(async.result())
+    counts = async.result()
+
+    ## distribute shards round-robin across hosts, splitting each host's 
+    ## threads among the shards that land on it.
+    jobs = {}
+    nhosts = len(hosts)
+    for shard in xrange(nshards):
+        if not counts[shard]:
+            continue
+        _, heids = hosts[shard % nhosts]
+        onhost = len(xrange(shard % nhosts, nshards, nhosts))
+        engine = ipyclient[heids[(shard // nhosts) % len(heids)]]
+        nthreads = max(1, len(heids) // onhost)
+        args = (data, noreverse, nthreads, shard_handles(data, shard))
+        jobs[shard] = engine.apply(cluster, *args)
+
+    while 1:
+        done = sum([i.ready() for i in jobs.values()])
+        elapsed = datetime.timedelta(seconds=int(time.time() - start))
+        progressbar(nshards + 2, done + 1, printstr.format(elapsed), 
+                    spacer=data._spacer)
+        if done == len(jobs):
+            break
+        else:
+            time.sleep(0.5)
+
+    for job in jobs.values():
+        if not job.successful():
+            raise IPyradWarningExit(job.result())
+
+    ## reconcile seeds across shards on the largest host
+    nthreads = min(len(eids), max(data._ipcluster["threads"], 10))
+    async = bighost.apply(reconcile_shards, *(data, noreverse, nthreads, nshards))
+    while not async.ready():
+        time.sleep(0.5)
+    elapsed = datetime.timedelta(seconds=int(time.time() - start))
+    progressbar(nshards + 2, nshards + 2, printstr.format(elapsed), 
+                spacer=data._spacer)
+    print("")
+    if not async.successful():
+        raise IPyradWarningExit(async.result())
+
+    data.stats_files.s6 = os.path.join(data.dirs.across, "s6_cluster_stats.txt")
+
+
+
+def shard_catshuf(data, nshards):
+    """
+    Splits the _catshuf file into nshards files by the minimizer of each 
+    read. Reads keep their (length-sorted) order within each shard. Returns
+    the number of reads in each shard.
+    """
+    kmer = 12
+    cathaplos = os.path.join(data.dirs.across, data.name+"_catshuf.tmp")
+    outs = [open(shard_handles(data, i)[0], 'w') for i in xrange(nshards)]
+    counts = [0] * nshards
+
+    with open(cathaplos, 'r') as indat:
+        pairs = itertools.izip(*[iter(indat)]*2)
+        while 1:
+            chunk = list(itertools.islice(pairs, 10000))
+            if not chunk:
+                break
+            bits = [[] for i in xrange(nshards)]
+            for name, seq in chunk:
+                arr = np.frombuffer(seq.strip(), dtype=np.uint8)
+                shard = get_minimizer(arr, kmer) % nshards
+                bits[shard].append(name+seq)
+                counts[shard] += 1
+            for shard in xrange(nshards):
+                outs[shard].write("".join(bits[shard]))
+
+    for out in outs:
+        out.close()
+    return counts
+
+
+
+@numba.jit(nopython=True)
+def get_minimizer(seq, kmer):
+    """
+    Returns the smallest hash of the canonical kmers (min of the kmer and its
+    revcomp) in a uint8 encoded sequence. Kmers spanning non-ACGT bases are
+    skipped. Canonical kmers send reads and their revcomps to the same shard.
+    """
+    shift = 2 * (kmer - 1)
+    mask = (1 << (2 * kmer)) - 1
+    fwd = 0
+    rev = 0
+    klen = 0
+    best = 0
+    found = 0
+    for idx in xrange(seq.shape[0]):
+        base = seq[idx]
+        if base == 65:
+            code = 0
+        elif base == 67:
+            code = 1
+        elif base == 71:
+            code = 2
+        elif base == 84:
+            code = 3
+        else:
+            klen = 0
+            continue
+        fwd = ((fwd << 2) | code) & mask
+        rev = (rev >> 2) | ((3 - code) << shift)
+        klen += 1
+        if klen >= kmer:
+            ## multiplicative hash, kmer <= 12 keeps this in int64
+            hval = ((min(fwd, rev) * 2654435761) >> 8) & 0xFFFFFFF
+            if (not found) or (hval < best):
+                best = hval
+                found = 1
+    return best
+
+
+
+def reconcile_shards(data, noreverse, nthreads, nshards):
+    """
+    Clusters the seeds of all shards in a final vsearch pass and remaps hits
+    of shard seeds that were merged onto their final seed. Writes the final
+    .utemp and .htemp files as if the data were clustered in one pass.
+    """
+    cathaplos = os.path.join(data.dirs.across, data.name+"_catshuf.tmp")
+    catseeds = os.path.join(data.dirs.across, data.name+"_catseeds.tmp")
+    seedutemp = os.path.join(data.dirs.across, data.name+"_seedutemp.tmp")
+    uhaplos = os.path.join(data.dirs.across, data.name+".utemp")
+    hhaplos = os.path.join(data.dirs.across, data.name+".htemp")
+    seedlog = os.path.join(data.dirs.across, data.name+"_seedlog.tmp")
+    logfile = os.path.join(data.dirs.across, "s6_cluster_stats.txt")
+
+    ## seeds of each shard are the reads that did not match a seed
+    seeds = set()
+    for shard in xrange(nshards):
+        hshard = shard_handles(data, shard)[2]
+        if os.path.exists(hshard):
+            with open(hshard, 'r') as indat:
+                for line in indat:
+                    if line[0] == ">":
+                        seeds.add(line[1:].strip())
+
+    ## write seeds in the same (length-sorted) order as the input file
+    with open(cathaplos, 'r') as indat, open(catseeds, 'w') as out:
+        pairs = itertools.izip(*[iter(indat)]*2)
+        while 1:
+            chunk = list(itertools.islice(pairs, 10000))
+            if not chunk:
+                break
+            out.write("".join([name+seq for name, seq in chunk \
+                      if name[1:].strip() in seeds]))
+    del seeds
+
+    ## cluster the seeds
+    cluster(data, noreverse, nthreads, (catseeds, seedutemp, hhaplos, seedlog))
+
+    ## the stats file is the vsearch log of each shard and of the seed pass
+    with open(logfile, 'w') as out:
+        for shard in xrange(nshards):
+            lshard = shard_handles(data, shard)[3]
+            if os.path.exists(lshard):
+                out.write("## shard {}\n".format(shard))
+                with open(lshard, 'r') as indat:
+                    out.write(indat.read())
+        out.write("## seed reconciliation\n")
+        with open(seedlog, 'r') as indat:
+            out.write(indat.read())
+
+    ## shard seeds that matched another seed: {seed: (newseed, strand)}
+    merged = {}
+    with open(seedutemp, 'r') as indat:
+        for line in indat:
+            hit, seed, ori = line.split()
+            merged[hit] = (seed, ori)
+
+    ## write final utemp. A hit on the reverse strand of a seed that was 
+    ## itself matched on the reverse strand is on the forward strand.
+    with open(uhaplos, 'w') as out:
+        with open(seedutemp, 'r') as indat:
+            out.write(indat.read())
+        for shard in xrange(nshards):
+            ushard = shard_handles(data, shard)[1]
+            if not os.path.exists(ushard):
+                continue
+            with open(ushard, 'r') as indat:
+                while 1:
+                    lines = list(itertools.islice(indat, 100000))
+                    if not lines:
+                        break
+                    bits = []
+                    for line in lines:
+                        hit, seed, ori = line.split()
+                        if seed in merged:
+                            seed, sori = merged[seed]
+                            ori = "+" if ori == sori else "-"
+                        bits.append("{}\t{}\t{}\n".format(hit, seed, ori))
+                    out.write("".join(bits))
+
+    ## cleanup shard files
+    for tmp in glob.glob(os.path.join(data.dirs.across, data.name+"_shard*.tmp")):
+        os.remove(tmp)
+    for tmp in [catseeds, seedutemp, seedlog]:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+
+def use_refmerge(data):
+    """
+    Reference assemblies can merge loci across samples by their mapped
+    coordinates instead of clustering them with vsearch.
+    """
+    return data.paramsdict["assembly_method"] == "reference" and \
+           bool(data._hackersonly["ref_merge_across"])
+
+
+
+def call_refmerge(data, samples, ipyclient):
+    """
+    Distributes 'refmerge()' to an engine and tracks progress. This replaces
+    'call_cluster()' for reference assemblies (substep 2).
+    """
+    lbview = ipyclient.load_balanced_view()
+    start = time.time()
+    printstr = " merging across        | {} | s6 |"
+    async = lbview.apply(refmerge, *(data, samples))
+
+    while 1:
+        ready = int(async.ready())
+        elapsed = datetime.timedelta(seconds=int(time.time() - start))
+        progressbar(1, ready, printstr.format(elapsed), spacer=data._spacer)
+        if ready:
+            break
+        else:
+            time.sleep(0.5)
+    print("")
+
+    if not async.successful():
+        raise IPyradWarningExit(async.result())
+    data.stats_files.s6 = os.path.join(data.dirs.across, "s6_cluster_stats.txt")
+
+
+
+def refmerge(data, samples):
+    """
+    Groups the consens reads of all samples by overlap of their reference
+    coordinates. The sorted interval index of each sample (built in step 5)
+    is stacked and swept once in (chrom, start) order. Results are written
+    in the same (hit, seed, strand) format as the vsearch .utemp file so that
+    the remaining substeps (align, index, database) are unchanged.
+    """
+    uhaplos = os.path.join(data.dirs.across, data.name+".utemp")
+    logfile = os.path.join(data.dirs.across, "s6_cluster_stats.txt")
+
+    ## stack (chrom, start, end, sidx, row) for all mapped consens reads
+    samples.sort(key=lambda x: x.name)
+    snames = np.array([i.name for i in samples])
+    stack = []
+    for sidx, sample in enumerate(samples):
+        chroms, refidx, _ = load_refindex(sample.files.database)
+        arr = np.zeros((refidx.shape[0], 5), dtype=np.int64)
+        arr[:, :3] = chroms[refidx]
+        arr[:, 3] = sidx
+        arr[:, 4] = refidx
+        stack.append(arr)
+    stack = np.concatenate(stack)
+    order = np.lexsort((stack[:, 2], stack[:, 1], stack[:, 0]))
+    stack = stack[order]
+    del order
+
+    ## assign a group to every interval and find the seed of each group
+    groups = sweep_intervals(stack[:, 0], stack[:, 1], stack[:, 2])
+    isseed = np.ones(groups.shape[0], dtype=np.bool_)
+    isseed[1:] = groups[1:] != groups[:-1]
+    seedidx = np.where(isseed)[0]
+    gsizes = np.diff(np.append(seedidx, groups.shape[0]))
+
+    ## write hits of groups with >1 member. Singletons are not retained,
+    ## just like seeds with no hits from vsearch.
+    hits = np.where(~isseed)[0]
+    seeds = seedidx[groups[hits]]
+    with open(uhaplos, 'w') as out:
+        for block in xrange(0, hits.shape[0], 100000):
+            hblock = hits[block:block+100000]
+            sblock = seeds[block:block+100000]
+            out.write("".join(["{}_{}\t{}_{}\t+\n".format(
+                snames[stack[hit, 3]], stack[hit, 4],
+                snames[stack[seed, 3]], stack[seed, 4])
+                for hit, seed in zip(hblock, sblock)]))
+
+    ## record a short summary in place of the vsearch log
+    with open(logfile, 'w') as out:
+        out.write("Loci merged by reference position\n")
+        out.write("Mapped consens reads: {}\n".format(stack.shape[0]))
+        out.write("Clusters: {}\n".format(seedidx.shape[0]))
+        out.write("Clusters with >1 read: {}\n".format(np.sum(gsizes > 1)))
+        out.write("Singletons: {}\n".format(np.sum(gsizes == 1)))
+    data.stats_files.s6 = logfile
+
+
+
+@numba.jit(nopython=True)
+def sweep_intervals(chrom, start, end):
+    """
+    Returns a group index for each interval in (chrom, start) sorted order.
+    An interval joins the current group if it overlaps the group's seed
+    (its first interval), otherwise it seeds a new group. Anchoring to the
+    seed keeps chains of overlapping reads from growing into long loci.
+    """
+    groups = np.zeros(chrom.shape[0], dtype=np.int64)
+    if not chrom.shape[0]:
+        return groups
+    gidx = 0
+    schrom = chrom[0]
+    send = end[0]
+    for idx in xrange(1, chrom.shape[0]):
+        if (chrom[idx] != schrom) or (start[idx] >= send):
+            gidx += 1
+            schrom = chrom[idx]
+            send = end[idx]
+        groups[idx] = gidx
+    return groups
+
+
+
+def build_h5_array(data, samples, nloci, ipyclient=None):
     """
     Sets up all of the h5 arrays that we will fill. 
     The catg array of prefiltered loci  is 4-dimensional (Big), so one big 
@@ -650,6 +1097,13 @@ def build_h5_array(data, samples, nloci):
     ## sort to ensure samples will be in alphabetical order, tho they should be.
     samples.sort(key=lambda x: x.name)
 
+    ## check the chunk tuning option before anything is written
+    autotune = data._hackersonly["chunk_autotune"]
+    if autotune not in ["off", "auto", "benchmark"]:
+        raise IPyradWarningExit(
+            "chunk_autotune must be 'off', 'auto' or 'benchmark', not {}"\
+            .format(autotune))
+
     ## get maxlen dim
     maxlen = data._hackersonly["max_fragment_length"] + 20
     LOGGER.info("maxlen inside build_h5_array is %s", maxlen)
@@ -670,6 +1124,12 @@ def build_h5_array(data, samples, nloci):
     while chunklen > int(500e6):
         chunks = (chunks // 2) + (chunks % 2)
         chunklen = chunks * len(samples) * maxlen * 4
+
+    ## or tune chunks and compression to the memory of each engine
+    comp = ("gzip", None)
+    if autotune != "off":
+        chunks, comp = autotune_chunks(data, nloci, len(samples), maxlen, 
+                                       ipyclient)
     LOGGER.info("chunks in build_h5_array: %s", chunks)
 
     data.chunks = chunks
@@ -677,44 +1137,181 @@ def build_h5_array(data, samples, nloci):
     LOGGER.info("chunks is %s", data.chunks)
 
     ## INIT FULL CATG ARRAY
-    ## store catgs with a .10 loci chunk size
-    supercatg = io5.create_dataset("catgs", (nloci, len(samples), maxlen, 4),
-                                    dtype=np.uint32,
-                                    chunks=(chunks, 1, maxlen, 4),
-                                    compression="gzip")
-    superseqs = io5.create_dataset("seqs", (nloci, len(samples), maxlen),
+    ## store catgs with a .10 loci chunk size. The loci and samples axes are
+    ## resizable so that new samples can be added later (see 'add_samples()')
+    ## With the virtual layout catgs and nalleles are instead mapped from the
+    ## singlecat files in 'build_virtual_catgs()', and with the sparse layout
+    ## catgs are written in 'build_sparse_catgs()'.
+    layout = get_catg_layout(data)
+    if layout == "dense":
+        supercatg = io5.create_dataset("catgs", 
+                                       (nloci, len(samples), maxlen, 4),
+                                       dtype=np.uint32,
+                                       chunks=(chunks, 1, maxlen, 4),
+                                       maxshape=(None, None, maxlen, 4),
+                                       compression=comp[0],
+                                       compression_opts=comp[1])
+        supercatg.attrs["chunksize"] = (chunks, 1, maxlen, 4)
+        supercatg.attrs["samples"] = [i.name for i in samples]
+    if layout != "virtual":
+        superalls = io5.create_dataset("nalleles", (nloci, len(samples)),
+                                       dtype=np.uint8,
+                                       chunks=(chunks, len(samples)),
+                                       maxshape=(None, None),
+                                       compression="gzip")
+        superalls.attrs["chunksize"] = (chunks, len(samples))
+        superalls.attrs["samples"] = [i.name for i in samples]
+    ## seqs are stored as |S1 or packed into 4-bit codes with the lowercase
+    ## allele phase in a separate bit array (see 'util.encode_seqs()')
+    if data._hackersonly["seqs_encoding"] == "nibble":
+        superseqs = io5.create_dataset("seqs", 
+                                    (nloci, len(samples), (maxlen+1) // 2),
+                                    dtype=np.uint8,
+                                    chunks=(chunks, len(samples), (maxlen+1) // 2),
+                                    maxshape=(None, None, (maxlen+1) // 2),
+                                    compression=comp[0],
+                                    compression_opts=comp[1])
+        superseqs.attrs["encoding"] = "nibble"
+        superseqs.attrs["maxlen"] = maxlen
+        io5.create_dataset("phase", (nloci, len(samples), (maxlen+7) // 8),
+                           dtype=np.uint8,
+                           chunks=(chunks, len(samples), (maxlen+7) // 8),
+                           maxshape=(None, None, (maxlen+7) // 8),
+                           compression='gzip')
+    else:
+        superseqs = io5.create_dataset("seqs", (nloci, len(samples), maxlen),
                                     dtype="|S1",
                                     #dtype=np.uint8,
                                     chunks=(chunks, len(samples), maxlen),
-                                    compression='gzip')
-    superalls = io5.create_dataset("nalleles", (nloci, len(samples)),
-                                    dtype=np.uint8,
-                                    chunks=(chunks, len(samples)),
-                                    compression="gzip")
+                                    maxshape=(None, None, maxlen),
+                                    compression=comp[0],
+                                    compression_opts=comp[1])
     superchroms = io5.create_dataset("chroms", (nloci, 3), 
                                      dtype=np.int64, 
                                      chunks=(chunks, 3),
+                                     maxshape=(None, 3),
                                      compression="gzip")
 
     ## allele count storage
-    supercatg.attrs["chunksize"] = (chunks, 1, maxlen, 4)
-    supercatg.attrs["samples"] = [i.name for i in samples]
     superseqs.attrs["chunksize"] = (chunks, len(samples), maxlen)
     superseqs.attrs["samples"] = [i.name for i in samples]
-    superalls.attrs["chunksize"] = (chunks, len(samples))
-    superalls.attrs["samples"] = [i.name for i in samples]
     superchroms.attrs["chunksize"] = (chunks, len(samples))
     superchroms.attrs["samples"] = [i.name for i in samples]
 
     ## array for pair splits locations, dup and ind filters
-    io5.create_dataset("splits", (nloci, ), dtype=np.uint16)
-    io5.create_dataset("duplicates", (nloci, ), dtype=np.bool_)
+    io5.create_dataset("splits", (nloci, ), dtype=np.uint16,
+                       chunks=(chunks, ), maxshape=(None, ))
+    io5.create_dataset("duplicates", (nloci, ), dtype=np.bool_,
+                       chunks=(chunks, ), maxshape=(None, ))
 
     ## close the big boy
     io5.close()
 
 
 
+def get_host_memory():
+    """ Returns the bytes of RAM of the host this is run on. """
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return int(4e9)
+
+
+
+def get_engine_memory(data, ipyclient):
+    """
+    Returns the bytes of RAM available to each engine. Memory is measured 
+    on one engine of each host and shared equally by the engines of that 
+    host, and the smallest share over hosts is returned. Without a client
+    the memory of this host is shared by data.cpus.
+    """
+    if ipyclient is None:
+        return get_host_memory() // max(1, data.cpus)
+
+    asyncs = []
+    for _, eids in get_hosts(ipyclient):
+        lbview = ipyclient.load_balanced_view(targets=[eids[0]])
+        asyncs.append((len(eids), lbview.apply(get_host_memory)))
+    return min([job.get() // neng for neng, job in asyncs])
+
+
+
+def autotune_chunks(data, nloci, nsamples, maxlen, ipyclient):
+    """
+    Returns (chunks, (compression, opts)) for the clust database. Step 7 
+    workers (site_stacks, vcfchunk, worker_make_arrays) each read one 
+    chunk of loci for all samples from catgs and seqs and expand it into 
+    several working arrays, so the chunk length is bounded by the memory of
+    an engine. Chunks are kept small enough that there are about 4 per cpu
+    for load balancing, but large enough that a catgs chunk (chunks, 1, 
+    maxlen, 4) is at least ~1MB, below which reads and compression suffer.
+    In 'benchmark' mode a few layouts around this size are timed.
+    """
+    ## ~bytes held by a step 7 worker for each locus: uint32 catgs (x4), 
+    ## seqs read and upper-cased, and int/bool working copies.
+    perlocus = nsamples * maxlen * 32
+    maxchunk = max(1, (get_engine_memory(data, ipyclient) // 2) // perlocus)
+    balance = max(1, nloci // (data.cpus * 4))
+    floor = max(1, int(1e6) // (maxlen * 16))
+    chunks = max(min(balance, maxchunk), min(floor, maxchunk))
+    chunks = max(1, min(chunks, nloci))
+    comp = ("gzip", 4)
+
+    if data._hackersonly["chunk_autotune"] == "benchmark":
+        candidates = []
+        for clen in set([max(1, chunks // 4), chunks, min(maxchunk, chunks * 4)]):
+            for cand in [("gzip", 4), ("gzip", 1), ("lzf", None)]:
+                candidates.append((clen, cand))
+        results = benchmark_chunks(data, nloci, nsamples, maxlen, candidates)
+        for res in results:
+            LOGGER.info("chunk benchmark: %s %s %s MB/s", *res)
+        chunks, comp, _ = max(results, key=lambda x: x[2])
+
+    LOGGER.info("autotuned chunks=%s compression=%s", chunks, comp)
+    return chunks, comp
+
+
+
+def benchmark_chunks(data, nloci, nsamples, maxlen, candidates, nreps=2,
+    maxbytes=int(64e6)):
+    """
+    Writes a synthetic catgs array (70% missing cells) with each candidate
+    (chunks, (compression, opts)) layout to the across dir and times reading
+    it back one chunk of loci at a time, as step 7 workers do. Each test 
+    file has the real chunk shape and holds up to 4 chunks of loci, but no
+    more loci than the database or than fit in maxbytes (at least one 
+    chunk). Returns a list of (chunks, compression, MB/s).
+    """
+    perlocus = nsamples * maxlen * 16
+    nrows = {}
+    for chunks, _ in candidates:
+        nrows[chunks] = min(nloci, max(chunks, min(4 * chunks, 
+                                                   maxbytes // perlocus)))
+    nbench = max(nrows.values())
+    arr = np.zeros((nbench, nsamples, maxlen, 4), dtype=np.uint32)
+    present = np.random.binomial(1, 0.3, (nbench, nsamples)).astype(np.bool_)
+    arr[present] = np.random.poisson(5, (present.sum(), maxlen, 4))
+
+    results = []
+    tmpfile = os.path.join(data.dirs.across, data.name+".benchmark.h5")
+    for chunks, comp in candidates:
+        barr = arr[:nrows[chunks]]
+        with h5py.File(tmpfile, 'w') as io5:
+            io5.create_dataset("catgs", data=barr,
+                               chunks=(chunks, 1, maxlen, 4),
+                               compression=comp[0], compression_opts=comp[1])
+        start = time.time()
+        for _ in xrange(nreps):
+            with h5py.File(tmpfile, 'r') as io5:
+                for init in xrange(0, barr.shape[0], chunks):
+                    io5["catgs"][init:init+chunks]
+        elapsed = max(1e-6, time.time() - start)
+        results.append((chunks, comp, (barr.nbytes * nreps / 1e6) / elapsed))
+        os.remove(tmpfile)
+    return results
+
+
+
 def fill_dups_arr(data):
     """
     fills the duplicates array from the multi_muscle_align tmp files
@@ -767,45 +1364,126 @@ def get_nloci(data):
 
 
 
-def get_seeds_and_hits(uhandle, bseeds, snames):
+def get_seeds_and_hits(uhandle, bseeds, snames, chunksize=2000000):
     """
     builds a seeds and hits (uarr) array of ints from the utemp.sort file.
-    Saves outputs to files ...
-    """
-    ## read in the utemp.sort file
-    updf = np.loadtxt(uhandle, dtype="S")
-
-    ## Get seeds for all matches from usort
-    seeds = np.unique(updf[:, 1])
-    seedsarr = np.column_stack([
-                    np.arange(len(seeds)),
-                   [i.rsplit("_", 1)[0] for i in seeds],
-                   [i.rsplit("_", 1)[1] for i in seeds]])
-    seedsarr[:, 1] = [snames.index(i) for i in seedsarr[:, 1]]
-    seedsarr = seedsarr.astype(np.int64)
-    LOGGER.info("got a seedsarr %s", seedsarr.shape)
-
-    ## Get matches from usort and create an array for fast entry
-    uarr = np.zeros((updf.shape[0], 3), dtype=np.int64)
-    idx = -1
-    lastloc = None
-    for ldx in xrange(updf.shape[0]):
-        tloc = updf[ldx, 1]
-        if tloc != lastloc:
-            idx += 1
-        uarr[ldx, 0] = idx
-        lastloc = tloc
-    ## create a column with sample index
-    uarr[:, 1] = [int(snames.index(i.rsplit("_", 1)[0])) for i in updf[:, 0]]
-    ## create a column with only consens index for sample
-    uarr[:, 2] = [int(i.rsplit("_", 1)[1]) for i in updf[:, 0]]
-    uarr = uarr.astype(np.int64)
-    LOGGER.info("got a uarr %s", uarr.shape)
-
-    ## save as h5 to we can grab by sample slices
-    with h5py.File(bseeds, 'w') as io5:
-        io5.create_dataset("seedsarr", data=seedsarr, dtype=np.int64)
-        io5.create_dataset("uarr", data=uarr, dtype=np.int64)
+    The file is parsed in chunks and appended to the seedsarr and uarr 
+    datasets in bseeds, so memory use depends on chunksize, not on nhits.
+    Locus ids follow the order of seeds in the sorted file, which is the 
+    same order in which clusters are written in 'sub_build_clustbits()'.
+    The seeds and hits of each chunk are also stored sorted by sample, in a
+    tmp file that is removed when done, so that 'build_sample_index()' can
+    group the rows of each sample.
+    """
+    nsamples = len(snames)
+    counts = []
+    tmpfile = os.path.splitext(bseeds)[0] + ".tmpfull.h5"
+    with h5py.File(bseeds, 'w') as io5, h5py.File(tmpfile, 'w') as tmp5:
+        seedsarr = io5.create_dataset("seedsarr", (0, 3), dtype=np.int64,
+                                      chunks=(min(chunksize, 100000), 3),
+                                      maxshape=(None, 3))
+        uarr = io5.create_dataset("uarr", (0, 3), dtype=np.int64,
+                                  chunks=(min(chunksize, 100000), 3),
+                                  maxshape=(None, 3))
+        tmpfull = tmp5.create_dataset("tmpfull", (0, 3), dtype=np.int64,
+                                      chunks=(min(chunksize, 100000), 3),
+                                      maxshape=(None, 3))
+
+        ## read the utemp.sort file in chunks, which is empty if no sample
+        ## had any hits.
+        if os.path.getsize(uhandle):
+            reader = pd.read_csv(uhandle, sep="\t", header=None, 
+                                 names=["hit", "seed", "ori"],
+                                 dtype={"hit": str, "seed": str, "ori": str},
+                                 chunksize=chunksize, engine="c")
+        else:
+            reader = []
+        lastseed = None
+        nloci = 0
+        for chunk in reader:
+            seeds = chunk["seed"].values
+            hits = chunk["hit"].values
+
+            ## locus ids from change-points in the seed column, carrying
+            ## over the last seed of the previous chunk.
+            newloc = np.ones(seeds.shape[0], dtype=np.bool_)
+            newloc[1:] = seeds[1:] != seeds[:-1]
+            newloc[0] = seeds[0] != lastseed
+            locs = np.cumsum(newloc) - 1 + nloci
+
+            ## (locus, sample index, consens index) for new seeds and hits
+            sarr = np.zeros((newloc.sum(), 3), dtype=np.int64)
+            sarr[:, 0] = locs[newloc]
+            sarr[:, 1:] = split_names(seeds[newloc], snames)
+            harr = np.zeros((hits.shape[0], 3), dtype=np.int64)
+            harr[:, 0] = locs
+            harr[:, 1:] = split_names(hits, snames)
+
+            ## seeds and hits of this chunk sorted by sample, then locus
+            farr = np.concatenate((sarr, harr))
+            farr = farr[np.lexsort((farr[:, 0], farr[:, 1]))]
+            counts.append(np.bincount(farr[:, 1], minlength=nsamples))
+
+            ## append to the h5 arrays
+            for dset, arr in [(seedsarr, sarr), (uarr, harr), (tmpfull, farr)]:
+                init = dset.shape[0]
+                dset.resize((init + arr.shape[0], 3))
+                dset[init:] = arr
+
+            nloci = locs[-1] + 1
+            lastseed = seeds[-1]
+        LOGGER.info("got a seedsarr %s", seedsarr.shape)
+        LOGGER.info("got a uarr %s", uarr.shape)
+
+        ## group the sorted chunks into one sample-sorted array
+        build_sample_index(io5, tmpfull, 
+                           np.array(counts).reshape(-1, nsamples))
+    os.remove(tmpfile)
+
+
+
+def build_sample_index(io5, tmpfull, counts):
+    """
+    Copies the rows of tmpfull, which is sorted by sample within each 
+    chunk, into a 'sampfull' array that is sorted by sample and then by 
+    locus, and stores the offset of each sample's rows in 'sampidx'. Rows 
+    of sample sidx are then sampfull[sampidx[sidx]:sampidx[sidx+1]]. 
+    counts is an (nchunks, nsamples) array of rows per sample in each chunk.
+    """
+    sampidx = np.zeros(counts.shape[1] + 1, dtype=np.int64)
+    sampidx[1:] = np.cumsum(counts.sum(axis=0))
+    sampfull = io5.create_dataset("sampfull", (tmpfull.shape[0], 3), 
+                                  dtype=np.int64, 
+                                  chunks=tmpfull.chunks,
+                                  maxshape=(None, 3))
+    io5.create_dataset("sampidx", data=sampidx)
+
+    ## copy each chunk's sample slices into the sample regions
+    ptrs = sampidx[:-1].copy()
+    init = 0
+    for ccounts in counts:
+        end = init + ccounts.sum()
+        farr = tmpfull[init:end]
+        cidx = 0
+        for sidx in np.where(ccounts)[0]:
+            nrows = ccounts[sidx]
+            sampfull[ptrs[sidx]:ptrs[sidx]+nrows] = farr[cidx:cidx+nrows]
+            ptrs[sidx] += nrows
+            cidx += nrows
+        init = end
+
+
+
+def split_names(names, snames):
+    """
+    Splits an array of consens read names ({sample}_{index}) into an int 
+    array of (sample index in snames, consens index).
+    """
+    parts = np.char.rpartition(np.asarray(names, dtype=str), "_")
+    sidx = pd.Categorical(parts[:, 0], categories=snames).codes
+    if np.any(sidx < 0):
+        raise IPyradWarningExit("sample names in clusters not in Assembly")
+    return np.column_stack([sidx, parts[:, 2].astype(np.int64)])
 
 
 
@@ -823,7 +1501,7 @@ def new_multicat(data, samples, ipyclient):
     ## Build the large h5 array. This will write a new HDF5 file and overwrite
     ## existing data. 
     nloci = get_nloci(data)
-    build_h5_array(data, samples, nloci)
+    build_h5_array(data, samples, nloci, ipyclient)
 
     ## parallel client (reserve engine 0 for data entry), if/else here in case
     ## user has only one engine.
@@ -856,7 +1534,11 @@ def new_multicat(data, samples, ipyclient):
     ## large array yet.
     snames = [i.name for i in samples]
     snames.sort()
-    smpios = {i:os.path.join(data.dirs.across, i+'.tmp.h5') for i in snames}
+    smpios = {i:get_smpio(data, i) for i in snames}
+    isref = 'reference' in data.paramsdict["assembly_method"]
+    catgstore = os.path.join(data.dirs.across, data.name+"_catgs")
+    if get_catg_layout(data) == "virtual" and not os.path.exists(catgstore):
+        os.mkdir(catgstore)
 
     ## send 'singlecat()' jobs to engines
     bseeds = os.path.join(data.dirs.across, data.name+".tmparrs.h5")
@@ -871,8 +1553,15 @@ def new_multicat(data, samples, ipyclient):
         if not os.path.exists(smpios[sample.name]):
             jobs[sample.name] = smallview.apply(singlecat, *args)
 
+        ## reference positions of finished files still need to be folded
+        elif isref:
+            with filler.temp_flags(after=cleanups[last_sample]):
+                last_sample = sample.name+"_chroms"
+                cleanups[last_sample] = filler.apply(fold_chroms, *(data, sample))
+
     ## track progress of singlecat jobs and submit writing jobs for finished
     ## singlecat files (.tmp.h5).
+    layout = get_catg_layout(data)
     alljobs = len(jobs)
     while 1:
         ## check for finished jobs
@@ -881,6 +1570,17 @@ def new_multicat(data, samples, ipyclient):
             async = jobs[key]
             if async.ready():
                 if async.successful():
+                    ## fold the sample's reference positions into chroms
+                    if isref:
+                        with filler.temp_flags(after=cleanups[last_sample]):
+                            last_sample = key+"_chroms"
+                            cleanups[last_sample] = filler.apply(
+                                fold_chroms, *(data, data.samples[key]))
+
+                    ## other layouts are built once all samples are finished
+                    if layout != "dense":
+                        del jobs[key]
+                        continue
                     ## submit cleanup for finished job
                     args = (data, data.samples[key], snames.index(key))
                     with filler.temp_flags(after=cleanups[last_sample]):
@@ -898,10 +1598,20 @@ def new_multicat(data, samples, ipyclient):
         if not jobs:
             break        
 
-    ## add the dask_chroms func for reference data
-    if 'reference' in data.paramsdict["assembly_method"]:
+    ## map the singlecat files into the database as virtual datasets
+    if layout == "virtual":
+        with filler.temp_flags(after=cleanups.values()):
+            cleanups['virtual'] = filler.apply(build_virtual_catgs, *(data, samples))
+
+    ## or pack the present cells of all singlecat files into sparse arrays
+    if layout == "sparse":
         with filler.temp_flags(after=cleanups.values()):
-            cleanups['ref'] = filler.apply(dask_chroms, *(data, samples))
+            cleanups['sparse'] = filler.apply(build_sparse_catgs, *(data, samples))
+
+    ## index the folded chroms for reference data
+    if isref:
+        with filler.temp_flags(after=cleanups.values()):
+            cleanups['ref'] = filler.apply(write_refindex, data)
 
     ## ------- print breakline between indexing and writing database ---------
     print("")
@@ -1015,10 +1725,14 @@ def multicat(data, samples, ipyclient):
         if not jobs:
             break
 
-    ## add the dask_chroms func for reference data
+    ## fold chroms of all samples then index them for reference data
     if 'reference' in data.paramsdict["assembly_method"]:
+        for sample in samples:
+            with lbview.temp_flags(after=cleanups[last_sample]):
+                last_sample = sample.name+"_chroms"
+                cleanups[last_sample] = lbview.apply(fold_chroms, *(data, sample))
         with lbview.temp_flags(after=cleanups.values()):
-            cleanups['ref'] = lbview.apply(dask_chroms, *(data, samples))
+            cleanups['ref'] = lbview.apply(write_refindex, data)
 
     ## wait for "write_to_fullarr" jobs to finish
     print("")
@@ -1073,26 +1787,17 @@ def singlecat(data, sample, bseeds, sidx, nloci):
     ## enter ref data?
     isref = 'reference' in data.paramsdict["assembly_method"]
 
-    ## grab seeds and hits info for this sample
+    ## grab seeds and hits info for this sample, sorted by locus
     with h5py.File(bseeds, 'r') as io5:
-        ## get hits just for this sample and sort them by sample order index
-        hits = io5["uarr"][:]
-        hits = hits[hits[:, 1] == sidx, :]
-        #hits = hits[hits[:, 2].argsort()]
-        ## get seeds just for this sample and sort them by sample order index
-        seeds = io5["seedsarr"][:]
-        seeds = seeds[seeds[:, 1] == sidx, :]
-        #seeds = seeds[seeds[:, 2].argsort()]
-        full = np.concatenate((seeds, hits))
-        full = full[full[:, 0].argsort()]
+        sampidx = io5["sampidx"][sidx:sidx+2]
+        full = io5["sampfull"][sampidx[0]:sampidx[1]]
 
     ## still using max+20 len limit, rare longer merged reads get trimmed
     ## we need to allow room for indels to be added too
     maxlen = data._hackersonly["max_fragment_length"] + 20
 
-    ## we'll fill a new catg and alleles arr for this sample in locus order,
-    ## which is known from seeds and hits
-    ocatg = np.zeros((nloci, maxlen, 4), dtype=np.uint32)
+    ## loci are filled in blocks, only the alleles and chroms arrs are full
+    block = min(data.chunks, nloci)
     onall = np.zeros(nloci, dtype=np.uint8)
     ochrom = np.zeros((nloci, 3), dtype=np.int64)
     
@@ -1100,13 +1805,43 @@ def singlecat(data, sample, bseeds, sidx, nloci):
     if not sample.files.database:
         raise IPyradWarningExit("missing catg file - {}".format(sample.name))
 
-    with h5py.File(sample.files.database, 'r') as io5:
-        ## get it and delete it
-        catarr = io5["catg"][:]
-        tmp = catarr[full[:, 2], :maxlen, :]
-        del catarr
-        ocatg[full[:, 0], :tmp.shape[1], :] = tmp
-        del tmp
+    ## save individual tmp h5 data. These are kept as the source data of the
+    ## catgs virtual dataset, so store them compressed. Written to a .part
+    ## file first so that unfinished files are never entered. 
+    smpio = get_smpio(data, sample.name)
+    smptmp = smpio + ".part"
+    comp = None
+    if get_catg_layout(data) == "virtual":
+        comp = "gzip"
+
+    ipath = os.path.join(data.dirs.across, data.name+".tmp.indels.hdf5")
+    with h5py.File(sample.files.database, 'r') as io5, \
+         h5py.File(ipath, 'r') as ih5, \
+         h5py.File(smptmp, 'w') as oh5:
+        icatg = oh5.create_dataset("icatg", (nloci, maxlen, 4), 
+                                   dtype=np.uint32,
+                                   chunks=(block, maxlen, 4),
+                                   compression=comp)
+
+        ## locus positions of the block edges in the sorted rows
+        edges = np.searchsorted(full[:, 0], np.arange(0, nloci+block, block))
+        for bidx, init in enumerate(xrange(0, nloci, block)):
+            end = min(init + block, nloci)
+            rows = full[edges[bidx]:edges[bidx+1]]
+            ocatg = np.zeros((end-init, maxlen, 4), dtype=np.uint32)
+
+            ## read only the consens rows of this block, in sorted order
+            if rows.shape[0]:
+                cidx, inv = np.unique(rows[:, 2], return_inverse=True)
+                tmp = io5["catg"][cidx.tolist(), :maxlen, :]
+                ocatg[rows[:, 0]-init, :tmp.shape[1], :] = tmp[inv]
+                del tmp
+
+            ## insert indels into the block and write it
+            indels = ih5["indels"][sidx, init:end, :maxlen]
+            insert_indels(ocatg, indels)
+            icatg[init:end] = ocatg
+            del ocatg, indels
 
         ## get it and delete it
         nall = io5["nalleles"][:]
@@ -1119,31 +1854,140 @@ def singlecat(data, sample, bseeds, sidx, nloci):
             ochrom[full[:, 0]] = chrom[full[:, 2]]
             del chrom
 
-    ## get indel locations for this sample
-    ipath = os.path.join(data.dirs.across, data.name+".tmp.indels.hdf5")
-    with h5py.File(ipath, 'r') as ih5:
-        indels = ih5["indels"][sidx, :, :maxlen]
-
-    ## insert indels into ocatg
-    newcatg = inserted_indels(indels, ocatg)
-    del ocatg, indels
-    
-    ## save individual tmp h5 data
-    smpio = os.path.join(data.dirs.across, sample.name+'.tmp.h5')
-    with h5py.File(smpio, 'w') as oh5:
-        oh5.create_dataset("icatg", data=newcatg, dtype=np.uint32)
         oh5.create_dataset("inall", data=onall, dtype=np.uint8)
         if isref:
             oh5.create_dataset("ichrom", data=ochrom, dtype=np.int64)
+    os.rename(smptmp, smpio)
 
 
 
-## This func could potentially be replaced entirely by making 
-## a dask array made up concatenating all of the individual 
-## .tmp.h5 arrays. Reading from that might be a bit slower, tho.
-## Something to consider since it would be parallel, while this 
-## step is not. If this step proves to be too slow in uber
-## big assemblies then we should try the other approach.
+def get_catg_layout(data):
+    """
+    Returns the storage layout of catgs in the clust database: 
+      dense   -- one compressed (nloci, nsamples, maxlen, 4) dataset.
+      virtual -- HDF5 virtual datasets mapped from the per-sample singlecat
+                 files. Requires h5py>=2.9 built with HDF5>=1.10, otherwise
+                 the dense layout is used.
+      sparse  -- CSR arrays of only the present (locus, sample) cells. Read
+                 with 'ipyrad.assemble.util.get_catgs()'.
+    """
+    layout = data._hackersonly["catg_layout"]
+    if layout not in ["dense", "virtual", "sparse"]:
+        raise IPyradWarningExit(
+            "catg_layout must be one of dense, virtual, or sparse")
+    if layout == "virtual":
+        if not hasattr(h5py, "VirtualLayout"):
+            return "dense"
+        if h5py.version.hdf5_version_tuple[:2] < (1, 10):
+            return "dense"
+    return layout
+
+
+
+def get_smpio(data, sname):
+    """
+    Returns the path of a sample's locus-ordered catg file from 'singlecat()'.
+    With the virtual layout these are kept in a store dir next to the 
+    database, otherwise they are temporary and removed after step 6.
+    """
+    if get_catg_layout(data) == "virtual":
+        return os.path.join(data.dirs.across, data.name+"_catgs", sname+".h5")
+    return os.path.join(data.dirs.across, sname+".tmp.h5")
+
+
+
+def build_virtual_catgs(data, samples):
+    """
+    Maps the icatg and inall arrays of every sample's singlecat file into 
+    the catgs and nalleles datasets of the database as virtual datasets. 
+    Samples are written in parallel by singlecat, so this replaces the 
+    serial copy of each sample in 'write_to_fullarr()'. Source files are 
+    stored relative to the database so the across dir can be moved.
+    """
+    samples.sort(key=lambda x: x.name)
+    maxlen = data._hackersonly["max_fragment_length"] + 20
+
+    with h5py.File(data.clust_database, 'r+') as io5:
+        nloci = io5["seqs"].shape[0]
+        chunks = io5["seqs"].attrs["chunksize"][0]
+        clayout = h5py.VirtualLayout(shape=(nloci, len(samples), maxlen, 4),
+                                     dtype=np.uint32)
+        alayout = h5py.VirtualLayout(shape=(nloci, len(samples)),
+                                     dtype=np.uint8)
+        for sidx, sample in enumerate(samples):
+            smpio = os.path.relpath(get_smpio(data, sample.name), 
+                                    data.dirs.across)
+            clayout[:, sidx] = h5py.VirtualSource(
+                smpio, "icatg", shape=(nloci, maxlen, 4))
+            alayout[:, sidx] = h5py.VirtualSource(
+                smpio, "inall", shape=(nloci, ))
+
+        for key in ["catgs", "nalleles"]:
+            if key in io5:
+                del io5[key]
+        supercatg = io5.create_virtual_dataset("catgs", clayout, fillvalue=0)
+        superalls = io5.create_virtual_dataset("nalleles", alayout, fillvalue=0)
+        supercatg.attrs["chunksize"] = (chunks, 1, maxlen, 4)
+        supercatg.attrs["samples"] = [i.name for i in samples]
+        superalls.attrs["chunksize"] = (chunks, len(samples))
+        superalls.attrs["samples"] = [i.name for i in samples]
+
+
+
+def build_sparse_catgs(data, samples):
+    """
+    Packs the catgs of all samples' singlecat files into CSR arrays that 
+    store only present (locus, sample) cells: catg_indptr (nloci+1) holds 
+    the offset of each locus into catg_sidx (sample index of each cell) and
+    catg_data (nnz, maxlen, 4). Also fills the dense nalleles array.
+    """
+    samples.sort(key=lambda x: x.name)
+    maxlen = data._hackersonly["max_fragment_length"] + 20
+
+    with h5py.File(data.clust_database, 'r+') as io5:
+        nloci = io5["seqs"].shape[0]
+        chunks = io5["seqs"].attrs["chunksize"][0]
+        indptr = io5.create_dataset("catg_indptr", (nloci+1, ), dtype=np.int64)
+        csidx = io5.create_dataset("catg_sidx", (0, ), dtype=np.int32,
+                                   chunks=(chunks, ), maxshape=(None, ),
+                                   compression="gzip")
+        cdata = io5.create_dataset("catg_data", (0, maxlen, 4), 
+                                   dtype=np.uint32,
+                                   chunks=(chunks, maxlen, 4), 
+                                   maxshape=(None, maxlen, 4),
+                                   compression="gzip")
+        cdata.attrs["samples"] = [i.name for i in samples]
+        nall = io5["nalleles"]
+
+        handles = [h5py.File(get_smpio(data, i.name), 'r') for i in samples]
+        nnz = 0
+        indptr[0] = 0
+        for init in xrange(0, nloci, chunks):
+            end = min(init + chunks, nloci)
+            block = np.zeros((end-init, len(samples), maxlen, 4), dtype=np.uint32)
+            for sidx, handle in enumerate(handles):
+                block[:, sidx] = handle["icatg"][init:end]
+                nall[init:end, sidx] = handle["inall"][init:end]
+
+            ## cells are stored in (locus, sample) order
+            present = np.any(block.reshape(block.shape[0], block.shape[1], -1), axis=2)
+            lidx, sidx = np.where(present)
+            indptr[init+1:end+1] = nnz + np.cumsum(present.sum(axis=1))
+            if lidx.shape[0]:
+                csidx.resize((nnz + lidx.shape[0], ))
+                cdata.resize((nnz + lidx.shape[0], maxlen, 4))
+                csidx[nnz:] = sidx
+                cdata[nnz:] = block[lidx, sidx]
+                nnz += lidx.shape[0]
+            del block
+
+        for handle in handles:
+            handle.close()
+
+
+
+## This step is serial on the filler engine. Uber big assemblies can 
+## instead use the 'virtual' or 'sparse' catg_layout.
 def write_to_fullarr(data, sample, sidx):
     """ writes arrays to h5 disk """
 
@@ -1159,7 +2003,7 @@ def write_to_fullarr(data, sample, sidx):
         nall = io5["nalleles"]
 
         ## adding an axis to newcatg makes it write about 1000X faster.
-        smpio = os.path.join(data.dirs.across, sample.name+'.tmp.h5')
+        smpio = get_smpio(data, sample.name)
         with h5py.File(smpio) as indat:
 
             ## grab all of the data from this sample's arrays
@@ -1174,33 +2018,53 @@ def write_to_fullarr(data, sample, sidx):
 
 
 
-def dask_chroms(data, samples):
+def fold_chroms(data, sample):
     """
-    A dask relay function to fill chroms for all samples
+    Folds a sample's ichrom array into the chroms array of the database,
+    keeping the max (nonzero) chrom, min (nonzero) start and max end of 
+    each locus over the samples folded so far. Called on the filler engine as each 
+    singlecat finishes, so that all samples never need to be stacked.
+    Folding is idempotent, so re-folding a sample on restart is harmless.
     """
-    
-    ## example concatenating with dask
-    h5s = [os.path.join(data.dirs.across, s.name+".tmp.h5") for s in samples]
-    handles = [h5py.File(i) for i in h5s]
-    dsets = [i['/ichrom'] for i in handles]
-    arrays = [da.from_array(dset, chunks=(10000, 3)) for dset in dsets]
-    stack = da.stack(arrays, axis=2)
-
-    ## max chrom (should we check for variable hits? if so, things can get wonk)
-    maxchrom = da.max(stack, axis=2)[:, 0]
-
-    ## max pos
-    maxpos = da.max(stack, axis=2)[:, 2]
-
-    ## min pos
-    mask = stack == 0
-    stack[mask] = 9223372036854775807  ## max int64 value
-    minpos = da.min(stack, axis=2)[:, 1]
-    final = da.stack([maxchrom, minpos, maxpos], axis=1)
-    final.to_hdf5(data.clust_database, "/chroms")
-
-    ## close the h5 handles
-    _ = [i.close() for i in handles]
+    smpio = get_smpio(data, sample.name)
+    with h5py.File(data.clust_database, 'r+') as io5, \
+         h5py.File(smpio, 'r') as indat:
+        chroms = io5["chroms"]
+        ichrom = indat["ichrom"]
+        chunk = chroms.chunks[0]
+
+        for init in xrange(0, chroms.shape[0], chunk):
+            end = init + chunk
+            accum = chroms[init:end]
+            new = ichrom[init:end]
+
+            ## max chrom of samples with data (0), so that a locus where all 
+            ## samples are anonymous (-1) stays -1, and the max end position
+            chrom = accum[:, 0]
+            mask = (new[:, 0] != 0) & ((chrom == 0) | (new[:, 0] > chrom))
+            chrom[mask] = new[mask, 0]
+            accum[:, 2] = np.maximum(accum[:, 2], new[:, 2])
+
+            ## min start ignoring samples without data at this locus
+            starts = accum[:, 1]
+            mask = (new[:, 1] != 0) & ((starts == 0) | (new[:, 1] < starts))
+            starts[mask] = new[mask, 1]
+            chroms[init:end] = accum
+
+
+
+def write_refindex(data):
+    """
+    Stores a (chrom, start, end) sorted index of the across-sample loci in
+    the clust database for region queries on reference assemblies.
+    """
+    with h5py.File(data.clust_database, 'r+') as io5:
+        chroms = io5["chroms"][:]
+        refidx = build_refindex(chroms)
+        if "refindex" in io5:
+            del io5["refindex"]
+        dridx = io5.create_dataset("refindex", data=refidx, dtype=np.int64)
+        dridx.attrs["maxspan"] = get_maxspan(chroms, refidx)
 
 #max int64 = 9223372036854775807
 #max uint64 = 18446744073709551615
@@ -1208,30 +2072,28 @@ def dask_chroms(data, samples):
 
 
 @numba.jit(nopython=True)
-def inserted_indels(indels, ocatg):
-    """
-    inserts indels into the catg array
-    """
-    ## return copy with indels inserted
-    newcatg = np.zeros(ocatg.shape, dtype=np.uint32)
-
-    ## iterate over loci and make extensions for indels
-    for iloc in xrange(ocatg.shape[0]):
-        ## get indels indices
-        indidx = np.where(indels[iloc, :])[0]
-        if np.any(indidx):
-            ## which new (empty) rows will be added
-            allrows = np.arange(ocatg.shape[1])
-            mask = np.ones(allrows.shape[0], dtype=np.bool_)
-            for idx in indidx:
-                mask[idx] = False
-            not_idx = allrows[mask == 1]
-
-            ## fill in new data into all other spots
-            newcatg[iloc][not_idx] = ocatg[iloc, :not_idx.shape[0]]
-        else:
-            newcatg[iloc] = ocatg[iloc]
-    return newcatg
+def insert_indels(catg, indels):
+    """
+    inserts indels into a block of the catg array in place. Data at each 
+    locus are shifted right past the indel positions, filling from the end.
+    """
+    for iloc in xrange(catg.shape[0]):
+        ## number of non-indel sites, these receive the data
+        nkeep = indels.shape[1]
+        for idx in xrange(indels.shape[1]):
+            if indels[iloc, idx]:
+                nkeep -= 1
+        if nkeep == indels.shape[1]:
+            continue
+
+        ## fill from the right so no source is overwritten before it's read
+        for idx in xrange(indels.shape[1]-1, -1, -1):
+            if indels[iloc, idx]:
+                catg[iloc, idx, :] = 0
+            else:
+                nkeep -= 1
+                catg[iloc, idx, :] = catg[iloc, nkeep, :]
+    return catg
 
 
 
@@ -1277,7 +2139,7 @@ def fill_superseqs(data, samples):
         ## if chunk is full put into superseqs and reset counter
         if cloc == chunksize:
             LOGGER.info("cloc chunk writing %s", cloc)
-            superseqs[iloc-cloc:iloc] = chunkseqs
+            put_seqs(io5, iloc-cloc, iloc, chunkseqs)
             splits[iloc-cloc:iloc] = chunkedge
             ## reset chunkseqs, chunkedge, cloc
             cloc = 0
@@ -1327,7 +2189,7 @@ def fill_superseqs(data, samples):
             break
 
     ## write final leftover chunk
-    superseqs[iloc-cloc:,] = chunkseqs[:cloc]
+    put_seqs(io5, iloc-cloc, iloc, chunkseqs[:cloc])
     splits[iloc-cloc:] = chunkedge[:cloc]
 
     ## close super
@@ -1342,6 +2204,103 @@ def fill_superseqs(data, samples):
 
 
 
+def fill_superseqs_parallel(data, samples, ipyclient):
+    """
+    Fills the superseqs and splits arrays by parsing the aligned cluster 
+    files (align_*.fa), which are independent locus ranges of the catclust 
+    file, on separate engines. Parsed ranges are written to the database in
+    locus order on this process as they finish.
+    """
+    ## the end locus of each range is in the file name
+    alignbits = glob.glob(os.path.join(data.tmpdir, "align_*.fa"))
+    alignbits.sort(key=lambda x: int(x.rsplit("_", 1)[-1][:-3]))
+
+    lbview = ipyclient.load_balanced_view()
+    start = time.time()
+    printstr = " filling superseqs     | {} | s6 |"
+    jobs = []
+    init = 0
+    for alignbit in alignbits:
+        end = int(alignbit.rsplit("_", 1)[-1][:-3])
+        args = (data, samples, alignbit, init, end)
+        jobs.append((init, end, lbview.apply(parse_aligned, *args)))
+        init = end
+
+    ## enter ranges in locus order
+    with h5py.File(data.clust_database, 'r+') as io5:
+        for done, (init, end, job) in enumerate(jobs):
+            while not job.ready():
+                elapsed = datetime.timedelta(seconds=int(time.time()-start))
+                progressbar(len(jobs), done, printstr.format(elapsed), 
+                            spacer=data._spacer)
+                time.sleep(0.1)
+            if not job.successful():
+                raise IPyradWarningExit(job.result())
+            seqfile, splitfile = job.result()
+            put_seqs(io5, init, end, np.load(seqfile))
+            io5["splits"][init:end] = np.load(splitfile)
+            os.remove(seqfile)
+            os.remove(splitfile)
+    elapsed = datetime.timedelta(seconds=int(time.time()-start))
+    progressbar(len(jobs), len(jobs), printstr.format(elapsed), 
+                spacer=data._spacer)
+    print("")
+
+
+
+def parse_aligned(data, samples, alignbit, init, end):
+    """
+    Parses one aligned cluster file (loci init:end) into a seqs array 
+    (nloci, nsamples, maxlen) and a splits array, saved as .npy files in the
+    tmpdir. Returns the two file paths.
+    """
+    maxlen = data._hackersonly["max_fragment_length"] + 20
+    snames = sorted([i.name for i in samples])
+    sidxs = {name: idx for idx, name in enumerate(snames)}
+
+    seqs = np.zeros((end-init, len(snames), maxlen), dtype="|S1")
+    seqs.fill("N")
+    splits = np.zeros(end-init, dtype=np.uint16)
+
+    with open(alignbit, 'rb') as infile:
+        clusts = infile.read().split("\n//\n//\n")
+    for ldx, clust in enumerate(clusts[:end-init]):
+        lines = clust.strip().split("\n")
+        if len(lines) < 2:
+            continue
+        rows = [sidxs[i.rsplit("_", 1)[0]] for i in lines[::2]]
+        ## duplicates may not be aligned, so use the shortest length
+        shlen = min(maxlen, min([len(i) for i in lines[1::2]]))
+        for sidx, seq in zip(rows, lines[1::2]):
+            seqs[ldx, sidx, :shlen] = np.frombuffer(seq[:shlen], dtype="|S1")
+
+        ## fill in the separator if it exists
+        separator = np.where(np.all(seqs[ldx, rows, :shlen] == "n", axis=0))[0]
+        if np.any(separator):
+            splits[ldx] = separator.min()
+
+    seqfile = os.path.join(data.tmpdir, "seqs_{}.tmp.npy".format(end))
+    splitfile = os.path.join(data.tmpdir, "splits_{}.tmp.npy".format(end))
+    np.save(seqfile, seqs)
+    np.save(splitfile, splits)
+    return seqfile, splitfile
+
+
+
+def put_seqs(io5, start, end, seqs):
+    """
+    Writes an |S1 block of seqs to loci start:end of the seqs dataset, packed
+    into 4-bit codes and phase bits if the dataset is nibble encoded.
+    """
+    if io5["seqs"].attrs.get("encoding", "S1") == "nibble":
+        packed, phase = encode_seqs(seqs)
+        io5["seqs"][start:end] = packed
+        io5["phase"][start:end] = phase
+    else:
+        io5["seqs"][start:end] = seqs
+
+
+
 def count_seeds(usort):
     """
     uses bash commands to quickly count N seeds from utemp file
@@ -1653,6 +2612,11 @@ def clean_and_build_concat(data, samples, randomseed, ipyclient):
         os.remove(catclust)
     if os.path.exists(data.clust_database):
         os.remove(data.clust_database)
+    catgstore = os.path.join(data.dirs.across, data.name+"_catgs")
+    if os.path.exists(catgstore):
+        shutil.rmtree(catgstore)
+    if get_catg_layout(data) == "virtual":
+        os.mkdir(catgstore)
 
     ## get parallel view
     start = time.time()
@@ -1676,6 +2640,636 @@ def clean_and_build_concat(data, samples, randomseed, ipyclient):
 
 
 
+def use_incremental(data, samples, force):
+    """
+    Returns True if step 6 should add new samples to the existing clust 
+    database instead of rebuilding it. Requires the 'incremental_across'
+    hackersonly option, a finished database that contains a subset of the
+    selected samples, and a denovo assembly.
+    """
+    if force or (not data._hackersonly["incremental_across"]):
+        return False
+    if "reference" in data.paramsdict["assembly_method"]:
+        return False
+    if get_catg_layout(data) == "sparse":
+        return False
+    if data._hackersonly["seqs_encoding"] == "nibble":
+        return False
+    if not (data.clust_database and os.path.exists(data.clust_database)):
+        return False
+    if getattr(data, "_checkpoint", 0) != 7:
+        return False
+    with h5py.File(data.clust_database, 'r') as io5:
+        dbnames = set(io5["seqs"].attrs["samples"])
+    snames = set([i.name for i in samples])
+    return dbnames.issubset(snames) and bool(snames - dbnames)
+
+
+
+def track_jobs(data, jobs, printstr):
+    """
+    Prints a progress bar until all async jobs are finished and raises an
+    error if any of them failed.
+    """
+    start = time.time()
+    while 1:
+        finished = sum([i.ready() for i in jobs])
+        elapsed = datetime.timedelta(seconds=int(time.time()-start))
+        progressbar(len(jobs), finished, printstr.format(elapsed), 
+                    spacer=data._spacer)
+        if finished == len(jobs):
+            break
+        else:
+            time.sleep(0.1)
+    print("")
+    for job in jobs:
+        if not job.successful():
+            raise IPyradWarningExit(job.result())
+
+
+
+def add_samples(data, samples, noreverse, randomseed, ipyclient):
+    """
+    Incremental step 6. Consens reads of samples that are not yet in the 
+    clust database are searched against a seed of each existing locus. Hits
+    are profile-aligned into existing loci, and the remaining reads are 
+    clustered and aligned among themselves as new loci. The database is then
+    extended along the loci and samples axes, keeping samples in sorted 
+    order. Existing samples' data are only rewritten for loci where gaps were
+    inserted to fit the new reads, and for samples that sort after a new one.
+    """
+    ## get samples in the existing database, and new samples in sorted order
+    with h5py.File(data.clust_database, 'r') as io5:
+        oldnames = list(io5["seqs"].attrs["samples"])
+    newsamples = [i for i in samples if i.name not in oldnames]
+    newsamples.sort(key=lambda x: x.name)
+
+    ## clear tmp align files
+    if os.path.exists(data.tmpdir):
+        shutil.rmtree(data.tmpdir)
+    os.mkdir(data.tmpdir)
+
+    ## build seeds of existing loci and an input file of the new reads
+    hosts = get_hosts(ipyclient)
+    _, eids = hosts[0]
+    bighost = ipyclient[eids[0]]
+    lbview = ipyclient.load_balanced_view()
+    async = bighost.apply(inc_build_input, *(data, newsamples, randomseed))
+    track_jobs(data, [async], " concat/shuffle input  | {} | s6 |")
+
+    ## search new reads against existing seeds and cluster the remainder
+    nthreads = min(len(eids), max(data._ipcluster["threads"], 10))
+    async = bighost.apply(inc_search, *(data, noreverse, nthreads))
+    track_jobs(data, [async], " clustering across     | {} | s6 |")
+
+    ## write new loci and extended loci to chunk files for aligning
+    async = bighost.apply(inc_build_clusters, *(data, newsamples))
+    track_jobs(data, [async], " building clusters     | {} | s6 |")
+    clustbits, profbits = async.result()
+
+    ## align new loci and profile-align hits into existing loci
+    jobs = []
+    for chunk in clustbits:
+        jobs.append(lbview.apply(persistent_popen_align3, 
+                                 *(data, newsamples, chunk)))
+    for chunk in profbits:
+        jobs.append(lbview.apply(profile_align, *(data, chunk)))
+    track_jobs(data, jobs, " aligning clusters     | {} | s6 |")
+
+    ## extend the database
+    async = bighost.apply(inc_fill_database, *(data, oldnames, newsamples))
+    track_jobs(data, [async], " building database     | {} | s6 |")
+
+    ## cleanup
+    cleanup_tempfiles(data)
+    if os.path.exists(data.tmpdir):
+        shutil.rmtree(data.tmpdir)
+    data.stats_files.s6 = os.path.join(data.dirs.across, "s6_cluster_stats.txt")
+
+
+
+## ACGT upper and lower as uint8
+BASES = np.array([65, 67, 71, 84, 97, 99, 103, 116], dtype=np.uint8)
+
+def inc_build_input(data, newsamples, randomseed):
+    """
+    Writes a fasta file with a seed sequence for each locus in the clust 
+    database, and the concat/shuffled input file of the new samples' reads.
+    """
+    ## pseudo-haplo substitutions as in 'build_input_file()'
+    table = string.maketrans("WRMKSYwrmksy", "AAATCCAAATCC")
+
+    ## the seed is the least-missing sequence in each locus, ungapped
+    seedfile = os.path.join(data.dirs.across, data.name+"_locseeds.tmp")
+    with h5py.File(data.clust_database, 'r') as io5, open(seedfile, 'w') as out:
+        seqs = io5["seqs"]
+        optim = seqs.attrs["chunksize"][0]
+        for init in xrange(0, seqs.shape[0], optim):
+            block = seqs[init:init+optim]
+            arr = block.view(np.uint8)
+            counts = np.sum(np.in1d(arr, BASES).reshape(arr.shape), axis=2)
+            best = np.argmax(counts, axis=1)
+            bits = []
+            for ldx in xrange(block.shape[0]):
+                if not counts[ldx, best[ldx]]:
+                    continue
+                seq = block[ldx, best[ldx]].tostring()
+                seq = seq.replace("-", "").rstrip("N").translate(table).upper()
+                bits.append(">locus_{}\n{}\n".format(init+ldx, seq))
+            out.write("".join(bits))
+
+    ## concat and shuffle the new samples' consens reads 
+    build_input_file(data, newsamples, randomseed)
+
+
+
+def inc_search(data, noreverse, nthreads):
+    """
+    Searches new reads against the seeds of existing loci with vsearch. Reads
+    that do not match an existing locus are clustered among themselves.
+    """
+    cathaplos = os.path.join(data.dirs.across, data.name+"_catshuf.tmp")
+    seedfile = os.path.join(data.dirs.across, data.name+"_locseeds.tmp")
+    uhaplos = os.path.join(data.dirs.across, data.name+"_inc.utemp")
+    nomatch = os.path.join(data.dirs.across, data.name+"_incnomatch.tmp")
+    inclog = os.path.join(data.dirs.across, data.name+"_inclog.tmp")
+    newlog = os.path.join(data.dirs.across, data.name+"_incnewlog.tmp")
+    logfile = os.path.join(data.dirs.across, "s6_cluster_stats.txt")
+
+    strand, cov = get_vsearch_params(data)
+    if noreverse:
+        strand = "plus"
+    cmd = [ipyrad.bins.vsearch,
+           "-usearch_global", cathaplos,
+           "-db", seedfile,
+           "-strand", strand,
+           "-query_cov", str(cov),
+           "-minsl", str(0.5),
+           "-id", str(data.paramsdict["clust_threshold"]),
+           "-userout", uhaplos,
+           "-notmatched", nomatch,
+           "-userfields", "query+target+qstrand",
+           "-maxaccepts", "1",
+           "-maxrejects", "0",
+           "-fasta_width", "0",
+           "-threads", str(nthreads),
+           "-fulldp",
+           "-log", inclog]
+    LOGGER.info(cmd)
+    proc = sps.Popen(cmd, stdout=sps.PIPE, stderr=sps.STDOUT, close_fds=True)
+    stdout = proc.communicate()[0]
+    if proc.returncode:
+        raise IPyradWarningExit("error in vsearch: \n{}".format(stdout))
+
+    ## cluster the unmatched reads into new loci
+    handles = (nomatch, 
+               os.path.join(data.dirs.across, data.name+".utemp"),
+               os.path.join(data.dirs.across, data.name+".htemp"),
+               newlog)
+    if os.path.getsize(nomatch):
+        cluster(data, noreverse, nthreads, handles)
+    else:
+        open(handles[1], 'w').close()
+
+    ## append the vsearch logs to the stats file of the existing database
+    with open(logfile, 'a') as out:
+        for title, log in [("search against existing loci", inclog), 
+                           ("clustering of unmatched reads", newlog)]:
+            if os.path.exists(log):
+                out.write("## incremental {}\n".format(title))
+                with open(log, 'r') as indat:
+                    out.write(indat.read())
+                os.remove(log)
+
+
+
+def inc_build_clusters(data, newsamples):
+    """
+    Writes clusters of new loci to chunk files in the format that is aligned
+    by 'persistent_popen_align3()', and hits to existing loci, together with
+    the existing alignment, to chunk files for 'profile_align()'. Returns 
+    the two lists of chunk files.
+    """
+    ## load new reads
+    allcons = {}
+    conshandle = os.path.join(data.dirs.across, data.name+"_catcons.tmp")
+    with gzip.open(conshandle, 'rb') as iocons:
+        cons = itertools.izip(*[iter(iocons)]*2)
+        for namestr, seq in cons:
+            nnn, sss = [i.strip() for i in namestr, seq]
+            allcons[nnn[1:]] = sss
+
+    ## revcomp if orientation is reversed
+    def oriented(hit, ori):
+        seq = allcons[hit]
+        if ori == "-":
+            seq = fullcomp(seq)[::-1]
+        return seq
+
+    ## new loci {seed: [(hit, ori), ...]}
+    newclusts = {}
+    with open(os.path.join(data.dirs.across, data.name+".utemp"), 'r') as infile:
+        for line in infile:
+            hit, seed, ori = line.split()
+            newclusts.setdefault(seed, []).append((hit, ori))
+
+    ## write new loci in sorted seed order to chunks for aligning
+    optim = max(1, len(newclusts) // (data.cpus*4))
+    clustbits = []
+    seqlist = []
+    seeds = sorted(newclusts)
+    for sdx, seed in enumerate(seeds):
+        fseqs = [">{}\n{}".format(seed, allcons[seed])]
+        for hit, ori in newclusts[seed]:
+            fseqs.append(">{}\n{}".format(hit, oriented(hit, ori)))
+        seqlist.append("\n".join(fseqs))
+        if (len(seqlist) >= optim) or (sdx == len(seeds) - 1):
+            clustbits.append(os.path.join(data.tmpdir, 
+                             data.name+".chunk_{}".format(sdx+1)))
+            with open(clustbits[-1], 'w') as clustsout:
+                clustsout.write("\n//\n//\n".join(seqlist)+"\n//\n//\n")
+            seqlist = []
+    del newclusts
+
+    ## hits to existing loci {locidx: [(hit, ori), ...]}
+    exhits = {}
+    with open(os.path.join(data.dirs.across, data.name+"_inc.utemp"), 'r') as infile:
+        for line in infile:
+            hit, target, ori = line.split()
+            exhits.setdefault(int(target.split("_")[1]), []).append((hit, ori))
+
+    ## write extended loci with their existing aligned rows 
+    optim = max(1, len(exhits) // (data.cpus*4))
+    profbits = []
+    seqlist = []
+    loci = sorted(exhits)
+    with h5py.File(data.clust_database, 'r') as io5:
+        seqs = io5["seqs"]
+        dbnames = seqs.attrs["samples"]
+        chunksize = seqs.attrs["chunksize"][0]
+        splits = io5["splits"][:]
+        dups = io5["duplicates"][:]
+        init = -1
+        for ldx, loc in enumerate(loci):
+            ## load the block of seqs holding this locus
+            if not init <= loc < init + chunksize:
+                init = loc - (loc % chunksize)
+                block = seqs[init:init+chunksize]
+            arr = block[loc-init]
+            present = np.where(np.any(arr != "N", axis=1))[0]
+            alen = np.where(np.any(arr[present] != "N", axis=0))[0].max() + 1
+            fseqs = ["{} {} {}".format(loc, splits[loc], int(dups[loc]))]
+            for sidx in present:
+                fseqs.append(">{};0\n{}".format(
+                    dbnames[sidx], arr[sidx, :alen].tostring()))
+            for hit, ori in exhits[loc]:
+                fseqs.append(">{};1\n{}".format(hit, oriented(hit, ori)))
+            seqlist.append("\n".join(fseqs))
+            if (len(seqlist) >= optim) or (ldx == len(loci) - 1):
+                profbits.append(os.path.join(data.tmpdir, 
+                                data.name+".profile_{}".format(ldx+1)))
+                with open(profbits[-1], 'w') as out:
+                    out.write("\n//\n//\n".join(seqlist)+"\n//\n//\n")
+                seqlist = []
+
+    return clustbits, profbits
+
+
+
+def profile_align(data, chunk):
+    """
+    Aligns hits from new samples to the existing alignment of each locus in
+    a chunk file using muscle -profile. Writes the aligned new reads, the new
+    split position, the duplicate flag, and the columns where gaps were 
+    inserted into the existing alignment to a .aligned file.
+    """
+    with open(chunk, 'rb') as infile:
+        clusts = infile.read().split("//\n//\n")[:-1]
+
+    tmpin = chunk+".tmp"
+    outstack = []
+    for clust in clusts:
+        lines = clust.strip().split("\n")
+        loc, split, dup = [int(i) for i in lines[0].split()]
+        names = lines[1::2]
+        seqs = lines[2::2]
+        old = [j for i, j in zip(names, seqs) if i.endswith(";0")]
+        hits = [i[1:-2] for i in names if i.endswith(";1")]
+        new = [j for i, j in zip(names, seqs) if i.endswith(";1")]
+
+        ## a sample that hit the locus twice makes it a duplicate
+        if len(hits) != len(set([i.rsplit("_", 1)[0] for i in hits])):
+            dup = 1
+
+        inserted = []
+        if not dup:
+            try:
+                if split:
+                    new1, new2 = zip(*[i.split("nnnn") for i in new])
+                    ali1, ins1 = muscle_profile(
+                        [i[:split] for i in old], new1, tmpin)
+                    ali2, ins2 = muscle_profile(
+                        [i[split+4:] for i in old], new2, tmpin)
+                    inserted = ins1 + [i + len(ali1[0]) + 4 for i in ins2]
+                    split = len(ali1[0])
+                    new = [i+"nnnn"+j for i, j in zip(ali1, ali2)]
+                else:
+                    new, inserted = muscle_profile(old, new, tmpin)
+            ## unpaired hits or a profile that could not be mapped back are 
+            ## treated like duplicates and left unaligned.
+            except (ValueError, KeyError, StopIteration) as inst:
+                LOGGER.info("profile align failed on locus %s: %s", loc, inst)
+                dup = 1
+
+        fseqs = ["{} {} {} {}".format(loc, split, dup, 
+                 ",".join([str(i) for i in inserted]))]
+        for hit, seq in zip(hits, new):
+            fseqs.append("{}\n{}".format(hit, seq))
+        outstack.append("\n".join(fseqs))
+
+    with open(chunk+".aligned", 'wb') as outfile:
+        outfile.write("\n//\n//\n".join(outstack)+"\n//\n//\n")
+    os.remove(chunk)
+    for tmp in glob.glob(tmpin+"*"):
+        os.remove(tmp)
+
+
+
+def muscle_profile(old, new, tmpin):
+    """
+    Aligns a list of new seqs to the existing alignment 'old' with muscle
+    -profile. New seqs are first aligned among themselves if there are 
+    several. Returns the aligned new seqs (with their original case) and the
+    columns at which all-gap columns were inserted into the old alignment.
+    """
+    ## write the new seqs and align them to each other
+    in1, in2 = tmpin+"1", tmpin+"2"
+    with open(in2, 'w') as out:
+        out.write("\n".join([">n{}\n{}".format(i, j) for i, j in enumerate(new)]))
+    if len(new) > 1:
+        proc = sps.Popen([ipyrad.bins.muscle, "-quiet", "-in", in2], 
+                         stdout=sps.PIPE, close_fds=True)
+        aligned = proc.communicate()[0]
+        with open(in2, 'w') as out:
+            out.write(aligned)
+
+    ## align the two profiles
+    with open(in1, 'w') as out:
+        out.write("\n".join([">o{}\n{}".format(i, j) for i, j in enumerate(old)]))
+    proc = sps.Popen([ipyrad.bins.muscle, "-quiet", "-profile", 
+                      "-in1", in1, "-in2", in2], 
+                     stdout=sps.PIPE, close_fds=True)
+    aligned = proc.communicate()[0]
+    aligned = dict([i.split("\n", 1) for i in aligned.strip()[1:].split("\n>")])
+    aligned = {i: j.replace("\n", "") for i, j in aligned.items()}
+
+    ## columns that are gaps in all old rows were inserted by the profile
+    arr = np.array([list(aligned["o{}".format(i)]) for i in xrange(len(old))])
+    inserted = np.where(np.all(arr == "-", axis=0))[0]
+    if arr.shape[1] - inserted.shape[0] != len(old[0]):
+        raise ValueError("existing alignment was modified")
+
+    ## put original bases (alleles are lowercase) back into the new seqs
+    newseqs = []
+    for idx, seq in enumerate(new):
+        bases = iter(seq.replace("-", ""))
+        newseqs.append("".join([i if i == "-" else bases.next() \
+                       for i in aligned["n{}".format(idx)]]))
+    return newseqs, inserted.tolist()
+
+
+
+def make_resizable(io5, key, naxes):
+    """
+    Copies a dataset into a new chunked dataset whose first naxes axes are 
+    resizable, if it is not already. Databases built before the datasets 
+    were created resizable are rewritten once here.
+    """
+    dset = io5[key]
+    if all([i is None for i in dset.maxshape[:naxes]]):
+        return
+    shape = dset.shape
+    chunks = dset.chunks
+    ## virtual datasets have no chunks but store their chunksize as attrs
+    if (not chunks) and (len(dset.attrs.get("chunksize", ())) == len(shape)):
+        chunks = tuple(dset.attrs["chunksize"])
+    if not chunks:
+        chunks = (max(1, min(shape[0], 10000)), ) + shape[1:]
+    maxshape = (None, ) * naxes + shape[naxes:]
+    tmp = io5.create_dataset(key+"_resize", shape, dtype=dset.dtype, 
+                             chunks=chunks, maxshape=maxshape, 
+                             compression=dset.compression or "gzip")
+    for init in xrange(0, shape[0], chunks[0]):
+        tmp[init:init+chunks[0]] = dset[init:init+chunks[0]]
+    for attr in dset.attrs:
+        tmp.attrs[attr] = dset.attrs[attr]
+    del io5[key]
+    io5.move(key+"_resize", key)
+
+
+
+def inc_fill_database(data, oldnames, newsamples):
+    """
+    Extends the clust database with the new samples and new loci. Aligned new
+    reads are entered into the new sample columns of seqs, catgs and nalleles,
+    which are merged into the samples axis in sorted name order. Existing 
+    columns are only moved if a new sample sorts before them. Gaps inserted 
+    into existing loci by profile alignment are entered into the existing 
+    samples' seqs and catgs for only those loci.
+    """
+    maxlen = data._hackersonly["max_fragment_length"] + 20
+    nold = len(oldnames)
+    newnames = [i.name for i in newsamples]
+    nall = nold + len(newnames)
+
+    ## the samples axis stays sorted. Columns before 'first' are unchanged, 
+    ## the rest are rewritten with old and new columns at their new index.
+    allnames = sorted(oldnames + newnames)
+    first = nold
+    for idx, name in enumerate(oldnames):
+        if allnames[idx] != name:
+            first = idx
+            break
+    ocols = [allnames.index(i) - first for i in oldnames[first:]]
+    ncols = [allnames.index(i) - first for i in newnames]
+
+    ## collect results by locus {loc: [(newsidx, row, seq), ...]}
+    rows = {}
+    inserts = {}
+    splits = {}
+    dups = {}
+
+    with h5py.File(data.clust_database, 'r') as io5:
+        noldloci = io5["seqs"].shape[0]
+
+    ## extended loci
+    alfiles = glob.glob(os.path.join(data.tmpdir, data.name+".profile_*.aligned"))
+    for alfile in alfiles:
+        with open(alfile, 'rb') as infile:
+            clusts = infile.read().split("\n//\n//\n")[:-1]
+        for clust in clusts:
+            lines = clust.strip().split("\n")
+            meta = lines[0].split(" ")
+            loc = int(meta[0])
+            splits[loc] = int(meta[1])
+            dups[loc] = bool(int(meta[2]))
+            if meta[3]:
+                inserts[loc] = [int(i) for i in meta[3].split(",")]
+            rows[loc] = []
+            for name, seq in zip(lines[1::2], lines[2::2]):
+                sname, row = name.rsplit("_", 1)
+                rows[loc].append((newnames.index(sname), int(row), seq))
+
+    ## new loci are appended after the existing loci
+    alfiles = glob.glob(os.path.join(data.tmpdir, "align_*.fa"))
+    alfiles.sort(key=lambda x: int(x.rsplit("_", 1)[-1][:-3]))
+    loc = noldloci
+    for alfile in alfiles:
+        with open(alfile, 'rb') as infile:
+            clusts = infile.read().split("\n//\n//\n")
+        for clust in clusts:
+            lines = clust.strip().split("\n")
+            if len(lines) < 2:
+                continue
+            snames = [i.rsplit("_", 1)[0] for i in lines[::2]]
+            dups[loc] = len(snames) != len(set(snames))
+            seqs = lines[1::2]
+            ## the split is the first column that is 'n' in all seqs
+            splits[loc] = 0
+            if not dups[loc]:
+                arr = np.array([list(i) for i in seqs])
+                separator = np.where(np.all(arr == 'n', axis=0))[0]
+                if np.any(separator):
+                    splits[loc] = separator.min()
+            rows[loc] = []
+            for name, seq in zip(lines[::2], seqs):
+                sname, row = name.rsplit("_", 1)
+                rows[loc].append((newnames.index(sname), int(row), seq))
+            loc += 1
+    nloci = loc
+
+    ## enter into the database
+    with h5py.File(data.clust_database, 'r+') as io5:
+        ## extend the arrays along the loci and samples axes
+        for key, naxes in [("seqs", 2), ("catgs", 2), ("nalleles", 2), 
+                           ("chroms", 1), ("splits", 1), ("duplicates", 1)]:
+            make_resizable(io5, key, naxes)
+        io5["seqs"].resize((nloci, nall, maxlen))
+        io5["catgs"].resize((nloci, nall, maxlen, 4))
+        io5["nalleles"].resize((nloci, nall))
+        io5["chroms"].resize((nloci, 3))
+        io5["splits"].resize((nloci, ))
+        io5["duplicates"].resize((nloci, ))
+        superseqs = io5["seqs"]
+        supercatg = io5["catgs"]
+        superalls = io5["nalleles"]
+        chunksize = superseqs.attrs["chunksize"][0]
+
+        ## open new samples' catg files
+        handles = [h5py.File(i.files.database, 'r') for i in newsamples]
+
+        for init in xrange(0, nloci, chunksize):
+            end = min(init + chunksize, nloci)
+            bloci = [i for i in xrange(init, end) if i in rows]
+
+            ## aligned new reads, and the catgs and nalleles of their reads
+            nseqs = np.zeros((end-init, len(newnames), maxlen), dtype="|S1")
+            nseqs.fill("N")
+            ncatg = np.zeros((len(newnames), end-init, maxlen, 4), dtype=np.uint32)
+            nnall = np.zeros((end-init, len(newnames)), dtype=np.uint8)
+            for nidx in xrange(len(newnames)):
+                hits = [(i - init, j[1]) for i in bloci for j in rows[i] \
+                        if j[0] == nidx]
+                if not hits:
+                    continue
+                hits.sort(key=lambda x: x[1])
+                bidx = np.array([i[0] for i in hits])
+                hrows = [i[1] for i in hits]
+                tmp = handles[nidx]["catg"][hrows, :maxlen, :]
+                ncatg[nidx, bidx, :tmp.shape[1], :] = tmp
+                nnall[bidx, nidx] = handles[nidx]["nalleles"][hrows]
+            for bloc in bloci:
+                for nidx, _, seq in rows[bloc]:
+                    seq = seq[:maxlen]
+                    nseqs[bloc-init, nidx, :len(seq)] = list(seq)
+            ## insert indels into the new samples' catgs
+            for nidx in xrange(len(newnames)):
+                indels = nseqs[:, nidx, :] == "-"
+                insert_indels(ncatg[nidx], indels)
+
+            ## existing loci with gaps inserted by the profile alignment. These
+            ## are read and rewritten by point selection of only those loci.
+            iloci = sorted([i for i in bloci if i in inserts])
+            if iloci:
+                oseqs = superseqs[iloci, :nold]
+                ocatg = supercatg[iloci, :nold]
+                mask = np.zeros((len(iloci), maxlen), dtype=np.bool_)
+                for ridx, iloc in enumerate(iloci):
+                    cols = [i for i in inserts[iloc] if i < maxlen]
+                    mask[ridx, cols] = True
+                    keep = np.where(~mask[ridx])[0]
+                    present = np.where(np.any(oseqs[ridx] != "N", axis=1))[0]
+                    for sidx in present:
+                        orow = oseqs[ridx, sidx].copy()
+                        oseqs[ridx, sidx, keep] = orow[:keep.shape[0]]
+                        oseqs[ridx, sidx, cols] = "-"
+                for sidx in xrange(nold):
+                    insert_indels(ocatg[:, sidx], mask)
+                superseqs[iloci, :nold] = oseqs
+                supercatg[iloci, :nold] = ocatg
+                del oseqs, ocatg
+
+            ## new loci are empty for existing samples before 'first'
+            oend = min(end, noldloci)
+            if (end > noldloci) and first:
+                nbeg = max(init, noldloci)
+                empty = np.zeros((end-nbeg, first, maxlen), dtype="|S1")
+                empty.fill("N")
+                superseqs[nbeg:end, :first] = empty
+
+            ## merge existing columns from 'first' on with the new columns
+            tseqs = np.zeros((end-init, nall-first, maxlen), dtype="|S1")
+            tseqs.fill("N")
+            tcatg = np.zeros((end-init, nall-first, maxlen, 4), 
+                             dtype=supercatg.dtype)
+            talls = np.zeros((end-init, nall-first), dtype=superalls.dtype)
+            if ocols and (oend > init):
+                tseqs[:oend-init, ocols] = superseqs[init:oend, first:nold]
+                tcatg[:oend-init, ocols] = supercatg[init:oend, first:nold]
+                talls[:oend-init, ocols] = superalls[init:oend, first:nold]
+            tseqs[:, ncols] = nseqs
+            talls[:, ncols] = nnall
+            for nidx in xrange(len(newnames)):
+                tcatg[:, ncols[nidx]] = ncatg[nidx]
+            superseqs[init:end, first:] = tseqs
+            supercatg[init:end, first:] = tcatg
+            superalls[init:end, first:] = talls
+            del nseqs, ncatg, nnall, tseqs, tcatg, talls
+
+            ## new loci have no reference position, as in a denovo build
+            if end > noldloci:
+                nbeg = max(init, noldloci)
+                io5["chroms"][nbeg:end] = np.zeros((end-nbeg, 3), dtype=np.int64)
+
+            ## splits and duplicates
+            if bloci:
+                bsplits = io5["splits"][init:end]
+                bdups = io5["duplicates"][init:end]
+                for bloc in bloci:
+                    bsplits[bloc-init] = splits[bloc]
+                    bdups[bloc-init] = bdups[bloc-init] or dups[bloc]
+                io5["splits"][init:end] = bsplits
+                io5["duplicates"][init:end] = bdups
+
+        for handle in handles:
+            handle.close()
+
+        ## store the new sample order
+        for key in ["seqs", "catgs", "nalleles", "chroms"]:
+            io5[key].attrs["samples"] = allnames
+
+
+
 def run(data, samples, noreverse, force, randomseed, ipyclient, **kwargs):
     """
     For step 6 the run function is sub divided a bit so that users with really
@@ -1738,6 +3332,14 @@ def run(data, samples, noreverse, force, randomseed, ipyclient, **kwargs):
     if not data.cpus:
         data.cpus = len(ipyclient)
 
+    ## add new samples to an existing database instead of rebuilding it
+    if use_incremental(data, samples, force):
+        add_samples(data, samples, noreverse, randomseed, ipyclient)
+        data._checkpoint = 7
+        for sample in samples:
+            sample.stats.state = 6
+        return
+
     ## STEP 6-1: Clean database and build input concat file for clustering
     if 1 in substeps:
         clean_and_build_concat(data, samples, randomseed, ipyclient)
@@ -1745,7 +3347,10 @@ def run(data, samples, noreverse, force, randomseed, ipyclient, **kwargs):
 
     ## STEP 6-2: Cluster across w/ vsearch; uses all threads on largest host 
     if 2 in substeps:
-        call_cluster(data, noreverse, ipyclient)
+        if use_refmerge(data):
+            call_refmerge(data, samples, ipyclient)
+        else:
+            call_cluster(data, noreverse, ipyclient)
         data._checkpoint = 2
 
     ## builds consens cluster bits and writes them to the tmp directory. These
@@ -1786,8 +3391,12 @@ def run(data, samples, noreverse, force, randomseed, ipyclient, **kwargs):
         data._checkpoint = 6
 
     if 7 in substeps:
-        ## FILL SUPERSEQS and fills edges(splits) for paired-end data
-        fill_superseqs(data, samples)
+        ## FILL SUPERSEQS and fills edges(splits) for paired-end data. Parse
+        ## the aligned chunk files in parallel if they are still in tmpdir.
+        if glob.glob(os.path.join(data.tmpdir, "align_*.fa")):
+            fill_superseqs_parallel(data, samples, ipyclient)
+        else:
+            fill_superseqs(data, samples)
         data._checkpoint = 7
 
         ## remove files but not dir (used in step 1 too)
@@ -1825,15 +3434,29 @@ def cleanup_tempfiles(data):
         os.path.join(data.dirs.across, data.name+"_cathaps.tmp"),
         os.path.join(data.dirs.across, data.name+"_catshuf.tmp"),
         os.path.join(data.dirs.across, data.name+"_catsort.tmp"),
+        os.path.join(data.dirs.across, data.name+"_catseeds.tmp"),
+        os.path.join(data.dirs.across, data.name+"_locseeds.tmp"),
+        os.path.join(data.dirs.across, data.name+"_incnomatch.tmp"),
+        os.path.join(data.dirs.across, data.name+"_inc.utemp"),
+        os.path.join(data.dirs.across, data.name+"_inclog.tmp"),
+        os.path.join(data.dirs.across, data.name+"_incnewlog.tmp"),
+        os.path.join(data.dirs.across, data.name+"_seedutemp.tmp"),
+        os.path.join(data.dirs.across, data.name+"_seedlog.tmp"),
         os.path.join(data.dirs.across, data.name+".tmparrs.h5"),
+        os.path.join(data.dirs.across, data.name+".tmparrs.tmpfull.h5"),
         os.path.join(data.dirs.across, data.name+".tmp.indels.hdf5"),
         ]
     for rfile in removal:
         if os.path.exists(rfile):
             os.remove(rfile)
 
+    ## remove cluster shard files
+    for tmp in glob.glob(os.path.join(data.dirs.across, data.name+"_shard*.tmp")):
+        os.remove(tmp)
+
     ## remove singlecat related h5 files
     smpios = glob.glob(os.path.join(data.dirs.across, '*.tmp.h5'))
+    smpios += glob.glob(os.path.join(data.dirs.across, '*.tmp.h5.part'))
     for smpio in smpios:
         if os.path.exists(smpio):
             os.remove(smpio)
@@ -546,6 +546,63 @@ def storealleles(consens, hidx, alleles):
 
 
 
+def build_refindex(chroms):
+    """
+    Returns the row indices of reference-mapped loci sorted by (chrom, start,
+    end). The chroms array is (nloci, 3) as stored in the catg database.
+    Anonymous loci (chrom < 0) and empty rows (chrom == 0) are not indexed.
+    """
+    mapped = np.where(chroms[:, 0] > 0)[0]
+    order = np.lexsort((chroms[mapped, 2], chroms[mapped, 1], chroms[mapped, 0]))
+    return mapped[order]
+
+
+
+def get_maxspan(chroms, refidx):
+    """ returns the length of the longest indexed interval """
+    if not refidx.size:
+        return 0
+    return int((chroms[refidx, 2] - chroms[refidx, 1]).max())
+
+
+
+def query_refindex(chroms, refidx, maxspan, chrom, start, end):
+    """
+    Returns row indices of loci overlapping the region (chrom, start, end),
+    in sorted order. Uses binary search on the sorted interval index, so
+    loci starting further than maxspan to the left of 'start' are never
+    examined.
+    """
+    schrom = chroms[refidx, 0]
+    left = np.searchsorted(schrom, chrom, side="left")
+    right = np.searchsorted(schrom, chrom, side="right")
+
+    ## candidate loci start in [start - maxspan, end)
+    starts = chroms[refidx[left:right], 1]
+    lidx = left + np.searchsorted(starts, start - maxspan, side="left")
+    ridx = left + np.searchsorted(starts, end, side="left")
+    hits = refidx[lidx:ridx]
+    return hits[chroms[hits, 2] > start]
+
+
+
+def load_refindex(handle):
+    """
+    Returns (chroms, refidx, maxspan) from a catg database file. If the
+    file was written before the index existed it is built here instead.
+    """
+    with h5py.File(handle, 'r') as io5:
+        chroms = io5["chroms"][:]
+        if "refindex" in io5:
+            refidx = io5["refindex"][:]
+            maxspan = int(io5["refindex"].attrs["maxspan"])
+        else:
+            refidx = build_refindex(chroms)
+            maxspan = get_maxspan(chroms, refidx)
+    return chroms, refidx, maxspan
+
+
+
 def cleanup(data, sample, statsdicts):
     """
     cleaning up. optim is the size (nloci) of tmp arrays
@@ -601,6 +658,14 @@ def cleanup(data, sample, statsdicts):
             io5.close()
             os.remove(icat)
 
+        ## index the mapped loci by position so that step 6 can query and
+        ## merge loci by reference coordinates without reparsing names.
+        if isref:
+            chroms = dchrom[:]
+            refidx = build_refindex(chroms)
+            dridx = ioh5.create_dataset("refindex", data=refidx, dtype=np.int64)
+            dridx.attrs["maxspan"] = get_maxspan(chroms, refidx)
+
     ## store the handle to the Sample
     sample.files.database = handle1
 
@@ -16,6 +16,7 @@ import tempfile
 import itertools
 import ipyrad
 import gzip
+import numpy as np
 from collections import defaultdict
 
 try:
@@ -888,6 +889,126 @@ def clustdealer(pairdealer, optim):
 
 
 
+def get_catgs(io5, start, end, sidx=None):
+    """
+    Returns a dense (nloci, nsamples, maxlen, 4) array of catg counts for loci
+    start:end of an open clust database, for only the samples selected by 
+    sidx (a bool mask or int indices). Databases with the sparse catg layout
+    store only present (locus, sample) cells in CSR form (catg_indptr, 
+    catg_sidx, catg_data), which are inflated here for the selected samples.
+    """
+    if "catg_indptr" not in io5:
+        catgs = io5["catgs"][start:end]
+        if sidx is not None:
+            catgs = catgs[:, sidx]
+        return catgs
+
+    nloci, nsamples = io5["seqs"].shape[:2]
+    end = min(end, nloci)
+    indptr = io5["catg_indptr"][start:end+1]
+    csidx = io5["catg_sidx"][indptr[0]:indptr[-1]]
+    cdata = io5["catg_data"][indptr[0]:indptr[-1]]
+    rows = np.repeat(np.arange(end-start), np.diff(indptr))
+
+    ## output column of each selected sample, -1 if not selected
+    cols = np.arange(nsamples)
+    if sidx is not None:
+        cols = cols[sidx]
+    colmap = np.zeros(nsamples, dtype=np.int64) - 1
+    colmap[cols] = np.arange(cols.shape[0])
+    keep = colmap[csidx] >= 0
+
+    catgs = np.zeros((end-start, cols.shape[0]) + cdata.shape[1:], 
+                     dtype=np.uint32)
+    catgs[rows[keep], colmap[csidx[keep]]] = cdata[keep]
+    return catgs
+
+
+
+
+## nibble (4-bit) codes for bases in the seqs dataset. Code 0 is N so that
+## empty cells are zeros. Lowercase (allele phase) is stored as a separate 
+## bit, except for 'n' which is the pair separator. Codes 13-15 are unused.
+NIBBLES = "NACGTRYSWKM-n"
+NIBBLE_DECODE = np.zeros(16, dtype=np.uint8) + ord("N")
+NIBBLE_DECODE[:len(NIBBLES)] = [ord(i) for i in NIBBLES]
+NIBBLE_UPPER = NIBBLE_DECODE.copy()
+NIBBLE_UPPER[NIBBLES.index("n")] = ord("N")
+NIBBLE_ENCODE = np.zeros(256, dtype=np.uint8)
+for _code, _base in enumerate(NIBBLES):
+    NIBBLE_ENCODE[ord(_base)] = _code
+    if _base not in "-n":
+        NIBBLE_ENCODE[ord(_base.lower())] = _code
+NIBBLE_PHASE = np.zeros(256, dtype=np.bool_)
+NIBBLE_PHASE[[ord(i) for i in "acgtryswkm"]] = True
+
+
+
+def encode_seqs(seqs):
+    """
+    Packs an |S1 array (..., maxlen) of bases into 4-bit codes, two bases per
+    byte (..., ceil(maxlen/2)), and returns it with the packed lowercase 
+    (phase) bits (..., ceil(maxlen/8)).
+    """
+    ints = seqs.view(np.uint8)
+    codes = NIBBLE_ENCODE[ints]
+    if codes.shape[-1] % 2:
+        pad = np.zeros(codes.shape[:-1] + (1, ), dtype=np.uint8)
+        codes = np.concatenate([codes, pad], axis=-1)
+    packed = (codes[..., 0::2] << 4) | codes[..., 1::2]
+    phase = np.packbits(NIBBLE_PHASE[ints], axis=-1)
+    return packed, phase
+
+
+
+def decode_seqs(packed, maxlen, phase=None):
+    """
+    Unpacks 4-bit codes into an |S1 array (..., maxlen). Without the packed
+    phase bits all bases (and the 'n' separator) are uppercase, the same as
+    np.char.upper on the |S1 seqs.
+    """
+    codes = np.zeros(packed.shape[:-1] + (packed.shape[-1] * 2, ), 
+                     dtype=np.uint8)
+    codes[..., 0::2] = packed >> 4
+    codes[..., 1::2] = packed & 15
+    if phase is None:
+        return NIBBLE_UPPER[codes[..., :maxlen]].view("S1")
+    seqs = NIBBLE_DECODE[codes[..., :maxlen]]
+    lower = np.unpackbits(phase, axis=-1)[..., :maxlen].astype(np.bool_)
+    seqs[lower] += 32
+    return seqs.view("S1")
+
+
+
+def get_seqs(io5, start, end, sidx=None, upper=True):
+    """
+    Returns an |S1 array of seqs for loci start:end of an open clust database,
+    for the samples selected by sidx (a bool mask or int indices). Bases are
+    uppercase unless upper=False, which keeps the lowercase allele phase. 
+    Reads both the |S1 and the nibble encoded seqs datasets.
+    """
+    dset = io5["seqs"]
+    if dset.attrs.get("encoding", "S1") != "nibble":
+        seqs = dset[start:end]
+        if sidx is not None:
+            seqs = seqs[:, sidx]
+        if upper:
+            seqs = np.char.upper(seqs)
+        return seqs
+
+    packed = dset[start:end]
+    phase = None
+    if not upper:
+        phase = io5["phase"][start:end]
+    if sidx is not None:
+        packed = packed[:, sidx]
+        if phase is not None:
+            phase = phase[:, sidx]
+    return decode_seqs(packed, dset.attrs["maxlen"], phase)
+
+
+
+
 def progressbar(njobs, finished, msg="", spacer="  "):
     """ prints a progress bar """
     if njobs:
@@ -21,23 +21,27 @@ from __future__ import print_function
 import pandas as pd
 import numpy as np
 import datetime
-import shutil
+import hashlib
 import numba
-import copy
+import pysam
+import heapq
+import itertools
 import time
 import glob
 import gzip
 import re
 import os
 import io
-from collections import Counter, OrderedDict
+import uuid
+from collections import Counter
 from ipyrad import __version__
 from util import *
 
+## BGZF writer of newer pysam versions, else the VCF is compressed after.
 try:
-    import subprocess32 as sps
+    from pysam.libcbgzf import BGZFile
 except ImportError:
-    import subprocess as sps
+    BGZFile = None
 
 import logging
 LOGGER = logging.getLogger(__name__)
@@ -64,6 +68,7 @@ OUTPUT_FORMATS = {'l': 'loci',
                   'G': "gphocs",
                   'u': 'usnps',
                   'v': 'vcf',
+                  'h': 'genos',
                   't': 'treemix',
                   'm': 'migrate-n'}
                   #'V': 'vcfFull',   ## currently hidden
@@ -95,24 +100,14 @@ def run(data, samples, force, ipyclient):
     ## output and build a stats file.
     data.outfiles.loci = os.path.join(data.dirs.outfiles, data.name+".loci")
     data.outfiles.alleles = os.path.join(data.dirs.outfiles, data.name+".alleles.loci")
-    make_loci_and_stats(data, samples, ipyclient)
+    data.outfiles.locindex = os.path.join(data.dirs.outfiles, data.name+".loci.h5")
 
-    ## OPTIONAL OUTPUTS:
-    output_formats = data.paramsdict["output_formats"]
-
-    ## held separate from *output_formats cuz it's big and parallelized
-    if any([x in output_formats for x in ["v", "V"]]):
-        full = "V" in output_formats
-        try:
-            make_vcf(data, samples, ipyclient, full=full)
-        except IPyradWarningExit as inst:
-            ## Something fsck vcf build. Sometimes this is simply a memory
-            ## issue, so trap the exception and allow it to try building
-            ## the other output formats.
-            print("  Error building vcf. See ipyrad_log.txt for details.")
-            LOGGER.error(inst)
+    ## The loci, stats, and the OPTIONAL OUTPUTS that are built from chunks 
+    ## of loci (vcf, genos, and arrays for other formats) in one pass.
+    make_chunk_outputs(data, samples, ipyclient)
 
-    ## make other array-based formats, recalcs keeps and arrays
+    ## make other array-based formats from the arrays
+    output_formats = data.paramsdict["output_formats"]
     make_outfiles(data, samples, output_formats, ipyclient)
 
     ## print friendly message
@@ -344,9 +339,6 @@ def filter_all_clusters(data, samples, ipyclient):
     Open the clust_database HDF5 array with seqs, catg, and filter data. 
     Fill the remaining filters.
     """
-    ## create loadbalanced ipyclient
-    lbview = ipyclient.load_balanced_view()
-
     ## get chunk size from the HD5 array and close
     with h5py.File(data.clust_database, 'r') as io5:
         ## the size of chunks for reading/writing
@@ -356,11 +348,6 @@ def filter_all_clusters(data, samples, ipyclient):
         ## the total number of loci
         nloci = io5["seqs"].shape[0]
 
-    ## make a tmp directory for saving chunked arrays to
-    chunkdir = os.path.join(data.dirs.outfiles, data.name+"_tmpchunks")
-    if not os.path.exists(chunkdir):
-        os.mkdir(chunkdir)
-
     ## get the indices of the samples that we are going to include
     sidx = select_samples(dbsamples, samples)
     ## do the same for the populations samples
@@ -379,122 +366,246 @@ def filter_all_clusters(data, samples, ipyclient):
     LOGGER.info("samples %s \n, dbsamples %s \n, sidx %s \n",
                 samples, dbsamples, sidx)
 
-    ## Put inside a try statement so we can delete tmpchunks
+    ## filter stats are cached in two levels. The sites cache holds what
+    ## depends only on the seqs of the selected samples, and is the only 
+    ## step that reads the seqs. The stats cache holds the edges and filter
+    ## stats for the edge params, and is recomputed from the sites cache 
+    ## when these change (e.g., min_samples_locus sets the edge minimum).
+    ## Cache files are named by the hash of what they depend on, so that
+    ## branches with different samples or params do not overwrite each 
+    ## other's, and a sweep over params keeps the stats of each setting.
+    sitesig = get_sites_signature(data, dbsamples, sidx)
+    statsig = get_stats_signature(data, sitesig)
+    sitesfile = get_stats_file(data, "sites", sitesig)
+    statsfile = get_stats_file(data, "stats", statsig)
+
+    ## Put inside a try statement to log when filtering finished
     try:
-        ## load a list of args to send to Engines. Each arg contains the index
-        ## to sample optim loci from catg, seqs, filters &or edges, which will
-        ## be loaded on the remote Engine.
+        if not stats_cached(sitesfile, sitesig):
+            make_stats_file(data, site_stacks, (data, sidx), optim, nloci, 
+                            get_sites_shapes(data, len(sidx), nloci), 
+                            sitesfile, sitesig, 
+                            " scanning loci         | {} | s7 |", ipyclient)
+        else:
+            LOGGER.info("using cached site stats %s", sitesfile)
+        if not stats_cached(statsfile, statsig):
+            make_stats_file(data, filter_stacks, (data, sitesfile), optim, nloci, 
+                            get_filter_shapes(data, nloci), 
+                            statsfile, statsig, 
+                            " filtering loci        | {} | s7 |", ipyclient)
+        else:
+            LOGGER.info("using cached filter stats %s", statsfile)
+
+        ## apply the filters to the stats, and fill the filters, edges, snps
+        ## and coverage arrays. The filter array order is ["duplicates", 
+        ## "max_indels", "max_snps", "max_shared_hets", "min_samps", 
+        ## "max_alleles"], dups is already filled.
+        params = get_filter_params(data, len(sidx))
+        popmask = params[0]
+
+        ## the per-population coverage is cached for the populations, so
+        ## only changing popmins does not recount it.
+        popsig = str([sitesig, popmask.astype(int).tolist()])
+        popfile = get_stats_file(data, "popcov", popsig)
+        if not stats_cached(popfile, popsig):
+            make_popcov_file(sitesfile, popfile, popsig, popmask, optim)
 
-        ## create job queue
-        start = time.time()
-        printstr = " filtering loci        | {} | s7 |"
-        fasyncs = {}
-        submitted = 0
-        while submitted < nloci:
-            hslice = np.array([submitted, submitted+optim])
-            fasyncs[hslice[0]] = lbview.apply(filter_stacks, *(data, sidx, hslice))
-            submitted += optim
-
-        ## run filter_stacks on all chunks
+        io5 = h5py.File(data.database, 'r+')
+        so5 = h5py.File(statsfile, 'r')
+        to5 = h5py.File(sitesfile, 'r')
+        po5 = h5py.File(popfile, 'r')
+        for hslice in xrange(0, nloci, optim):
+            stats = {key: so5[key][hslice:hslice+optim] for key in STATS}
+            stats["nalleles"] = to5["nalleles"][hslice:hslice+optim]
+            stats["popcov"] = po5["popcov"][hslice:hslice+optim]
+
+            ## store to DB by chunk, splits are already in the edges array.
+            hslab = slice(hslice, hslice+optim)
+            filters = io5["filters"][hslab]
+            filters[:, 1:] += filter_stats(stats, *params[1:])
+            io5["filters"][hslab] = filters
+            io5["edges"][hslab] = so5["edges"][hslab]
+            io5["snps"][hslab] = so5["snps"][hslab]
+            io5["coverage"][hslab] = so5["coverage"][hslab]
+        io5.close()
+        so5.close()
+        to5.close()
+        po5.close()
+
+    finally:
+        LOGGER.info("finished filtering")
+
+
+
+def get_stats_file(data, kind, signature):
+    """
+    Returns the path of a stats cache of this kind built for signature. 
+    Caches are kept next to the clust database so that branches with the
+    same samples and params share them, and are named by a hash of the 
+    signature so that branches with different ones do not.
+    """
+    prefix = os.path.splitext(data.clust_database)[0]
+    if not isinstance(signature, bytes):
+        signature = signature.encode("utf-8")
+    sighash = hashlib.md5(signature).hexdigest()[:16]
+    return "{}.{}-{}.hdf5".format(prefix, kind, sighash)
+
+
+
+def get_sites_signature(data, dbsamples, sidx):
+    """
+    Returns a string of everything that the site stats depend on: the 
+    samples and the clust database file.
+    """
+    return str([[dbsamples[i] for i in sidx],
+                os.path.getmtime(data.clust_database), 
+                os.path.getsize(data.clust_database)])
+
+
+
+def get_stats_signature(data, sitesig):
+    """
+    Returns a string of everything that the filter stats depend on: the 
+    edge params and the site stats.
+    """
+    edgetrims, cuts, minedge, ispair = get_edge_params(data)
+    return str([edgetrims.tolist(), cuts.tolist(), int(minedge), ispair,
+                sitesig])
+
+
+
+def stats_cached(statsfile, signature):
+    """ returns True if a stats cache exists and was built for signature """
+    if not os.path.exists(statsfile):
+        return False
+    with h5py.File(statsfile, 'r') as so5:
+        return so5.attrs.get("signature") == signature
+
+
+
+def get_sites_shapes(data, nsamples, nloci):
+    """
+    Returns the {name: (shape, dtype)} of the site stats computed by 
+    'site_stacks()'. Per sample masks are packed bits along the sites axis.
+    """
+    with h5py.File(data.database, 'r') as io5:
+        nsites = io5["snps"].shape[1]
+    return {
+        "hasdata": ((nloci, (nsamples + 7) // 8), np.uint8),
+        "nalleles": ((nloci,), np.int16),
+        "nhets": ((nloci, nsites), np.uint16),
+        "snpraw": ((nloci, nsites, 2), np.bool_),
+        "nmask": ((nloci, nsamples, (nsites + 7) // 8), np.uint8),
+        "gapmask": ((nloci, nsamples, (nsites + 7) // 8), np.uint8)}
+
+
+
+def get_filter_shapes(data, nloci):
+    """
+    Returns the {name: (shape, dtype)} of the edges, snps, coverage and 
+    filter stats computed by 'filter_stacks()'.
+    """
+    with h5py.File(data.database, 'r') as io5:
+        shapes = {key: (io5[key].shape, io5[key].dtype) \
+                  for key in ["edges", "snps", "coverage"]}
+    shapes.update({
+        "efilter": ((nloci,), np.bool_),
+        "maxhets": ((nloci,), np.int16),
+        "nindels": ((nloci, 2), np.int16),
+        "nsnps": ((nloci, 2), np.int16)})
+    return shapes
+
+
+
+def make_popcov_file(sitesfile, popfile, signature, popmask, optim):
+    """
+    Counts the samples with data in each population at each locus from the
+    sites cache with 'pop_coverage()' and stores them in a popcov cache.
+    The cache is written to a tmp file and renamed when complete.
+    """
+    tmpfile = "{}.{}.tmp".format(popfile, uuid.uuid4().hex)
+    with h5py.File(sitesfile, 'r') as to5, h5py.File(tmpfile, 'w') as po5:
+        nloci = to5["nalleles"].shape[0]
+        popcov = po5.create_dataset("popcov", (nloci, popmask.shape[0]), 
+                                    dtype=np.uint16, 
+                                    chunks=(optim, popmask.shape[0]),
+                                    compression="gzip")
+        for hslice in xrange(0, nloci, optim):
+            hasdata = np.unpackbits(to5["hasdata"][hslice:hslice+optim], 
+                                    axis=1)[:, :popmask.shape[1]]
+            popcov[hslice:hslice+optim] = pop_coverage(hasdata, popmask)
+        po5.attrs["signature"] = signature
+    os.rename(tmpfile, popfile)
+
+
+
+def make_stats_file(data, func, args, optim, nloci, shapes, statsfile, 
+    signature, printstr, ipyclient):
+    """
+    Runs func(*args, hslice) on engines for each chunk of loci, which 
+    returns a dict of arrays keyed like shapes, and stores them in a stats 
+    cache. Chunks are written as they finish, so only finished chunks are 
+    held in memory. The cache is written to a tmp file of this run and 
+    renamed when complete, so branches that build the same cache at the 
+    same time do not write to the same file.
+    """
+    ## create loadbalanced ipyclient
+    lbview = ipyclient.load_balanced_view()
+
+    ## create job queue
+    start = time.time()
+    fasyncs = {}
+    submitted = 0
+    while submitted < nloci:
+        hslice = np.array([submitted, submitted+optim])
+        fasyncs[hslice[0]] = lbview.apply(func, *(args + (hslice, )))
+        submitted += optim
+
+    ## the datasets of the cache
+    tmpfile = "{}.{}.tmp".format(statsfile, uuid.uuid4().hex)
+    so5 = h5py.File(tmpfile, 'w')
+    for key, (shape, dtype) in shapes.items():
+        so5.create_dataset(key, shape, dtype=dtype, 
+                           chunks=(optim,) + tuple(shape[1:]), 
+                           compression="gzip")
+
+    ## store each chunk as it finishes
+    total = len(fasyncs)
+    try:
         while 1:
-            readies = [i.ready() for i in fasyncs.values()]
+            for hslice in [i for i in fasyncs if fasyncs[i].ready()]:
+                if not fasyncs[hslice].successful():
+                    LOGGER.error("error in %s on chunk %s: %s", func.__name__,
+                                 hslice, fasyncs[hslice].exception())
+                    raise IPyradWarningExit(
+                        "error in {} on chunk {}: {}"\
+                        .format(func.__name__, hslice, 
+                                fasyncs[hslice].exception()))
+                job = fasyncs.pop(hslice)
+                stats = job.get()
+                ## drop the client's cached copy of the result
+                for msg_id in job.msg_ids:
+                    ipyclient.results.pop(msg_id, None)
+                del job
+                for key in shapes:
+                    so5[key][hslice:hslice+optim] = stats[key]
+                del stats
+
             elapsed = datetime.timedelta(seconds=int(time.time()-start))
-            progressbar(len(readies), sum(readies),
+            progressbar(total, total - len(fasyncs),
                 printstr.format(elapsed), spacer=data._spacer)
-            time.sleep(0.1)
-            if sum(readies) == len(readies):
+            if not fasyncs:
                 print("")
                 break
-
-        ## raise error if any jobs failed
-        for async in fasyncs:
-            if not fasyncs[async].successful():
-                LOGGER.error("error in filter_stacks on chunk %s: %s",
-                             async, fasyncs[async].exception())
-                raise IPyradWarningExit("error in filter_stacks on chunk {}: {}"\
-                             .format(async, fasyncs[async].exception()))
-        ipyclient.purge_everything()
-
-        ## get all the saved tmp arrays for each slice
-        tmpsnp = glob.glob(os.path.join(chunkdir, "snpf.*.npy"))
-        tmphet = glob.glob(os.path.join(chunkdir, "hetf.*.npy"))
-        tmpmin = glob.glob(os.path.join(chunkdir, "minf.*.npy"))
-        tmpedg = glob.glob(os.path.join(chunkdir, "edgf.*.npy"))
-        tmppld = glob.glob(os.path.join(chunkdir, "pldf.*.npy"))
-        tmpind = glob.glob(os.path.join(chunkdir, "indf.*.npy"))
-
-        ## sort array files within each group
-        arrdict = OrderedDict([('ind', tmpind),
-                               ('snp', tmpsnp), ('het', tmphet),
-                               ('min', tmpmin), ('edg', tmpedg),
-                               ('pld', tmppld)])
-        for arrglob in arrdict.values():
-            arrglob.sort(key=lambda x: int(x.rsplit(".")[-2]))
-
-        ## re-load the full filter array who's order is
-        ## ["duplicates", "max_indels", "max_snps", "max_hets", "min_samps", "max_alleles"]
-        io5 = h5py.File(data.database, 'r+')
-        superfilter = np.zeros(io5["filters"].shape, io5["filters"].dtype)
-
-        ## iterate across filter types (dups is already filled)
-        ## we have [4,4] b/c minf and edgf both write to minf
-        for fidx, ftype in zip([1, 2, 3, 4, 4, 5], arrdict.keys()):
-            ## fill in the edgefilters
-            for ffile in arrdict[ftype]:
-                ## grab a file and get it's slice
-                hslice = int(ffile.split(".")[-2])
-                ## load in the array
-                arr = np.load(ffile)
-                ## store slice into full array (we use += here because the minf
-                ## and edgf arrays both write to the same filter).
-                superfilter[hslice:hslice+optim, fidx] += arr
-
-        ## store to DB
-        io5["filters"][:] += superfilter
-        del arr, superfilter
-
-        ## store the other arrayed values (edges, snps)
-        edgarrs = glob.glob(os.path.join(chunkdir, "edgearr.*.npy"))
-        snparrs = glob.glob(os.path.join(chunkdir, "snpsarr.*.npy"))
-
-        ## sort array files within each group
-        arrdict = OrderedDict([('edges', edgarrs), ('snps', snparrs)])
-        for arrglob in arrdict.values():
-            arrglob.sort(key=lambda x: int(x.rsplit(".")[-2]))
-
-        ## fill the edge array, splits are already in there.
-        superedge = np.zeros(io5['edges'].shape, io5['edges'].dtype)
-        for ffile in arrdict['edges']:
-            ## grab a file and get it's slice
-            hslice = int(ffile.split(".")[-2])
-            ## load in the array w/ shape (hslice, 5)
-            arr = np.load(ffile)
-            ## store slice into full array
-            superedge[hslice:hslice+optim, :] = arr
-        io5["edges"][:, :] = superedge
-        del arr, superedge
-
-        ## fill the snps array. shape= (nloci, maxlen, 2)
-        supersnps = np.zeros(io5['snps'].shape, io5['snps'].dtype)
-        for ffile in arrdict['snps']:
-            ## grab a file and get it's slice
-            hslice = int(ffile.split(".")[-2])
-            ## load in the array w/ shape (hslice, maxlen, 2)
-            arr = np.load(ffile)
-            ## store slice into full array
-            LOGGER.info("shapes, %s %s", supersnps.shape, arr.shape)
-            supersnps[hslice:hslice+optim, :, :] = arr
-        io5["snps"][:] = supersnps
-        del arr
-        io5.close()
-
-    finally:
-        ## clean up the tmp files/dirs even if we failed.
-        try:
-            LOGGER.info("finished filtering")
-            shutil.rmtree(chunkdir)
-        except (IOError, OSError):
-            pass
+            time.sleep(0.1)
+        so5.attrs["signature"] = signature
+    except:
+        so5.close()
+        os.remove(tmpfile)
+        raise
+    so5.close()
+    ipyclient.purge_everything()
+    os.rename(tmpfile, statsfile)
 
 
 
@@ -513,15 +624,17 @@ def padnames(names):
 
 
 
-## incorporating samples...
-def make_loci_and_stats(data, samples, ipyclient):
+def make_chunk_outputs(data, samples, ipyclient):
     """
-    Makes the .loci file from h5 data base. Iterates by optim loci at a
-    time and write to file. Also makes alleles file if requested.
+    Builds the outputs that are made from chunks of filtered loci (loci,
+    alleles, stats, vcf, genos, and the arrays for other formats) in one
+    pass over the databases. Each chunk is read once on an engine and fed 
+    to the encoders of the requested outputs, and their results are passed
+    to the output sinks in locus order. Adding an output is adding a sink.
     """
-    ## start vcf progress bar
+    ## start progress bar
     start = time.time()
-    printstr = " building loci/stats   | {} | s7 |"
+    printstr = " building outputs      | {} | s7 |"
     elapsed = datetime.timedelta(seconds=int(time.time()-start))
     progressbar(20, 0, printstr.format(elapsed), spacer=data._spacer)
 
@@ -531,113 +644,503 @@ def make_loci_and_stats(data, samples, ipyclient):
         optim = io5["seqs"].attrs["chunksize"][0]
         nloci = io5["seqs"].shape[0]
         anames = io5["seqs"].attrs["samples"]
-
-    ## get name and snp padding
-    pnames, snppad = padnames(anames)
     snames = [i.name for i in samples]
-    smask = np.array([i not in snames for i in anames])
-
-    ## keep track of how many loci from each sample pass all filters
-    samplecov = np.zeros(len(anames), dtype=np.int32)
+    names = [i for i in anames if i in snames]
+    sidx = np.array([i in snames for i in anames])
 
-    ## set initial value to zero for all values above min_samples_locus
-    #for cov in range(data.paramsdict["min_samples_locus"], len(anames)+1):
-    locuscov = Counter()
-    for cov in range(len(anames)+1):
-        locuscov[cov] = 0
+    ## the sinks of requested outputs, loci are always built
+    formats = data.paramsdict["output_formats"]
+    sinks = [LociSink(data, samples, anames, optim, nloci)]
+    if any(i in formats for i in "vV"):
+        sinks.append(VcfSink(data, names, "V" in formats))
+    if "h" in formats:
+        sinks.append(GenosSink(data, names, optim))
+    if any(i in formats for i in "pnsukg"):
+        sinks.append(ArraysSink(data, sidx, optim))
+    encoders = [(i.name, i.args) for i in sinks]
 
-    ## client for sending jobs to parallel engines
+    ## send jobs in chunks
     lbview = ipyclient.load_balanced_view()
+    asyncs = {}
+    for chunk in xrange(0, nloci, optim):
+        args = (data, optim, sidx, chunk, encoders)
+        asyncs[chunk] = lbview.apply(chunk_outputs, *args)
+    njobs = len(asyncs)
 
-    ## send jobs in chunks
-    loci_asyncs = {}
-    for istart in xrange(0, nloci, optim):
-        args = [data, optim, pnames, snppad, smask, istart, samplecov, locuscov, 1]
-        loci_asyncs[istart] = lbview.apply(locichunk, args)
+    ## pass results to the sinks in order as they finish. tmp files get left 
+    ## behind and jobs are left running when interrupted, so we wrap it.
+    try:
+        for chunk in sorted(asyncs):
+            while not asyncs[chunk].ready():
+                elapsed = datetime.timedelta(seconds=int(time.time()-start))
+                progressbar(njobs, njobs-len(asyncs), printstr.format(elapsed), 
+                            spacer=data._spacer)
+                time.sleep(0.1)
+            if not asyncs[chunk].successful():
+                raise IPyradWarningExit(" error building outputs [{}]: {}"\
+                      .format(chunk, asyncs[chunk].exception()))
+            job = asyncs.pop(chunk)
+            results = job.get()
+            ## drop the client's cached copy of the result
+            for msg_id in job.msg_ids:
+                ipyclient.results.pop(msg_id, None)
+            del job
+            for sink in sinks:
+                sink.add(chunk, results[sink.name])
+            del results
 
-    while 1:
-        done = [i.ready() for i in loci_asyncs.values()]
         elapsed = datetime.timedelta(seconds=int(time.time()-start))
-        progressbar(len(done), sum(done), printstr.format(elapsed), spacer=data._spacer)
-        time.sleep(0.1)
-        if len(done) == sum(done):
-            print("")
-            break
+        progressbar(njobs, njobs, printstr.format(elapsed), spacer=data._spacer)
+        print("")
+        ipyclient.purge_everything()
 
-    ## check for errors
-    for job in loci_asyncs:
-        if loci_asyncs[job].ready() and not loci_asyncs[job].successful():
-            LOGGER.error("error in building loci [%s]: %s",
-                         job, loci_asyncs[job].exception())
-            raise IPyradWarningExit(loci_asyncs[job].exception())
-
-    ## concat and cleanup
-    results = [i.get() for i in loci_asyncs.values()]
-    ## update dictionaries
-    for chunk in results:
-        samplecov += chunk[0]
-        locuscov.update(chunk[1])
-
-    ## get all chunk files
-    tmploci = glob.glob(data.outfiles.loci+".[0-9]*")
-    ## sort by start value
-    tmploci.sort(key=lambda x: int(x.split(".")[-1]))
-
-    ## write tmpchunks to locus file
-    locifile = open(data.outfiles.loci, 'w')
-    for tmploc in tmploci:
-        with open(tmploc, 'r') as inloc:
-            locdat = inloc.read()
-            locifile.write(locdat)
-            os.remove(tmploc)
-    locifile.close()
-
-    ## make stats file from data
-    make_stats(data, samples, samplecov, locuscov)
-
-    ## repeat for alleles output
-    if "a" in data.paramsdict["output_formats"]:
-
-        loci_asyncs = {}
-        for istart in xrange(0, nloci, optim):
-            args = [data, optim, pnames, snppad, smask, istart, samplecov, locuscov, 0]
-            loci_asyncs[istart] = lbview.apply(locichunk, args)
+    except:
+        ## make sure all future jobs are aborted and tmp files destroyed
+        for job in asyncs.values():
+            try:
+                job.cancel()
+            except Exception:
+                pass
+        for sink in sinks:
+            sink.abort()
+        raise
+
+    ## finish the outputs
+    for sink in sinks:
+        sink.close(lbview)
+
+
+
+def chunk_outputs(data, optim, sidx, start, encoders):
+    """
+    Runs the output encoders on a chunk of loci sharing one read of the 
+    chunk's database arrays. encoders is a list of (name, args) of the 
+    functions in ENCODERS, each called as func(data, cdata, *args). Returns
+    a dict of results by name, or of the exception raised by an encoder.
+    """
+    cdata = ChunkData(data, optim, sidx, start)
+    results = {}
+    for name, args in encoders:
+        try:
+            results[name] = ENCODERS[name](data, cdata, *args)
+        except Exception as inst:
+            LOGGER.error("error in %s output of chunk %s: %s", name, start, inst)
+            results[name] = inst
+    return results
+
+
+
+class ChunkData(object):
+    """
+    The database arrays of a chunk of loci. Each is read from the databases
+    on first use and kept, so that all outputs of the chunk share one read.
+    seqs (upper case) and lseqs (with the lowercase allele phase) are for
+    all samples in the database, catgs are for the sidx samples.
+    """
+    def __init__(self, data, optim, sidx, start):
+        self.data = data
+        self.sidx = sidx
+        self.start = start
+        self.end = start + optim
+        self._arrs = {}
+
+
+    def _read(self, dbase, key):
+        """ reads and keeps the chunk of a dataset in a database """
+        if key not in self._arrs:
+            with h5py.File(dbase, 'r') as io5:
+                self._arrs[key] = io5[key][self.start:self.end]
+        return self._arrs[key]
+
+
+    @property
+    def filters(self):
+        return self._read(self.data.database, "filters")
+
+    @property
+    def edges(self):
+        return self._read(self.data.database, "edges")
+
+    @property
+    def snps(self):
+        return self._read(self.data.database, "snps")
+
+    @property
+    def chroms(self):
+        return self._read(self.data.clust_database, "chroms")
+
+    @property
+    def keep(self):
+        """ bool mask of loci that passed all filters """
+        return self.filters.sum(axis=1) == 0
+
+
+    @property
+    def lseqs(self):
+        if "lseqs" not in self._arrs:
+            with h5py.File(self.data.clust_database, 'r') as io5:
+                self._arrs["lseqs"] = get_seqs(io5, self.start, self.end, upper=False)
+        return self._arrs["lseqs"]
+
+
+    @property
+    def seqs(self):
+        ## uppercase the phased seqs if they were already read
+        if "seqs" not in self._arrs:
+            if "lseqs" in self._arrs:
+                self._arrs["seqs"] = UPPERARR[self.lseqs.view(np.uint8)].view("S1")
+            else:
+                with h5py.File(self.data.clust_database, 'r') as io5:
+                    self._arrs["seqs"] = get_seqs(io5, self.start, self.end)
+        return self._arrs["seqs"]
+
+
+    @property
+    def catgs(self):
+        if "catgs" not in self._arrs:
+            with h5py.File(self.data.clust_database, 'r') as io5:
+                self._arrs["catgs"] = get_catgs(io5, self.start, self.end, self.sidx)
+        return self._arrs["catgs"]
+
+
+
+class OutputSink(object):
+    """
+    An output built by 'make_chunk_outputs()'. The function 'name' in 
+    ENCODERS is run on each chunk on engines with (data, cdata, *args), and
+    its results are passed to add() in locus order. close() is called when
+    all chunks are added, and abort() if the pass fails.
+    """
+    name = None
+    args = ()
+
+    def add(self, chunk, result):
+        if isinstance(result, Exception):
+            raise IPyradWarningExit(" error building {} [{}]: {}"\
+                  .format(self.name, chunk, result))
+        self.collect(chunk, result)
+
+    def collect(self, chunk, result):
+        pass
+
+    def close(self, lbview):
+        pass
+
+    def abort(self):
+        pass
+
+
+
+class LociSink(OutputSink):
+    """
+    The .loci file and its index, the .alleles.loci file if requested, and
+    the stats file. The byte offset of each chunk in the outputs is known 
+    from the filtered database, so engines write their chunk directly into 
+    the preallocated files.
+    """
+    name = "loci"
+
+    def __init__(self, data, samples, anames, optim, nloci):
+        self.data = data
+        self.samples = samples
+        self.anames = anames
+        self.results = []
+
+        ## get name and snp padding
+        pnames, snppad = padnames(anames)
+        snames = [i.name for i in samples]
+        smask = np.array([i not in snames for i in anames])
+
+        ## keep track of how many loci from each sample pass all filters
+        self.samplecov = np.zeros(len(anames), dtype=np.int32)
+
+        ## set initial value to zero for all values above min_samples_locus
+        self.locuscov = Counter()
+        for cov in range(len(anames)+1):
+            self.locuscov[cov] = 0
+
+        ## get the (offset, size) of each chunk and preallocate the outfiles
+        locichunks, allelechunks = get_chunk_offsets(data, optim, nloci, 
+                                                     len(pnames[0]), snppad)
+        outfiles = [(data.outfiles.loci, locichunks)]
+        if "a" in data.paramsdict["output_formats"]:
+            outfiles.append((data.outfiles.alleles, allelechunks))
+        else:
+            allelechunks = None
+        for outfile, chunks in outfiles:
+            with open(outfile, 'w') as out:
+                out.truncate(sum(i[1] for i in chunks.values()))
+        self.chunkstarts = {i: j[0] for i, j in locichunks.items()}
+        self.args = (pnames, snppad, smask, locichunks, allelechunks)
+
+
+    def collect(self, chunk, result):
+        ## update dictionaries
+        self.samplecov += result[0]
+        self.locuscov.update(result[1])
+        self.results.append(result)
+
+
+    def close(self, lbview):
+        ## write the random-access index of the locus file
+        write_loci_index(self.data, self.anames, self.results, self.chunkstarts)
 
+        ## make stats file from data
+        make_stats(self.data, self.samples, self.samplecov, self.locuscov)
+
+
+
+class VcfSink(OutputSink):
+    """
+    The .vcf file, and the full .vcf.gz if full. Engines write chunk files 
+    which are merged when all chunks are done. Errors are reported but the
+    other outputs are still built, since sometimes this is simply a memory
+    issue.
+    """
+    name = "vcf"
+
+    def __init__(self, data, names, full):
+        self.data = data
+        self.names = names
+        self.full = full
+        self.error = None
+        self.args = (full,)
+
+        ## create outputs for v and V, gzip V to be friendly
+        data.outfiles.vcf = os.path.join(data.dirs.outfiles, data.name+".vcf")
+        if full:
+            data.outfiles.VCF = os.path.join(data.dirs.outfiles, data.name+".vcf.gz")
+
+
+    def add(self, chunk, result):
+        if isinstance(result, Exception) and not self.error:
+            self.error = result
+
+
+    def abort(self):
+        ## make sure all tmp files are destroyed
+        vcfchunks = glob.glob(os.path.join(self.data.dirs.outfiles, "*.vcf.[0-9]*"))
+        for dfile in vcfchunks:
+            os.remove(dfile)
+
+
+    def close(self, lbview):
+        if self.error:
+            print("  Error building vcf. See ipyrad_log.txt for details.")
+            LOGGER.error(self.error)
+            self.abort()
+            return
+
+        ## writing full vcf file to disk
+        start = time.time()
+        printstr = " writing vcf file      | {} | s7 |"
+        res = lbview.apply(concat_vcf, *(self.data, self.names, self.full))
+        ogchunks = len(glob.glob(self.data.outfiles.vcf+".*"))
         while 1:
-            done = [i.ready() for i in loci_asyncs.values()]
             elapsed = datetime.timedelta(seconds=int(time.time()-start))
-            progressbar(len(done), sum(done),
-                " building alleles      | {} | s7 |".format(elapsed), 
-                spacer=data._spacer)
+            curchunks = len(glob.glob(self.data.outfiles.vcf+".*"))
+            progressbar(ogchunks, ogchunks-curchunks, printstr.format(elapsed), 
+                        spacer=self.data._spacer)
             time.sleep(0.1)
-            if len(done) == sum(done):
-                print("")
+            if res.ready():
                 break
+        elapsed = datetime.timedelta(seconds=int(time.time()-start))
+        progressbar(1, 1, printstr.format(elapsed), spacer=self.data._spacer)
+        print("")
+        if not res.successful():
+            print("  Error building vcf. See ipyrad_log.txt for details.")
+            LOGGER.error(res.exception())
+
+
+
+class GenosSink(OutputSink):
+    """
+    The HDF5 genotype store of snps laid out like scikit-allel calldata and
+    variants arrays. Chunks of snps are appended in locus order.
+    """
+    name = "genos"
+
+    def __init__(self, data, names, optim):
+        data.outfiles.genos = os.path.join(data.dirs.outfiles, data.name+".genos.hdf5")
+
+        ## datasets are resized as chunks are appended
+        nsamp = len(names)
+        self.shapes = [("calldata/GT", (nsamp, 2), np.int8), 
+                       ("calldata/CATG", (nsamp, 4), np.uint32),
+                       ("variants/CHROM", (), h5py.special_dtype(vlen=bytes)),
+                       ("variants/POS", (), np.int64),
+                       ("variants/REF", (), "S1"),
+                       ("variants/ALT", (3,), "S1"),
+                       ("variants/LOCUS", (), np.int64)]
+        self.io5 = h5py.File(data.outfiles.genos, 'w')
+        self.io5.create_dataset("samples", data=np.array(names).astype("S"))
+        for key, shape, dtype in self.shapes:
+            self.io5.create_dataset(key, (0,)+shape, dtype=dtype,
+                                    chunks=(min(optim, 10000),)+shape,
+                                    maxshape=(None,)+shape,
+                                    compression="gzip")
+
+
+    def collect(self, chunk, arrs):
+        nsnps = arrs["variants/POS"].shape[0]
+        init = self.io5["variants/POS"].shape[0]
+        for key, _, _ in self.shapes:
+            self.io5[key].resize(init + nsnps, axis=0)
+            self.io5[key][init:] = arrs[key]
+
+
+    def close(self, lbview):
+        self.io5.close()
+
+
+    def abort(self):
+        self.io5.close()
+
+
+
+class ArraysSink(OutputSink):
+    """
+    The tmp arrays that other formats are written from in 'make_outfiles()':
+    snparr, bisarr and maparr in a tmp h5, and the seq array (the phylip 
+    output, essentially) spilled to a flat file as it arrives, one row-major
+    (nsamples, width) block per chunk, so that it never has to be held in
+    memory. Writers read it back by row or by column block.
+    """
+    name = "arrays"
+
+    def __init__(self, data, sidx, optim):
+        ## load the h5 database and grab some needed info
+        maxlen = data._hackersonly["max_fragment_length"] + 20
+        self.args = (maxlen,)
+
+        ## shape of arrays is sidx, we will subsample h5 w/ sidx to match.
+        with h5py.File(data.database, 'r') as co5:
+            maxsnp = nkeeps = 0
+            for start in xrange(0, co5["filters"].shape[0], optim):
+                maxsnp += co5["snps"][start:start+optim].sum()
+                afilt = co5["filters"][start:start+optim]
+                nkeeps += np.sum(np.sum(afilt, axis=1) == 0)
+
+        ## ensure chunksize is not greater than array size
+        h5name = os.path.join(data.dirs.outfiles, "tmp-{}.h5".format(data.name))
+        spillname = os.path.join(data.dirs.outfiles, "tmp-{}.seqs".format(data.name))
+        self.tmp5 = h5py.File(h5name, 'w')
+        self.spill = open(spillname, 'wb')
+        self.tmp5.create_dataset("snparr", (sum(sidx), maxsnp), dtype="S1", 
+                                 chunks=(sum(sidx), max(1, min(maxsnp, optim))))
+        self.tmp5.create_dataset('bisarr', (sum(sidx), nkeeps), dtype="S1", 
+                                 chunks=(sum(sidx), max(1, min(nkeeps, optim))))
+        self.tmp5.create_dataset('maparr', (maxsnp, 4), dtype=np.uint32)
+
+        ## axis1 counters
+        self.seqblocks = []
+        self.snpidx = self.bisidx = self.mapidx = self.locidx = 0
+
+
+    def collect(self, chunk, result):
+        ## enter results in order
+        seqarr, snparr, bisarr, maparr = result
+        self.spill.write(np.ascontiguousarray(seqarr).tobytes())
+        self.seqblocks.append(seqarr.shape[1])
+        self.tmp5["snparr"][:, self.snpidx:self.snpidx+snparr.shape[1]] = snparr
+        self.snpidx += snparr.shape[1]
+        self.tmp5["bisarr"][:, self.bisidx:self.bisidx+bisarr.shape[1]] = bisarr
+        self.bisidx += bisarr.shape[1]
+
+        ## mapfile needs idxs summed, only bother if there is data
+        ## that passed filtering for this chunk
+        if maparr.shape[0]:
+            mapcopy = maparr.copy()
+            mapcopy[:, 0] += self.locidx
+            mapcopy[:, 3] += self.mapidx
+            self.tmp5["maparr"][self.mapidx:self.mapidx+maparr.shape[0], :] = mapcopy
+            self.locidx = mapcopy[-1, 0]
+            self.mapidx += mapcopy.shape[0]
+
+
+    def close(self, lbview):
+        ## number of filled columns in the snp arrays
+        self.tmp5["snparr"].attrs["end"] = self.snpidx
+        self.tmp5["bisarr"].attrs["end"] = self.bisidx
+
+        ## column widths of the blocks in the seqs file
+        self.tmp5.create_dataset("seqblocks", 
+                                 data=np.array(self.seqblocks, dtype=np.int64))
+        self.tmp5.close()
+        self.spill.close()
+
+
+    def abort(self):
+        self.tmp5.close()
+        self.spill.close()
+        os.remove(self.tmp5.filename)
+        os.remove(self.spill.name)
+
+
+
+def get_chunk_offsets(data, optim, nloci, namelen, snppad):
+    """
+    Returns dicts mapping the start of each chunk to its (offset, size) in
+    bytes in the .loci and .alleles.loci files, computed from the filters,
+    edges and coverage in the database without building the text.
+    """
+    locichunks = {}
+    allelechunks = {}
+    lociofs = alleleofs = 0
+    with h5py.File(data.database, 'r') as co5:
+        for start in xrange(0, nloci, optim):
+            afilt = co5["filters"][start:start+optim]
+            keep = np.where(np.sum(afilt, axis=1) == 0)[0]
+            aedge = co5["edges"][start:start+optim][keep]
+            acov = co5["coverage"][start:start+optim][keep]
+            locisize, allelesize = get_loci_sizes(
+                keep + start, aedge, acov, namelen, len(snppad))
+
+            locichunks[start] = (lociofs, int(locisize.sum()))
+            allelechunks[start] = (alleleofs, int(allelesize.sum()))
+            lociofs += locichunks[start][1]
+            alleleofs += allelechunks[start][1]
+    return locichunks, allelechunks
+
+
 
-        ## check for errors
-        for job in loci_asyncs:
-            if loci_asyncs[job].ready() and not loci_asyncs[job].successful():
-                LOGGER.error("error in building alleles [%s]: %s",
-                             job, loci_asyncs[job].exception())
-                raise IPyradWarningExit(loci_asyncs[job].exception())
+def get_loci_sizes(locids, edges, coverage, namelen, snppadlen):
+    """
+    Returns the byte length of each locus in the .loci and .alleles.loci
+    files as written by 'locichunk()', including the trailing newline. Each
+    sample name is padded to namelen, pairs are joined by a 4 char spacer.
+    """
+    edges = edges.astype(np.int64)
+    nsamp = coverage.astype(np.int64)
+    width = edges[:, 1] - edges[:, 0] + 1
+    pairs = edges[:, 4] > 0
+    width[pairs] += 4 + edges[pairs, 3] - edges[pairs, 2] + 1
 
-        ## concat and cleanup
-        #results = [i.get() for i in loci_asyncs.values()]
+    ## snp line: pad + snpstring + |locid|
+    snpline = snppadlen + width + np.char.str_len(locids.astype("S")) + 2
+    locisize = nsamp * (namelen + width + 1) + snpline + (nsamp == 0) + 1
+    ## two lines per sample with _0 or _1 added to names, loci with no 
+    ## samples are skipped, and the snp line starts with 2 more spaces
+    allelesize = 2 * nsamp * (namelen + width + 3) + snpline + 3
+    allelesize[nsamp == 0] = 0
+    return locisize, allelesize
 
-        ## get all chunk files
-        tmploci = glob.glob(data.outfiles.loci+".[0-9]*")
-        ## sort by start value
-        tmploci.sort(key=lambda x: int(x.split(".")[-1]))
 
-        ## write tmpchunks to locus file
-        locifile = open(data.outfiles.alleles, 'w')
-        for tmploc in tmploci:
-            with open(tmploc, 'r') as inloc:
-                locdat = inloc.read()
-                inalleles = get_alleles(locdat)
-                locifile.write(inalleles)
-                os.remove(tmploc)
-        locifile.close()
+
+def pwrite(fname, buff, offset):
+    """
+    Writes a string into an existing file at a byte offset without 
+    truncating it, so that engines can fill separate parts of one file.
+    """
+    fd = os.open(fname, os.O_WRONLY)
+    try:
+        ## os.pwrite is not available in py2
+        os.lseek(fd, offset, os.SEEK_SET)
+        while buff:
+            nbytes = os.write(fd, buff)
+            buff = buff[nbytes:]
+    finally:
+        os.close(fd)
 
 
 
@@ -671,56 +1174,114 @@ def get_alleles(locdat):
 
 
 
-def locichunk(args):
+def locichunk(data, cdata, pnames, snppad, smask, locichunks, allelechunks):
     """
-    Function from make_loci to apply to chunks. smask is sample mask.
+    Loci encoder of 'make_chunk_outputs()'. smask is sample mask. Writes the
+    chunk's loci, and alleles if requested, at its offsets in the outfiles,
+    which are given as dicts of (offset, size) by chunk start.
     """
-    ## parse args
-    data, optim, pnames, snppad, smask, start, samplecov, locuscov, upper = args
+    start = cdata.start
+    loci = locichunks[start]
+    alleles = allelechunks[start] if allelechunks else None
 
-    ## this slice
-    hslice = [start, start+optim]
+    ## sample and locus coverage of this chunk
+    samplecov = np.zeros(smask.shape[0], dtype=np.int32)
+    locuscov = Counter()
 
     ## get filter db info
-    co5 = h5py.File(data.database, 'r')
-    afilt = co5["filters"][hslice[0]:hslice[1], ]
-    aedge = co5["edges"][hslice[0]:hslice[1], ]
-    asnps = co5["snps"][hslice[0]:hslice[1], ]
+    aedge = cdata.edges
+    asnps = cdata.snps
 
-    ## get seqs db
-    io5 = h5py.File(data.clust_database, 'r')
-    if upper:
-        aseqs = np.char.upper(io5["seqs"][hslice[0]:hslice[1], ])
-    else:
-        aseqs = io5["seqs"][hslice[0]:hslice[1], ]
+    ## keep the lowercase allele phase for alleles, upper for loci
+    if alleles:
+        lseqs = cdata.lseqs
+        lstore = []
+    aseqs = cdata.seqs
 
     ## which loci passed all filters
-    keep = np.where(np.sum(afilt, axis=1) == 0)[0]
+    keep = np.where(cdata.keep)[0]
     store = []
 
+    ## locus index entries: length in bytes, samples present, nvar, npis
+    lens = np.zeros(keep.shape[0], dtype=np.int64)
+    covs = np.zeros((keep.shape[0], smask.shape[0]), dtype=np.bool_)
+    nsnps = np.zeros((keep.shape[0], 2), dtype=np.int32)
+
     ## write loci that passed after trimming edges, then write snp string
-    for iloc in keep:
+    for kidx, iloc in enumerate(keep):
         edg = aedge[iloc]
         #LOGGER.info("!!!!!! iloc edg %s, %s", iloc, edg)
         args = [iloc, pnames, snppad, edg, aseqs, asnps, smask, samplecov, locuscov, start]
         if edg[4]:
-            outstr, samplecov, locuscov = enter_pairs(*args)
-            store.append(outstr)
+            enter = enter_pairs
+            snps = np.concatenate((asnps[iloc, edg[0]:edg[1]+1], 
+                                   asnps[iloc, edg[2]:edg[3]+1]))
         else:
-            outstr, samplecov, locuscov = enter_singles(*args)
-            store.append(outstr)
-
-    ## write to file and clear store
-    tmpo = os.path.join(data.dirs.outfiles, data.name+".loci.{}".format(start))
-    with open(tmpo, 'w') as tmpout:
-        tmpout.write("\n".join(store) + "\n")
+            enter = enter_singles
+            snps = asnps[iloc, edg[0]:edg[1]+1]
+        outstr, samplecov, locuscov = enter(*args)
+        store.append(outstr)
+
+        ## same locus from phased seqs, counters are not updated again
+        if alleles:
+            largs = [iloc, pnames, snppad, edg, lseqs, asnps, smask, 
+                     samplecov, Counter(), start]
+            lstore.append(enter(*largs)[0])
+
+        ## each locus is followed by a newline in the file
+        lens[kidx] = len(outstr) + 1
+        nalln = np.all(aseqs[iloc, :, edg[0]:edg[1]+1] == "N", axis=1)
+        covs[kidx] = np.invert(nalln + smask)
+        nsnps[kidx] = snps.sum(axis=0)
+
+    ## write into this chunk's place in the outfiles
+    outputs = [(data.outfiles.loci, loci, "".join(i + "\n" for i in store))]
+    if alleles:
+        allelestr = get_alleles("".join(i + "\n" for i in lstore))
+        outputs.append((data.outfiles.alleles, alleles, allelestr.lstrip("\n")))
+    for outfile, (offset, size), outstr in outputs:
+        if len(outstr) != size:
+            raise IPyradWarningExit(
+                "chunk {} of {} is {} bytes, expected {}"\
+                .format(start, outfile, len(outstr), size))
+        pwrite(outfile, outstr, offset)
+
+    ## return sample counter and index entries
+    index = {"locid": keep + start, 
+             "length": lens, 
+             "samples": np.packbits(covs, axis=1),
+             "nvar": nsnps.sum(axis=1),
+             "npis": nsnps[:, 1]}
+    return samplecov, locuscov, start, index
+
+
+
+def write_loci_index(data, anames, results, chunkstarts):
+    """
+    Writes a companion index of the .loci file to an h5 file with the byte
+    offset and length of each locus record, its locus id (the number after
+    the snp string), the samples present as packed bits in the order of 
+    anames, and its number of variable and parsimony informative sites. 
+    Used by 'ipyrad.analysis.locireader' for random access to loci.
+    """
+    results = sorted(results, key=lambda x: x[2])
+    index = {}
+    for key in ["locid", "length", "samples", "nvar", "npis"]:
+        index[key] = np.concatenate([i[3][key] for i in results])
 
-    ## close handles
-    io5.close()
-    co5.close()
+    ## offsets of loci from the start of their chunk in the file
+    offsets = []
+    for chunk in results:
+        lens = chunk[3]["length"]
+        offsets.append(chunkstarts[chunk[2]] + np.cumsum(lens) - lens)
+    index["offset"] = np.concatenate(offsets).astype(np.int64)
 
-    ## return sample counter
-    return samplecov, locuscov, start
+    with h5py.File(data.outfiles.locindex, 'w') as io5:
+        for key in ["locid", "offset", "length", "nvar", "npis"]:
+            io5.create_dataset(key, data=index[key])
+        dsamp = io5.create_dataset("samples", data=index["samples"])
+        dsamp.attrs["names"] = np.array(anames).astype("S")
+        io5.attrs["nloci"] = index["locid"].shape[0]
 
 
 
@@ -856,6 +1417,12 @@ def init_arrays(data):
     edges.attrs["chunksize"] = chunks
     edges.attrs["names"] = ["R1_L", "R1_R", "R2_L", "R2_R", "sep"]
 
+    ## number of samples with data within the R1 edges of each locus, used
+    ## to size the loci outputs before they are written
+    coverage = io5.create_dataset("coverage", (nloci,), dtype=np.uint16,
+                                  chunks=(chunks,), compression="gzip")
+    coverage.attrs["chunksize"] = chunks
+
     ## xfer data from clustdb to finaldb
     edges[:, 4] = co5["splits"][:]
     filters[:, 0] = co5["duplicates"][:]
@@ -866,120 +1433,144 @@ def init_arrays(data):
 
 
 
-def filter_stacks(data, sidx, hslice):
+def site_stacks(data, sidx, hslice):
     """
-    Grab a chunk of loci from the HDF5 database. Apply filters and fill the
-    the filters boolean array.
-
-    The design of the filtering steps intentionally sacrifices some performance
-    for an increase in readability, and extensibility. Calling multiple filter
-    functions ends up running through the sequences per stack several times,
-    but I felt this design made more sense, and also will easily allow us to
-    add more filters in the future.
+    Grab a chunk of loci from the HDF5 database. Computes the site stats of
+    the chunk in one pass over the seqs with 'site_numba()': the samples 
+    with data, the hets and unmasked snps at each site, and the N and indel
+    masks of each sample. Edges and filter stats are computed from these by
+    'filter_stacks()' for any edge params without reading the seqs again.
     """
-    LOGGER.info("Entering filter_stacks")
+    LOGGER.info("Entering site_stacks")
 
-    ## open h5 handles
+    ## open h5 handle
     io5 = h5py.File(data.clust_database, 'r')
-    co5 = h5py.File(data.database, 'r')
-    ## get a chunk (hslice) of loci for the selected samples (sidx)
-    #superseqs = io5["seqs"][hslice[0]:hslice[1], sidx,]
-    ## get an int view of the seq array
-    #superints = io5["seqs"][hslice[0]:hslice[1], sidx, :].view(np.int8)
-
-    ## we need to use upper to skip lowercase allele storage
-    ## this slows down the rate of loading in data by a ton.
-    superints = np.char.upper(io5["seqs"][hslice[0]:hslice[1], sidx,]).view(np.int8)
+
+    ## we need to use upper to skip lowercase allele storage. This is free
+    ## for nibble encoded seqs but slows down loading |S1 seqs by a ton.
+    superints = get_seqs(io5, hslice[0], hslice[1], sidx).view(np.int8)
     LOGGER.info("superints shape {}".format(superints.shape))
 
-    ## fill edge filter
-    ## get edges of superseqs and supercats, since edges need to be trimmed
-    ## before counting hets, snps, inds. Technically, this could edge trim
-    ## clusters to the point that they are below the minlen, and so this
-    ## also constitutes a filter, though one that is uncommon. For this
-    ## reason we have another filter called edgfilter.
-    splits = co5["edges"][hslice[0]:hslice[1], 4]
-    edgfilter, edgearr = get_edges(data, superints, splits)
-    del splits
-    LOGGER.info('passed edges %s', hslice[0])
+    ## run the site kernel
+    hasdata, nhets, snpraw, nmask, gapmask = site_numba(superints)
 
-    ## minsamp coverages filtered from superseqs
-    minfilter = filter_minsamp(data, superints)
-    LOGGER.info('passed minfilt %s', hslice[0])
+    ## stats for the ploidy filter
+    nalleles = io5["nalleles"][hslice[0]:hslice[1]].max(axis=1)
+    io5.close()
 
-    ## maxhets per site column from superseqs after trimming edges
-    hetfilter = filter_maxhet(data, superints, edgearr)
-    LOGGER.info('passed minhet %s', hslice[0])
+    return {"hasdata": np.packbits(hasdata, axis=1),
+            "nalleles": nalleles,
+            "nhets": nhets,
+            "snpraw": snpraw,
+            "nmask": np.packbits(nmask, axis=2),
+            "gapmask": np.packbits(gapmask, axis=2)}
 
-    ## ploidy filter
-    pldfilter = io5["nalleles"][hslice[0]:hslice[1]].max(axis=1) > \
-                                         data.paramsdict["max_alleles_consens"]
 
-    ## indel filter, needs a fresh superints b/c get_edges does (-)->(N)
-    indfilter = filter_indels(data, superints, edgearr)
-    LOGGER.info('passed minind %s', hslice[0])
 
-    ## Build the .loci snpstring as an array (snps)
-    ## shape = (chunk, 1) dtype=S1, or should it be (chunk, 2) for [-,*] ?
-    snpfilter, snpsarr = filter_maxsnp(data, superints, edgearr)
+def filter_stacks(data, sitesfile, hslice):
+    """
+    Grab a chunk of loci from the site stats cache file. Computes the edges, snps
+    and the per-locus filter stats of the chunk with 'filter_numba()' and 
+    returns them to be entered into the database and the filter stats 
+    cache. Also returns the number of samples with data in each locus. 
+    Filters are applied to the stats by 'filter_stats()'.
+    """
+    LOGGER.info("Entering filter_stacks")
+
+    ## open h5 handles
+    to5 = h5py.File(sitesfile, 'r')
+    co5 = h5py.File(data.database, 'r')
+
+    ## the site stats, per sample masks are unpacked to (loci, samples, sites)
+    nhets = to5["nhets"][hslice[0]:hslice[1]]
+    snpraw = to5["snpraw"][hslice[0]:hslice[1]]
+    nsites = nhets.shape[1]
+    nmask = np.unpackbits(to5["nmask"][hslice[0]:hslice[1]], axis=2)\
+              [:, :, :nsites].astype(np.bool_)
+    gapmask = np.unpackbits(to5["gapmask"][hslice[0]:hslice[1]], axis=2)\
+                [:, :, :nsites].astype(np.bool_)
+
+    ## the pair splits of each locus
+    splits = co5["edges"][hslice[0]:hslice[1], 4]
+    to5.close()
+    co5.close()
 
-    LOGGER.info("edg %s", edgfilter.sum())
-    LOGGER.info("min %s", minfilter.sum())
-    LOGGER.info("het %s", hetfilter.sum())
-    LOGGER.info("pld %s", pldfilter.sum())
-    LOGGER.info("snp %s", snpfilter.sum())
-    LOGGER.info("ind %s", indfilter.sum())
+    ## run the filter kernel
+    args = get_edge_params(data)
+    edgearr, snpsarr, efilter, maxhets, nindels, nsnps = \
+        filter_numba(nmask, gapmask, nhets, snpraw, splits, *args)
+    coverage = coverage_numba(nmask, edgearr)
 
-    ## SAVE FILTERS AND INFO TO DISK BY SLICE NUMBER (.0.tmp.h5)
-    chunkdir = os.path.join(data.dirs.outfiles, data.name+"_tmpchunks")
+    return {"edges": edgearr,
+            "snps": snpsarr,
+            "coverage": coverage,
+            "efilter": efilter, 
+            "maxhets": maxhets,
+            "nindels": nindels, 
+            "nsnps": nsnps}
 
-    handle = os.path.join(chunkdir, "edgf.{}.npy".format(hslice[0]))
-    with open(handle, 'w') as out:
-        np.save(out, edgfilter)
 
-    handle = os.path.join(chunkdir, "minf.{}.npy".format(hslice[0]))
-    with open(handle, 'w') as out:
-        np.save(out, minfilter)
 
-    handle = os.path.join(chunkdir, "hetf.{}.npy".format(hslice[0]))
-    with open(handle, 'w') as out:
-        np.save(out, hetfilter)
+def pop_coverage(hasdata, popmask):
+    """
+    Returns the number of samples with data in each population for each 
+    locus, as one product of the (loci x samples) presence bitmap and the 
+    (samples x pops) membership matrix. float32 products are exact for 
+    these counts and use BLAS.
+    """
+    return np.dot(hasdata.astype(np.float32), popmask.T.astype(np.float32))\
+             .astype(np.uint16)
 
-    handle = os.path.join(chunkdir, "snpf.{}.npy".format(hslice[0]))
-    with open(handle, 'w') as out:
-        np.save(out, snpfilter)
 
-    handle = os.path.join(chunkdir, "pldf.{}.npy".format(hslice[0]))
-    with open(handle, 'w') as out:
-        np.save(out, pldfilter)
 
-    handle = os.path.join(chunkdir, "indf.{}.npy".format(hslice[0]))
-    with open(handle, 'w') as out:
-        np.save(out, indfilter)
+def filter_stats(stats, popmins, maxhet, hetfrac, maxsnps, maxinds,
+    ispair, maxalleles):
+    """
+    Returns the filters of loci from their stats, as computed in 
+    'filter_stacks()', 'site_stacks()' and 'pop_coverage()', and the params
+    from 'get_filter_params()' without the popmask. Filter columns are in 
+    the order of the database 'filters' array without duplicates: ["max_indels", "max_snps", "max_shared_hets", "min_samps",
+    "max_alleles"]. Edge-trimmed loci are stored as minsamp excludes.
+    """
+    filters = np.zeros((stats["maxhets"].shape[0], 5), dtype=np.bool_)
+
+    ## max internal indels and max snps in each read
+    filters[:, 0] = stats["nindels"][:, 0] > maxinds[0]
+    if ispair:
+        filters[:, 0] |= stats["nindels"][:, 1] > maxinds[1]
+    filters[:, 1] = stats["nsnps"][:, 0] > maxsnps[0]
+    if maxsnps.shape[0] > 1:
+        filters[:, 1] |= stats["nsnps"][:, 1] > maxsnps[1]
+
+    ## maxhets per site, or as a proportion of samples with data
+    if hetfrac:
+        hetmax = np.floor(maxhet * stats["popcov"][:, 0])
+    else:
+        hetmax = maxhet
+    filters[:, 2] = stats["maxhets"] > hetmax
 
-    handle = os.path.join(chunkdir, "snpsarr.{}.npy".format(hslice[0]))
-    with open(handle, 'w') as out:
-        np.save(out, snpsarr)
+    ## minsamp for each population
+    filters[:, 3] = stats["efilter"]
+    filters[:, 3] |= np.any(stats["popcov"] < popmins, axis=1)
 
-    handle = os.path.join(chunkdir, "edgearr.{}.npy".format(hslice[0]))
-    with open(handle, 'w') as out:
-        np.save(out, edgearr)
+    ## ploidy filter
+    filters[:, 4] = stats["nalleles"] > maxalleles
 
-    io5.close()
-    co5.close()
+    LOGGER.info("ind %s", filters[:, 0].sum())
+    LOGGER.info("snp %s", filters[:, 1].sum())
+    LOGGER.info("het %s", filters[:, 2].sum())
+    LOGGER.info("min %s", filters[:, 3].sum())
+    LOGGER.info("pld %s", filters[:, 4].sum())
+    return filters
 
 
 
-def get_edges(data, superints, splits):
+def get_edge_params(data):
     """
-    Gets edge trimming based on the overlap of sequences at the edges of
-    alignments and the tuple arg passed in for edge_trimming. Trims as
-    (R1 left, R1 right, R2 left, R2 right). We also trim off the restriction
-    site if it present. This modifies superints, and so should be run on an
-    engine so it doesn't affect local copy. If this is changed to run locally
-    for some reason make sure we copy the superints instead.
+    Returns the edge trimming params as the types used by filter_numba. The
+    edges, snps and filter stats depend only on these and the samples.
     """
-    ## the filtering arg and parse it into minsamp numbers
+    ## the edge trimming args
     if "trim_overhang" in data.paramsdict:
         edgetrims = np.array(data.paramsdict["trim_overhang"]).astype(np.int16)
     else:
@@ -993,16 +1584,8 @@ def get_edges(data, superints, splits):
         LOGGER.debug("Found 3Rad cut sites")
     except ValueError:
         cut1, cut2 = data.paramsdict["restriction_overhang"]
-
     cuts = np.array([len(cut1), len(cut2)], dtype=np.int16)
 
-    ## a local array for storing edge trims
-    edges = np.zeros((superints.shape[0], 5), dtype=np.int16)
-
-    ## a local array for storing edge filtered loci, these are stored
-    ## eventually as minsamp excludes.
-    edgefilter = np.zeros((superints.shape[0],), dtype=np.bool)
-
     ## TRIM GUIDE. The cut site lengths are always trimmed. In addition,
     ## edge overhangs are trimmed to min(4, minsamp), and then additional
     ## number of columns is trimmed based on edgetrims values.
@@ -1011,120 +1594,288 @@ def get_edges(data, superints, splits):
         minedge = np.int16(data.paramsdict["min_samples_locus"])
     else:
         minedge = np.int16(max(4, data.paramsdict["min_samples_locus"]))
+    ispair = "pair" in data.paramsdict["datatype"]
+    return edgetrims, cuts, minedge, ispair
 
-    ## convert all - to N to make this easier
-    nodashints = copy.deepcopy(superints)#.copy()
-    nodashints[nodashints == 45] = 78
 
-    ## trim overhanging edges
-    ## get the number not Ns in each site,
-    #ccx = np.sum(superseqs != "N", axis=1)
-    ccx = np.sum(nodashints != 78, axis=1, dtype=np.uint16)
-    efi, edg = edgetrim_numba(splits, ccx, edges, edgefilter, edgetrims, cuts, minedge)
-    return efi, edg
 
+def get_filter_params(data, nsamples):
+    """
+    Returns the filter thresholds as the types used by filter_stats. 
+    Samples are indexed as in superints, which is already subsampled by sidx.
+    """
+    ## minsamp for each population. The first row of the membership matrix
+    ## is all samples, which is the min_samples_locus population if there
+    ## are no populations, and is also the coverage used by hetfrac.
+    ## data._populations will look like this:
+    ## {'a': (3, [0, 1, 2, 3],
+    ##  'b': (3, [4, 5, 6, 7],
+    ##  'c': (3, [8, 9, 10, 11]}
+    pops = sorted(data._populations.items()) if data.populations else []
+    popmask = np.zeros((len(pops) + 1, nsamples), dtype=np.bool_)
+    popmins = np.zeros(len(pops) + 1, dtype=np.int64)
+    popmask[0] = True
+    if not pops:
+        popmins[0] = data.paramsdict["min_samples_locus"]
+    for pidx, (_, (minsamp, samps)) in enumerate(pops):
+        popmask[pidx + 1, samps] = True
+        popmins[pidx + 1] = minsamp
 
+    ## The type of max_shared_Hs_locus is determined and the cast to either
+    ## int or float is made at assembly load time. A float is a proportion 
+    ## of the samples with data at each locus.
+    maxhet = data.paramsdict["max_shared_Hs_locus"]
+    hetfrac = isinstance(maxhet, float)
+    maxhet = np.float64(maxhet)
 
-@numba.jit(nopython=True)
-def edgetrim_numba(splits, ccx, edges, edgefilter, edgetrims, cuts, minedge):
-    ## get splits
-    for idx in xrange(splits.shape[0]):
-
-        ## get the data, single or paired
-        if splits[idx]:
-            r1s = ccx[idx, :splits[idx]]
-            r2s = ccx[idx, splits[idx]+4:]
-        else:
-            r1s = ccx[idx, :]
+    maxsnps = np.atleast_1d(np.array(data.paramsdict['max_SNPs_locus'], dtype=np.int16))
+    maxinds = np.atleast_1d(np.array(data.paramsdict["max_Indels_locus"]).astype(np.int64))
+    ispair = "pair" in data.paramsdict["datatype"]
+    maxalleles = data.paramsdict["max_alleles_consens"]
+    return (popmask, popmins, maxhet, hetfrac, maxsnps, maxinds, ispair, 
+            maxalleles)
 
-        ## if 0 or positive, get edge 0
-        x = np.where(r1s >= minedge)[0]
-        if edgetrims[0] >= 0:
-            if x.shape[0] > 20:
-                edges[idx][0] = np.min(x[cuts[0]+edgetrims[0]:])
-            else:
-                edges[idx][0] = np.uint16(0)
-                edgefilter[idx] = True
 
-        ## fill in edge 1
-        if edgetrims[1] >= 0:
-            if x.shape[0] > 20:
-                edges[idx][1] = np.max(x-edgetrims[1])
-            else:
-                edges[idx][1] = np.uint16(1)
-                edgefilter[idx] = True
+
+@numba.jit(nopython=True)
+def site_numba(superints):
+    """
+    Single pass over the seqs of each locus. Returns the samples with data,
+    the number of ambiguous bases at each site, the snpstring (- or *) of 
+    each site before edge trimming, and masks of the N and indel (-) sites 
+    of each sample.
+    """
+    nloci, nsamples, nsites = superints.shape
+    hasdata = np.zeros((nloci, nsamples), dtype=np.bool_)
+    nhets = np.zeros((nloci, nsites), dtype=np.uint16)
+    snpraw = np.zeros((nloci, nsites, 2), dtype=np.bool_)
+    nmask = np.zeros((nloci, nsamples, nsites), dtype=np.bool_)
+    gapmask = np.zeros((nloci, nsamples, nsites), dtype=np.bool_)
+    catg = np.zeros(4, dtype=np.int16)
+
+    for idx in xrange(nloci):
+        ## count bases and ambiguities at each site
+        for site in xrange(nsites):
+            catg[:] = 0
+            for sidx in xrange(nsamples):
+                base = superints[idx, sidx, site]
+                if base == 78:      #N
+                    nmask[idx, sidx, site] = True
+                    continue
+                hasdata[idx, sidx] = True
+                if base == 45:      #-
+                    gapmask[idx, sidx, site] = True
+                    continue
+                if base == 67:      #C
+                    catg[0] += 1
+                elif base == 65:    #A
+                    catg[1] += 1
+                elif base == 84:    #T
+                    catg[2] += 1
+                elif base == 71:    #G
+                    catg[3] += 1
+                elif base == 82:    #R
+                    catg[1] += 1
+                    catg[3] += 1
+                    nhets[idx, site] += 1
+                elif base == 75:    #K
+                    catg[2] += 1
+                    catg[3] += 1
+                    nhets[idx, site] += 1
+                elif base == 83:    #S
+                    catg[0] += 1
+                    catg[3] += 1
+                    nhets[idx, site] += 1
+                elif base == 89:    #Y
+                    catg[0] += 1
+                    catg[2] += 1
+                    nhets[idx, site] += 1
+                elif base == 87:    #W
+                    catg[1] += 1
+                    catg[2] += 1
+                    nhets[idx, site] += 1
+                elif base == 77:    #M
+                    catg[0] += 1
+                    catg[1] += 1
+                    nhets[idx, site] += 1
+
+            ## get second most common site, if invariant e.g., [0, 0, 0, 9],
+            ## then nothing (" "), else pis (*) or autapomorphy (-)
+            catg.sort()
+            if catg[2] > 1:
+                snpraw[idx, site, 1] = True
+            elif catg[2]:
+                snpraw[idx, site, 0] = True
+
+    return hasdata, nhets, snpraw, nmask, gapmask
+
+
+
+@numba.jit(nopython=True)
+def filter_numba(nmask, gapmask, nhets, snpraw, splits, edgetrims, cuts, 
+    minedge, ispair):
+    """
+    Filter kernel on the site stats of 'site_numba()'. For each locus the 
+    coverage of each site gives the edges, from which the stats of the 
+    filters are all computed. Returns the edges, the edge-masked snps array,
+    and the stats: whether edge trimming failed, the max shared hets at a 
+    site within the edges, and the max internal indels and the number of 
+    snps in each read.
+    """
+    nloci, nsamples, nsites = nmask.shape
+    edges = np.zeros((nloci, 5), dtype=np.int16)
+    snpsarr = snpraw.copy()
+    efilters = np.zeros(nloci, dtype=np.bool_)
+    maxhets = np.zeros(nloci, dtype=np.int16)
+    nindels = np.zeros((nloci, 2), dtype=np.int16)
+    nsnps = np.zeros((nloci, 2), dtype=np.int16)
+
+    ## per locus work array
+    ccx = np.zeros(nsites, dtype=np.uint16)
+
+    for idx in xrange(nloci):
+        ## the number of samples with a base at each site
+        ccx[:] = 0
+        for sidx in xrange(nsamples):
+            for site in xrange(nsites):
+                if not (nmask[idx, sidx, site] or gapmask[idx, sidx, site]):
+                    ccx[site] += 1
+
+        ## trim overhanging edges by the number of samples with data 
+        efilter = False
+        split = splits[idx]
+        if split:
+            r1s = ccx[:split]
+            r2s = ccx[split+4:]
+        else:
+            r1s = ccx
+
+        ## if 0 or positive, get edge 0
+        x = np.where(r1s >= minedge)[0]
+        if edgetrims[0] >= 0:
+            if x.shape[0] > 20:
+                edges[idx, 0] = np.min(x[cuts[0]+edgetrims[0]:])
+            else:
+                edges[idx, 0] = 0
+                efilter = True
+
+        ## fill in edge 1
+        if edgetrims[1] >= 0:
+            if x.shape[0] > 20:
+                edges[idx, 1] = np.max(x-edgetrims[1])
+            else:
+                edges[idx, 1] = 1
+                efilter = True
 
         ## If paired, do second read edges
-        if splits[idx]:
+        if split:
             x = np.where(r2s >= minedge)[0]
             if edgetrims[2] >= 0:
                 if x.shape[0] > 20:
-                    edges[idx][2] = splits[idx] + np.int16(4) + np.min(x) + edgetrims[2]
+                    edges[idx, 2] = split + 4 + np.min(x) + edgetrims[2]
                 else:
-                    edges[idx][2] = edges[idx][1] + 4
-                    edgefilter[idx] = True
+                    edges[idx, 2] = edges[idx, 1] + 4
+                    efilter = True
 
             if edgetrims[3] >= 0:
                 ## get farthest site that is not all Ns
                 if x.shape[0] > 20:
                     ## return index w/ spacers
-                    edges[idx][3] = (splits[idx] + np.int16(4) + np.max(x)) - edgetrims[3]
+                    edges[idx, 3] = (split + 4 + np.max(x)) - edgetrims[3]
                 else:
-                    edges[idx][3] = edges[idx][2] + 1
-                    edgefilter[idx] = True
+                    edges[idx, 3] = edges[idx, 2] + 1
+                    efilter = True
 
             ## enter the pair splitter
-            edges[idx][4] = splits[idx]
+            edges[idx, 4] = split
 
         ## sanity check filter on edges
-        if (edges[idx][1] < edges[idx][0]) or (edges[idx][3] < edges[idx][2]):
-            edgefilter[idx] = True
+        if (edges[idx, 1] < edges[idx, 0]) or (edges[idx, 3] < edges[idx, 2]):
+            efilter = True
+        e0, e1, e2, e3 = edges[idx, 0], edges[idx, 1], edges[idx, 2], edges[idx, 3]
+        efilters[idx] = efilter
+
+        ## maxhets per site column after trimming edges
+        for site in xrange(max(e0, 0), min(e1, nsites)):
+            if nhets[idx, site] > maxhets[idx]:
+                maxhets[idx] = nhets[idx, site]
+        for site in xrange(max(e2, 0), min(e3, nsites)):
+            if nhets[idx, site] > maxhets[idx]:
+                maxhets[idx] = nhets[idx, site]
+
+        ## max indels within the edges, excluding terminal indels
+        if ispair:
+            nindels[idx, 0] = maxind_numba(gapmask[idx], e0, e1)
+            nindels[idx, 1] = maxind_numba(gapmask[idx], e2, e3)
+        elif e1 - e0 > 1:
+            nindels[idx, 0] = maxind_numba(gapmask[idx], e0, e1)
+
+        ## exclude snps that are outside of the edges then count them
+        if not split:
+            for site in xrange(nsites):
+                if (site < e0) or (site > e1):
+                    snpsarr[idx, site, :] = False
+            for site in xrange(nsites):
+                nsnps[idx, 0] += snpsarr[idx, site, 0] + snpsarr[idx, site, 1]
+        else:
+            for site in xrange(nsites):
+                if site < e0:
+                    snpsarr[idx, site, :] = False
+                elif (site > e1) and (site < e2):
+                    snpsarr[idx, site, :] = False
+                elif site > e3:
+                    snpsarr[idx, site, :] = False
+            for site in xrange(nsites):
+                if site < split:
+                    nsnps[idx, 0] += snpsarr[idx, site, 0] + snpsarr[idx, site, 1]
+                else:
+                    nsnps[idx, 1] += snpsarr[idx, site, 0] + snpsarr[idx, site, 1]
 
-        ## minlen check on edges (set arbitrarily to 20 right now)
-        #if ((edges[idx][1] - edges[idx][0]) < 20) or \
-        #   ((edges[idx][3] - edges[idx][2]) < 20):
-        #    edgefilter[idx] = True
+    return edges, snpsarr, efilters, maxhets, nindels, nsnps
 
-    return edgefilter, edges
 
 
+@numba.jit(nopython=True)
+def maxind_numba(gaps, left, right):
+    """ max internal indels (not terminal) in any sample between edges """
+    inds = 0
+    for row in xrange(gaps.shape[0]):
+        ## find the first and last non-indel sites
+        first = -1
+        last = -1
+        for site in xrange(max(left, 0), min(right, gaps.shape[1])):
+            if not gaps[row, site]:
+                if first < 0:
+                    first = site
+                last = site
+        if first < 0:
+            continue
+        obs = 0
+        for site in xrange(first, last):
+            if gaps[row, site]:
+                obs += 1
+        if obs > inds:
+            inds = obs
+    return inds
 
-def filter_minsamp(data, superints):
-    """
-    Filter minimum # of samples per locus from superseqs[chunk]. The shape
-    of superseqs is [chunk, sum(sidx), maxlen]
-    """
-    ## global minsamp
-    minsamp = data.paramsdict["min_samples_locus"]
 
-    ## use population minsamps
-    if data.populations:
-        ## data._populations will look like this:
-        ## {'a': (3, [0, 1, 2, 3],
-        ##  'b': (3, [4, 5, 6, 7],
-        ##  'c': (3, [8, 9, 10, 11]}
-        LOGGER.info("POPULATIONS %s", data.populations)
-        
-        ## superints has already been subsampled by sidx
-        ## get the sidx values for each pop
-        minfilters = []
-        for pop in data._populations:
-            samps = data._populations[pop][1]
-            minsamp = data._populations[pop][0]
-            mini = np.sum(~np.all(superints[:, samps, :] == 78, axis=2), axis=1) < minsamp
-            minfilters.append(mini)
-        ## get sum across all pops for each locus
-        minfilt = np.any(minfilters, axis=0)
 
-    else:
-        ## if not pop-file use global minsamp filter
-        minfilt = np.sum(~np.all(superints == 78, axis=2), axis=1) < minsamp
-        #LOGGER.info("Filtered by min_samples_locus - {}".format(minfilt.sum()))
-    return minfilt
+@numba.jit(nopython=True)
+def coverage_numba(nmask, edgearr):
+    """ number of samples that are not all N within the R1 edges """
+    coverage = np.zeros(nmask.shape[0], dtype=np.uint16)
+    for iloc in xrange(nmask.shape[0]):
+        for sidx in xrange(nmask.shape[1]):
+            for site in xrange(edgearr[iloc, 0], edgearr[iloc, 1]+1):
+                if not nmask[iloc, sidx, site]:
+                    coverage[iloc] += 1
+                    break
+    return coverage
 
 
 
 def ucount(sitecol):
+
     """
     Used to count the number of unique bases in a site for snpstring.
     returns as a spstring with * and -
@@ -1154,259 +1905,13 @@ def ucount(sitecol):
 
 
 
-def filter_maxsnp(data, superints, edgearr):
-    """
-    Filter max # of SNPs per locus. Do R1 and R2 separately if PE.
-    Also generate the snpsite line for the .loci format and save in the snp arr
-    This uses the edge filters that have been built based on trimming, and
-    saves the snps array with edges filtered. **Loci are not yet filtered.**
-    """
-
-    ## an empty array to count with failed loci
-    snpfilt = np.zeros(superints.shape[0], dtype=np.bool)
-    snpsarr = np.zeros((superints.shape[0], superints.shape[2], 2), dtype=np.bool)
-    maxsnps = np.array(data.paramsdict['max_SNPs_locus'], dtype=np.int16)
-
-    ## get the per site snp string | shape=(chunk, maxlen)
-    # snpsarr[:, :, 0] = snps == "-"
-    # snpsarr[:, :, 1] = snps == "*"
-    snpsarr = snpcount_numba(superints, snpsarr)
-    LOGGER.info("---found the snps: %s", snpsarr.sum())
-    snpfilt, snpsarr = snpfilter_numba(snpsarr, snpfilt, edgearr, maxsnps)
-    LOGGER.info("---filtered snps: %s", snpfilt.sum())
-    return snpfilt, snpsarr
-
-
-
-@numba.jit(nopython=True)
-def snpfilter_numba(snpsarr, snpfilt, edgearr, maxsnps):
-    for idx in xrange(snpsarr.shape[0]):
-        if not edgearr[idx, 4]:
-            ## exclude snps that are outside of the edges
-            for sidx in xrange(snpsarr.shape[1]):
-                if sidx < edgearr[idx, 0]:
-                    snpsarr[idx, sidx, :] = False
-                elif sidx > edgearr[idx, 1]:
-                    snpsarr[idx, sidx, :] = False
-
-            nvar = snpsarr[idx, :].sum()
-            if nvar > maxsnps[0]:
-                snpfilt[idx] = True
-
-        else:
-            for sidx in xrange(snpsarr.shape[1]):
-                if sidx < edgearr[idx, 0]:
-                    snpsarr[idx, sidx, :] = False
-                else:
-                    if sidx > edgearr[idx, 1]:
-                        if sidx < edgearr[idx, 2]:
-                            snpsarr[idx, sidx, :] = False
-                    if sidx > edgearr[idx, 3]:
-                        snpsarr[idx, sidx, :] = False
-
-            nvar1 = snpsarr[idx, :][:edgearr[idx, 4]].sum()
-            if nvar1 > maxsnps[0]:
-                snpfilt[idx] = True
-            nvar2 = snpsarr[idx, :][edgearr[idx, 4]:].sum()
-            if nvar2 > maxsnps[1]:
-                snpfilt[idx] = True
-
-    return snpfilt, snpsarr
-
-
-
-@numba.jit(nopython=True)
-def snpcount_numba(superints, snpsarr):
-    """
-    Used to count the number of unique bases in a site for snpstring.
-    """
-    ## iterate over all loci
-    for iloc in xrange(superints.shape[0]):
-        for site in xrange(superints.shape[2]):
-
-            ## make new array
-            catg = np.zeros(4, dtype=np.int16)
-
-            ## a list for only catgs
-            ncol = superints[iloc, :, site]
-            for idx in range(ncol.shape[0]):
-                if ncol[idx] == 67: #C
-                    catg[0] += 1
-                elif ncol[idx] == 65: #A
-                    catg[1] += 1
-                elif ncol[idx] == 84: #T
-                    catg[2] += 1
-                elif ncol[idx] == 71: #G
-                    catg[3] += 1
-                elif ncol[idx] == 82: #R
-                    catg[1] += 1        #A
-                    catg[3] += 1        #G
-                elif ncol[idx] == 75: #K
-                    catg[2] += 1        #T
-                    catg[3] += 1        #G
-                elif ncol[idx] == 83: #S
-                    catg[0] += 1        #C
-                    catg[3] += 1        #G
-                elif ncol[idx] == 89: #Y
-                    catg[0] += 1        #C
-                    catg[2] += 1        #T
-                elif ncol[idx] == 87: #W
-                    catg[1] += 1        #A
-                    catg[2] += 1        #T
-                elif ncol[idx] == 77: #M
-                    catg[0] += 1        #C
-                    catg[1] += 1        #A
-
-
-            ## get second most common site
-            catg.sort()
-            ## if invariant e.g., [0, 0, 0, 9], then nothing (" ")
-            if not catg[2]:
-                pass
-            else:
-                if catg[2] > 1:
-                    snpsarr[iloc, site, 1] = True
-                else:
-                    snpsarr[iloc, site, 0] = True
-    return snpsarr
-
-
-
-def filter_maxhet(data, superints, edgearr):
-    """
-    Filter max shared heterozygosity per locus. The dimensions of superseqs
-    are (chunk, sum(sidx), maxlen). Don't need split info since it applies to
-    entire loci based on site patterns (i.e., location along the seq doesn't
-    matter.) Current implementation does ints, but does not apply float diff
-    to every loc based on coverage...
-    """
-    ## the filter max
-    ## The type of max_shared_Hs_locus is determined and the cast to either
-    ## int or float is made at assembly load time
-    maxhet = data.paramsdict["max_shared_Hs_locus"]
-    if isinstance(maxhet, float):
-        ## get an array with maxhet fraction * ntaxa with data for each locus
-        #maxhet = np.array(superints.shape[1]*maxhet, dtype=np.int16)
-        maxhet = np.floor(
-            maxhet * (superints.shape[1] - 
-                np.all(superints == 78, axis=2).sum(axis=1))).astype(np.int16)
-    elif isinstance(maxhet, int):
-        maxhet = np.zeros(superints.shape[0], dtype=np.int16)
-        maxhet.fill(data.paramsdict["max_shared_Hs_locus"])
-
-    ## an empty array to fill with failed loci
-    LOGGER.info("--------------maxhet mins %s", maxhet)
-    hetfilt = np.zeros(superints.shape[0], dtype=np.bool)
-    hetfilt = maxhet_numba(superints, edgearr, maxhet, hetfilt)
-    LOGGER.info("--------------maxhet sums %s", hetfilt.sum())
-    return hetfilt
-
-
-
-def filter_indels(data, superints, edgearr):
-    """
-    Filter max indels. Needs to split to apply to each read separately.
-    The dimensions of superseqs are (chunk, sum(sidx), maxlen).
-    """
-
-    maxinds = np.array(data.paramsdict["max_Indels_locus"]).astype(np.int64)
-
-    ## an empty array to fill with failed loci
-    ifilter = np.zeros(superints.shape[0], dtype=np.bool_)
-
-    ## if paired then worry about splits
-    if "pair" in data.paramsdict["datatype"]:
-        for idx in xrange(superints.shape[0]):
-            block1 = superints[idx, :, edgearr[idx, 0]:edgearr[idx, 1]]
-            block2 = superints[idx, :, edgearr[idx, 2]:edgearr[idx, 3]]
-
-            sums1 = maxind_numba(block1)
-            sums2 = maxind_numba(block2)
-
-            if (sums1 > maxinds[0]) or (sums2 > maxinds[1]):
-                ifilter[idx] = True
-
-    else:
-        for idx in xrange(superints.shape[0]):
-            ## get block based on edge filters
-            block = superints[idx, :, edgearr[idx, 0]:edgearr[idx, 1]]
-            ## shorten block to exclude terminal indels
-            ## if data at this locus (not already filtered by edges/minsamp)
-            if block.shape[1] > 1:
-                sums = maxind_numba(block)
-                #LOGGER.info("maxind numba %s %s", idx, sums)
-                #LOGGER.info("sums, maxinds[0], compare: %s %s %s",
-                #             sums, maxinds[0], sums > maxinds[0])
-                if sums > maxinds[0]:
-                    ifilter[idx] = True
-
-    LOGGER.info("--------------maxIndels sums %s", ifilter.sum())
-    return ifilter
-
-
-
-@numba.jit(nopython=True)
-def maxind_numba(block):
-    """ filter for indels """
-    ## remove terminal edges
-    inds = 0
-    for row in xrange(block.shape[0]):
-        where = np.where(block[row] != 45)[0]
-        left = np.min(where)
-        right = np.max(where)
-        obs = np.sum(block[row, left:right] == 45)
-        if obs > inds:
-            inds = obs
-    return inds
-
-
-
-@numba.jit(nopython=True)
-def maxhet_numba(superints, edgearr, maxhet, hetfilt):
-    for idx in xrange(edgearr.shape[0]):
-        ## do read1s
-        fcolumns = superints[idx, :, edgearr[idx, 0]:edgearr[idx, 1]]
-        count1s = np.zeros(fcolumns.shape[1], dtype=np.int16)
-        for fidx in xrange(fcolumns.shape[1]):
-            subcount = 0
-            for ambig in AMBIGARR:
-                subcount += np.sum(fcolumns[:, fidx] == ambig)
-            count1s[fidx] = subcount
-
-        ## do read2s
-        fcolumns = superints[idx, :, edgearr[idx, 2]:edgearr[idx, 3]]
-        count2s = np.zeros(fcolumns.shape[1], dtype=np.int16)
-        for fidx in xrange(fcolumns.shape[1]):
-            subcount = 0
-            for ambig in AMBIGARR:
-                subcount += np.sum(fcolumns[:, fidx] == ambig)
-            count2s[fidx] = subcount
-
-        ## check against max
-        if count1s.max() > maxhet[idx]:
-            hetfilt[idx] = True
-        elif count2s.size:
-            if count2s.max() > maxhet[idx]:
-                hetfilt[idx] = True
-    return hetfilt
-
-## MAKE GLOBAL
-AMBIGARR = np.array(list("RSKYWM")).view(np.int8)
-
-
-
-
 def make_outfiles(data, samples, output_formats, ipyclient):
     """
     Get desired formats from paramsdict and write files to outfiles
     directory.
     """
 
-    ## will iterate optim loci at a time
     with h5py.File(data.clust_database, 'r') as io5:
-        optim = io5["seqs"].attrs["chunksize"][0]
-        nloci = io5["seqs"].shape[0]
-
         ## get name and snp padding
         anames = io5["seqs"].attrs["samples"]
         snames = [i.name for i in samples]
@@ -1427,9 +1932,9 @@ def make_outfiles(data, samples, output_formats, ipyclient):
     start = time.time()
     results = {}
 
-    ## build arrays and outputs from arrays.
-    ## these arrays are keys in the tmp h5 array: seqarr, snparr, bisarr, maparr
-    boss_make_arrays(data, sidx, optim, nloci, ipyclient)
+    ## outputs are built from the arrays made in 'make_chunk_outputs()'.
+    ## these arrays are keys in the tmp h5 array: snparr, bisarr, maparr, and
+    ## seqblocks, the column widths of the seq blocks in the tmp seqs file.
 
     start = time.time()
     ## phy and partitions are a default output ({}.phy, {}.phy.partitions)
@@ -1502,112 +2007,24 @@ def make_outfiles(data, samples, output_formats, ipyclient):
                          suff, async.exception())
 
     ## remove the tmparrays
-    tmparrs = os.path.join(data.dirs.outfiles, "tmp-{}.h5".format(data.name))
-    os.remove(tmparrs)
+    for tmparrs in ["tmp-{}.h5", "tmp-{}.seqs"]:
+        tmparrs = os.path.join(data.dirs.outfiles, tmparrs.format(data.name))
+        if os.path.exists(tmparrs):
+            os.remove(tmparrs)
 
 
 
-def boss_make_arrays(data, sidx, optim, nloci, ipyclient):
-    
-    ## make a list of slices to distribute in parallel
-    hslices = [start for start in range(0, nloci, optim)]
-    
-    ## parallel client setup
-    lbview = ipyclient.load_balanced_view()
-        
-    ## load the h5 database and grab some needed info
-    maxlen = data._hackersonly["max_fragment_length"] + 20
-
-    ## distribute jobs in chunks of optim
-    asyncs = []
-    for hslice in hslices:
-        args = (data, sidx, hslice, optim, maxlen)
-        async = lbview.apply(worker_make_arrays, *args)
-        asyncs.append(async)
-               
-    ## shape of arrays is sidx, we will subsample h5 w/ sidx to match. Seqarr
-    ## will actually be a fair bit smaller since its being loaded with edge
-    with h5py.File(data.database, 'r') as co5:
-        maxsnp = co5["snps"][:].sum()
-        afilt = co5["filters"][:]
-        nkeeps = np.sum(np.sum(afilt, axis=1) == 0)
-
-    ## a tmp h5 to hold working arrays (the seq array is not filtered and trimmed
-    ## It is the phylip output, essentially.
-    h5name = os.path.join(data.dirs.outfiles, "tmp-{}.h5".format(data.name))
-    with h5py.File(h5name, 'w') as tmp5:
-
-        ## ensure chunksize is not greater than array size
-        shape1 = maxlen*nkeeps
-        tmp5.create_dataset("seqarr", (sum(sidx), shape1), dtype="S1", 
-                            chunks=(sum(sidx), min(shape1, maxlen*optim)))
-        tmp5.create_dataset("snparr", (sum(sidx), maxsnp), dtype="S1", 
-                            chunks=(sum(sidx), min(maxsnp, optim)))
-        tmp5.create_dataset('bisarr', (sum(sidx), nkeeps), dtype="S1", 
-                            chunks=(sum(sidx), min(nkeeps, optim)))
-        tmp5.create_dataset('maparr', (maxsnp, 4), dtype=np.uint32)
-
-        ## track progress, catch errors, and enter results into h5 as it arrive
-        start = time.time()
-        njobs = len(asyncs)
-        ## axis1 counters
-        seqidx = snpidx = bisidx = mapidx = locidx = 0
-        
-        while 1:
-            ## we need to collect results in order!
-            if asyncs[0].ready():
-                if asyncs[0].successful():
-                    ## enter results and del async
-                    seqarr, snparr, bisarr, maparr = asyncs[0].result()
-                    tmp5["seqarr"][:, seqidx:seqidx+seqarr.shape[1]] = seqarr
-                    seqidx += seqarr.shape[1]
-                    tmp5["snparr"][:, snpidx:snpidx+snparr.shape[1]] = snparr
-                    snpidx += snparr.shape[1]
-                    tmp5["bisarr"][:, bisidx:bisidx+bisarr.shape[1]] = bisarr
-                    bisidx += bisarr.shape[1]
-
-                    ## mapfile needs idxs summed, only bother if there is data
-                    ## that passed filtering for this chunk
-                    if maparr.shape[0]:
-                        mapcopy = maparr.copy()
-                        mapcopy[:, 0] += locidx
-                        mapcopy[:, 3] += mapidx
-                        tmp5["maparr"][mapidx:mapidx+maparr.shape[0], :] = mapcopy
-                        locidx = mapcopy[-1, 0]
-                        mapidx += mapcopy.shape[0]
-                    del asyncs[0]
-                        
-                else:
-                    print(asyncs[0].exception())
-
-            ## print progress            
-            time.sleep(0.1)
-            elapsed = datetime.timedelta(seconds=int(time.time()-start))
-            progressbar(njobs, njobs-len(asyncs), 
-                " building arrays       | {} | s7 |".format(elapsed), 
-                spacer=data._spacer)
-            
-            ## are we done?
-            if not asyncs:
-                print("")
-                break
-
-    #return 
-    
-
-    
-def worker_make_arrays(data, sidx, hslice, optim, maxlen):
+def worker_make_arrays(data, cdata, maxlen):
     """
-    Parallelized worker to build array chunks for output files. One main 
-    goal here is to keep seqarr to less than ~1GB RAM.
+    Arrays encoder of 'make_chunk_outputs()' to build array chunks for 
+    output files. One main goal here is to keep seqarr to less than ~1GB RAM.
     """
-    
-    ## big data arrays
-    io5 = h5py.File(data.clust_database, 'r')
-    co5 = h5py.File(data.database, 'r')
-    
+    sidx = cdata.sidx
+    hslice = cdata.start
+    optim = cdata.end - cdata.start
+
     ## temporary storage until writing to h5 array    
-    maxsnp = co5["snps"][hslice:hslice+optim].sum()         ## concat later
+    maxsnp = cdata.snps.sum()         ## concat later
     maparr = np.zeros((maxsnp, 4), dtype=np.uint32)
     snparr = np.zeros((sum(sidx), maxsnp), dtype="S1")
     bisarr = np.zeros((sum(sidx), maxsnp), dtype="S1")
@@ -1623,15 +2040,13 @@ def worker_make_arrays(data, sidx, hslice, optim, maxlen):
     mapsnp = 0
     totloc = 0
 
-    afilt = co5["filters"][hslice:hslice+optim, :]
-    aedge = co5["edges"][hslice:hslice+optim, :]
-    asnps = co5["snps"][hslice:hslice+optim, :]
-    #aseqs = io5["seqs"][hslice:hslice+optim, sidx, :]
-    ## have to run upper on seqs b/c they have lowercase storage of alleles
-    aseqs = np.char.upper(io5["seqs"][hslice:hslice+optim, sidx, :])
+    aedge = cdata.edges
+    asnps = cdata.snps
+    ## upper seqs b/c they have lowercase storage of alleles
+    aseqs = cdata.seqs[:, sidx]
 
     ## which loci passed all filters
-    keep = np.where(np.sum(afilt, axis=1) == 0)[0]
+    keep = np.where(cdata.keep)[0]
 
     ## write loci that passed after trimming edges, then write snp string
     for iloc in keep:
@@ -1680,10 +2095,6 @@ def worker_make_arrays(data, sidx, hslice, optim, maxlen):
             bisarr[:, bis] = snps[:, samp]
             bis += 1
             totloc += 1
-            
-    ## clean up
-    io5.close()
-    co5.close()
     
     ## trim trailing edges b/c we made the array bigger than needed.
     ridx = np.all(seqarr == "", axis=0)
@@ -1703,82 +2114,89 @@ def worker_make_arrays(data, sidx, hslice, optim, maxlen):
 
 def write_phy(data, sidx, pnames):
     """ 
-    write the phylip output file from the tmparr[seqarray] 
+    write the phylip output file from the tmp seqs file. Each row is 
+    written from its segment in each block, so memory use is one segment.
     """
 
-    ## grab seq data from tmparr
+    ## grab seq block widths from tmparr
     start = time.time()
     tmparrs = os.path.join(data.dirs.outfiles, "tmp-{}.h5".format(data.name)) 
+    spillname = os.path.join(data.dirs.outfiles, "tmp-{}.seqs".format(data.name))
     with h5py.File(tmparrs, 'r') as io5:
-        seqarr = io5["seqarr"]
+        widths = io5["seqblocks"][:]
+    offsets = np.concatenate([[0], np.cumsum(widths * len(pnames))[:-1]])
+
+    ## write to phylip 
+    with open(spillname, 'rb') as infile, open(data.outfiles.phy, 'w') as out:
+        ## write header
+        out.write("{} {}\n".format(len(pnames), widths.sum()))
+
+        ## write data rows segment by segment
+        for idx, name in enumerate(pnames):
+            out.write(name)
+            for offset, width in zip(offsets, widths):
+                if width:
+                    infile.seek(offset + idx * width)
+                    out.write(infile.read(width))
+            out.write("\n")
+    LOGGER.debug("finished writing phy in: %s", time.time() - start)
 
-        ## trim to size b/c it was made longer than actual
-        end = np.where(np.all(seqarr[:] == "", axis=0))[0]
-        if np.any(end):
-            end = end.min()
-        else:
-            end = seqarr.shape[1] 
 
-        ## write to phylip 
-        with open(data.outfiles.phy, 'w') as out:
-            ## write header
-            out.write("{} {}\n".format(seqarr.shape[0], end))
 
-            ## write data rows
-            for idx, name in enumerate(pnames):
-                out.write("{}{}\n".format(name, "".join(seqarr[idx, :end])))
-    LOGGER.debug("finished writing phy in: %s", time.time() - start)
+def iter_seqblocks(spillname, nsamples, widths, chunksize):
+    """ 
+    yields (nsamples, chunksize) column blocks of the seq array from the tmp 
+    seqs file, the last block may be shorter. 
+    """
+    carry = np.zeros((nsamples, 0), dtype="S1")
+    with open(spillname, 'rb') as infile:
+        for width in widths:
+            block = np.frombuffer(infile.read(nsamples * width), dtype="S1")
+            carry = np.concatenate([carry, block.reshape(nsamples, width)], axis=1)
+            while carry.shape[1] >= chunksize:
+                yield carry[:, :chunksize]
+                carry = carry[:, chunksize:]
+    if carry.shape[1]:
+        yield carry
 
 
 
 def write_nex(data, sidx, pnames):
     """ 
-    write the nexus output file from the tmparr[seqarray] and tmparr[maparr]
+    write the nexus output file from the tmp seqs file in column blocks
     """    
 
-    ## grab seq data from tmparr
+    ## grab seq block widths from tmparr
     start = time.time()
     tmparrs = os.path.join(data.dirs.outfiles, "tmp-{}.h5".format(data.name)) 
+    spillname = os.path.join(data.dirs.outfiles, "tmp-{}.seqs".format(data.name))
     with h5py.File(tmparrs, 'r') as io5:
-        seqarr = io5["seqarr"]
-
-        ## trim to size b/c it was made longer than actual
-        end = np.where(np.all(seqarr[:] == "", axis=0))[0]
-        if np.any(end):
-            end = end.min()
-        else:
-            end = seqarr.shape[1] 
+        widths = io5["seqblocks"][:]
 
-        ## write to nexus
-        data.outfiles.nex = os.path.join(data.dirs.outfiles, data.name+".nex")
+    ## write to nexus
+    data.outfiles.nex = os.path.join(data.dirs.outfiles, data.name+".nex")
+    with open(data.outfiles.nex, 'w') as out:
 
-        with open(data.outfiles.nex, 'w') as out:
+        ## write nexus seq header
+        out.write(NEXHEADER.format(len(pnames), widths.sum()))
 
-            ## write nexus seq header
-            out.write(NEXHEADER.format(seqarr.shape[0], end))
+        ## grab a big block of data
+        chunksize = 100000  # this should be a multiple of 100
+        for bigblock in iter_seqblocks(spillname, len(pnames), widths, chunksize):
 
-            ## grab a big block of data
-            chunksize = 100000  # this should be a multiple of 100
-            for bidx in xrange(0, end, chunksize):
-                bigblock = seqarr[:, bidx:bidx+chunksize]
-                lend = end-bidx
-                #LOGGER.info("BIG: %s %s %s %s", bigblock.shape, bidx, lend, end)
+            ## write interleaved seqs 100 chars with longname+2 before
+            tmpout = []            
+            for block in xrange(0, bigblock.shape[1], 100):
+                for idx, name in enumerate(pnames):
+                    seqdat = bigblock[idx, block:block+100]
+                    tmpout.append("  {}{}\n".format(name, seqdat.tobytes()))
+                tmpout.append("\n")
 
-                ## write interleaved seqs 100 chars with longname+2 before
-                tmpout = []            
-                for block in xrange(0, min(chunksize, lend), 100):
-                    stop = min(block+100, end)
+            ## print intermediate result and clear
+            out.write("".join(tmpout))
 
-                    for idx, name in enumerate(pnames):
-                        seqdat = bigblock[idx, block:stop]
-                        tmpout.append("  {}{}\n".format(name, "".join(seqdat)))
-                    tmpout.append("\n")
-
-                ## print intermediate result and clear
-                if any(tmpout):
-                    out.write("".join(tmpout))
-            ## closer
-            out.write(NEXCLOSER)
+        ## closer
+        out.write(NEXCLOSER)
     LOGGER.debug("finished writing nex in: %s", time.time() - start)
 
 
@@ -1828,19 +2246,14 @@ def write_snps(data, sidx, pnames):
     tmparrs = os.path.join(data.dirs.outfiles, "tmp-{}.h5".format(data.name)) 
     with h5py.File(tmparrs, 'r') as io5:
         snparr = io5["snparr"]
-
-        ## trim to size b/c it was made longer than actual
-        end = np.where(np.all(snparr[:] == "", axis=0))[0]
-        if np.any(end):
-            end = end.min()
-        else:
-            end = snparr.shape[1]        
+        end = snparr.attrs["end"]
 
         ## write to snps file
         with open(data.outfiles.snpsphy, 'w') as out:
             out.write("{} {}\n".format(snparr.shape[0], end))
-            for idx, name in enumerate(pnames):
-                out.write("{}{}\n".format(name, "".join(snparr[idx, :end])))
+            for row, block in iter_rowblocks(snparr, end):
+                for idx in xrange(block.shape[0]):
+                    out.write("{}{}\n".format(pnames[row+idx], block[idx].tobytes()))
     LOGGER.debug("finished writing snps in: %s", time.time() - start)
 
 
@@ -1852,74 +2265,46 @@ def write_usnps(data, sidx, pnames):
     tmparrs = os.path.join(data.dirs.outfiles, "tmp-{}.h5".format(data.name)) 
     with h5py.File(tmparrs, 'r') as io5:
         bisarr = io5["bisarr"]
-
-        ## trim to size b/c it was made longer than actual
-        end = np.where(np.all(bisarr[:] == "", axis=0))[0]
-        if np.any(end):
-            end = end.min()
-        else:
-            end = bisarr.shape[1]        
+        end = bisarr.attrs["end"]
 
         ## write to usnps file
         with open(data.outfiles.usnpsphy, 'w') as out:
             out.write("{} {}\n".format(bisarr.shape[0], end))
-            for idx, name in enumerate(pnames):
-                out.write("{}{}\n".format(name, "".join(bisarr[idx, :end])))
+            for row, block in iter_rowblocks(bisarr, end):
+                for idx in xrange(block.shape[0]):
+                    out.write("{}{}\n".format(pnames[row+idx], block[idx].tobytes()))
 
 
 
 def write_str(data, sidx, pnames):
     """ Write STRUCTURE format for all SNPs and unlinked SNPs """
 
-    ## grab snp and bis data from tmparr
+    ## one row per allele for diploids, else haploid output
     start = time.time()
+    if data.paramsdict["max_alleles_consens"] > 1:
+        alleles = [0, 1]
+    else:
+        alleles = [0]
+
+    ## grab snp and bis data from tmparr
     tmparrs = os.path.join(data.dirs.outfiles, "tmp-{}.h5".format(data.name)) 
     with h5py.File(tmparrs, 'r') as io5:
-        snparr = io5["snparr"]
-        bisarr = io5["bisarr"]
-
-        ## trim to size b/c it was made longer than actual
-        bend = np.where(np.all(bisarr[:] == "", axis=0))[0]
-        if np.any(bend):
-            bend = bend.min()
-        else:
-            bend = bisarr.shape[1]        
-
-        send = np.where(np.all(snparr[:] == "", axis=0))[0]       
-        if np.any(send):
-            send = send.min()
-        else:
-            send = snparr.shape[1]        
-
-        ## write to str and ustr
-        out1 = open(data.outfiles.str, 'w')
-        out2 = open(data.outfiles.ustr, 'w')
-        numdict = {'A': '0', 'T': '1', 'G': '2', 'C': '3', 'N': '-9', '-': '-9'}
-        if data.paramsdict["max_alleles_consens"] > 1:
-            for idx, name in enumerate(pnames):
-                out1.write("{}\t\t\t\t\t{}\n"\
-                    .format(name,
-                    "\t".join([numdict[DUCT[i][0]] for i in snparr[idx, :send]])))
-                out1.write("{}\t\t\t\t\t{}\n"\
-                    .format(name,
-                    "\t".join([numdict[DUCT[i][1]] for i in snparr[idx, :send]])))
-                out2.write("{}\t\t\t\t\t{}\n"\
-                    .format(name,
-                    "\t".join([numdict[DUCT[i][0]] for i in bisarr[idx, :bend]])))
-                out2.write("{}\t\t\t\t\t{}\n"\
-                    .format(name,
-                    "\t".join([numdict[DUCT[i][1]] for i in bisarr[idx, :bend]])))
-        else:
-            ## haploid output
-            for idx, name in enumerate(pnames):
-                out1.write("{}\t\t\t\t\t{}\n"\
-                    .format(name,
-                    "\t".join([numdict[DUCT[i][0]] for i in snparr[idx, :send]])))
-                out2.write("{}\t\t\t\t\t{}\n"\
-                    .format(name,
-                    "\t".join([numdict[DUCT[i][0]] for i in bisarr[idx, :bend]])))
-        out1.close()
-        out2.close()
+        for arr, outfile in [(io5["snparr"], data.outfiles.str), 
+                             (io5["bisarr"], data.outfiles.ustr)]:
+            end = arr.attrs["end"]
+            ## an empty row still gets the tab before the first column
+            spacer = "\t\t\t\t" + ("" if end else "\t")
+
+            ## write to str or ustr in blocks of rows
+            with open(outfile, 'w') as out:
+                for row, block in iter_rowblocks(arr, end):
+                    rows = [encode_structure(block, i) for i in alleles]
+                    tmpout = []
+                    for idx in xrange(block.shape[0]):
+                        for arows in rows:
+                            tmpout.append("{}{}{}\n"\
+                                .format(pnames[row+idx], spacer, arows[idx]))
+                    out.write("".join(tmpout))
     LOGGER.debug("finished writing str in: %s", time.time() - start)
 
 
@@ -1934,69 +2319,65 @@ def write_geno(data, sidx):
     start = time.time()
     tmparrs = os.path.join(data.dirs.outfiles, "tmp-{}.h5".format(data.name)) 
     with h5py.File(tmparrs, 'r') as io5:
-        snparr = io5["snparr"]
-        bisarr = io5["bisarr"]
+        for arr, outfile in [(io5["snparr"], data.outfiles.geno), 
+                             (io5["bisarr"], data.outfiles.ugeno)]:
+            end = arr.attrs["end"]
+
+            ## rows of the geno file are snps, so encode blocks of columns
+            ncols = max(1, int(50e6 // arr.shape[0]))
+            with open(outfile, 'w') as out:
+                for col in xrange(0, end, ncols):
+                    out.write(encode_geno(arr[:, col:min(col+ncols, end)]))
+    LOGGER.debug("finished writing geno in: %s", time.time() - start)
 
-        ## trim to size b/c it was made longer than actual
-        bend = np.where(np.all(bisarr[:] == "", axis=0))[0]
-        if np.any(bend):
-            bend = bend.min()
-        else:
-            bend = bisarr.shape[1]        
 
-        send = np.where(np.all(snparr[:] == "", axis=0))[0]       
-        if np.any(send):
-            send = send.min()
-        else:
-            send = snparr.shape[1]        
-
-        ## get most common base at each SNP as a pseudo-reference
-        ## and record 0,1,2 or missing=9 for counts of the ref allele
-        snpref = reftrick(snparr[:, :send].view(np.int8), GETCONS).view("S1")
-        bisref = reftrick(bisarr[:, :bend].view(np.int8), GETCONS).view("S1")
-
-        ## geno matrix to fill (9 is empty)
-        snpgeno = np.zeros((snparr.shape[0], send), dtype=np.uint8)
-        snpgeno.fill(9)
-        bisgeno = np.zeros((bisarr.shape[0], bend), dtype=np.uint8)
-        bisgeno.fill(9)
-
-        ##--------------------------------------------------------------------
-        ## fill in complete hits (match to first column ref base)
-        mask2 = np.array(snparr[:, :send] == snpref[:, 0])
-        snpgeno[mask2] = 2
-
-        ## fill in single hits (heteros) match to hetero of first+second column
-        ambref = np.apply_along_axis(lambda x: TRANSFULL[tuple(x)], 1, snpref[:, :2])
-        mask1 = np.array(snparr[:, :send] == ambref)
-        snpgeno[mask1] = 1
-
-        ## fill in zero hits, meaning a perfect match to the second column base
-        ## anything else is left at 9 (missing), b/c it's either missing or it
-        ## is not bi-allelic. 
-        mask0 = np.array(snparr[:, :send] == snpref[:, 1])
-        snpgeno[mask0] = 0
-
-        ##--------------------------------------------------------------------
-
-        ## fill in complete hits
-        mask2 = np.array(bisarr[:, :bend] == bisref[:, 0])
-        bisgeno[mask2] = 2
-
-        ## fill in single hits (heteros)
-        ambref = np.apply_along_axis(lambda x: TRANSFULL[tuple(x)], 1, bisref[:, :2])
-        mask1 = np.array(bisarr[:, :bend] == ambref)
-        bisgeno[mask1] = 1
-
-        ## fill in zero hits (match to second base)
-        mask0 = np.array(bisarr[:, :bend] == bisref[:, 1])
-        bisgeno[mask0] = 0
-
-        ##---------------------------------------------------------------------
-        ## print to files
-        np.savetxt(data.outfiles.geno, snpgeno.T, delimiter="", fmt="%d")
-        np.savetxt(data.outfiles.ugeno, bisgeno.T, delimiter="", fmt="%d")
-    LOGGER.debug("finished writing geno in: %s", time.time() - start)
+
+def iter_rowblocks(arr, end, maxbytes=50e6):
+    """ 
+    yields (row, block) for blocks of rows of a tmp h5 S1 array trimmed to
+    end columns, with blocks of about maxbytes.
+    """
+    nrows = max(1, int(maxbytes // max(1, end)))
+    for row in xrange(0, arr.shape[0], nrows):
+        yield row, arr[row:row+nrows, :end]
+
+
+
+def encode_structure(block, allele):
+    """
+    Returns a list with a string for each row of an S1 array of the tab
+    separated STRUCTURE codes of one allele of each base (0-3, -9 missing).
+    """
+    cells = STRUCTARR[block.view(np.uint8), allele].reshape(block.shape[0], -1)
+    keep = cells != 0
+    return [cells[idx][keep[idx]].tobytes() for idx in xrange(block.shape[0])]
+
+
+
+def encode_geno(block):
+    """
+    Returns geno file rows for the columns (snps) of an S1 array. Each 
+    sample is the count of the most common base (2, 1 for heterozygotes
+    with the second most common base, 0 for the second most common base) 
+    and 9 for missing or other bases.
+    """
+    ## get most common base at each SNP as a pseudo-reference
+    ints = block.view(np.uint8)
+    snpref = reftrick(block.view(np.int8), GETCONS)
+
+    ## geno matrix to fill (9 is empty). Matches to the ambiguity of the
+    ## first+second base are heteros, matches to the second base are zero.
+    geno = np.zeros(block.shape, dtype=np.uint8)
+    geno.fill(9)
+    geno[ints == snpref[:, 0]] = 2
+    geno[ints == TRANSARR[snpref[:, 0], snpref[:, 1]]] = 1
+    geno[ints == snpref[:, 1]] = 0
+
+    ## as ascii digits with a newline ending each snp
+    out = np.zeros((block.shape[1], block.shape[0] + 1), dtype=np.uint8)
+    out[:, -1] = ord("\n")
+    out[:, :-1] = geno.T + ord("0")
+    return out.tobytes()
 
 
 
@@ -2061,219 +2442,234 @@ def write_gphocs(data, sidx):
 
 
 
-def make_vcf(data, samples, ipyclient, full=0):
+def genochunk(data, cdata):
     """
-    Write the full VCF for loci passing filtering. Other vcf formats are
-    possible, like SNPs-only, or with filtered loci included but the filter
-    explicitly labeled. These are not yet supported, however.
+    Genos encoder of 'make_chunk_outputs()'. Returns the genotype store 
+    arrays for the snps of a chunk of loci.
     """
-    ## start vcf progress bar
-    start = time.time()
-    printstr = " building vcf file     | {} | s7 |"
-    LOGGER.info("Writing .vcf file")
-    elapsed = datetime.timedelta(seconds=int(time.time()-start))
-    progressbar(20, 0, printstr.format(elapsed), spacer=data._spacer)
+    faidict = get_faidict(data, cdata.start, cdata.end - cdata.start)
+    arrs = {key: [] for key in ["calldata/GT", "calldata/CATG", 
+            "variants/CHROM", "variants/POS", "variants/REF", 
+            "variants/ALT", "variants/LOCUS"]}
+    nsamp = cdata.sidx.sum()
+
+    for locid, chrom, poss, seq, catg in vcfloci(data, cdata, 0):
+        if chrom > 0:
+            chrom = faidict[chrom]
+        else:
+            chrom = faidict[(locid + 1) * -1]
+        alleles, genos = get_genos(seq, catg)
+        arrs["calldata/GT"].append(genos)
+        arrs["calldata/CATG"].append(catg.transpose(1, 0, 2))
+        arrs["variants/CHROM"].append([chrom] * poss.shape[0])
+        arrs["variants/POS"].append(poss)
+        arrs["variants/REF"].append(alleles[:, 0].view("S1"))
+        arrs["variants/ALT"].append(alleles[:, 1:].view("S1"))
+        arrs["variants/LOCUS"].append(np.repeat(locid, poss.shape[0]))
+
+    ## empty arrays of the right shape if no snps in this chunk
+    empties = {"calldata/GT": np.zeros((0, nsamp, 2), dtype=np.int8),
+               "calldata/CATG": np.zeros((0, nsamp, 4), dtype=np.uint32),
+               "variants/CHROM": np.zeros(0, dtype=object),
+               "variants/POS": np.zeros(0, dtype=np.int64),
+               "variants/REF": np.zeros(0, dtype="S1"),
+               "variants/ALT": np.zeros((0, 3), dtype="S1"),
+               "variants/LOCUS": np.zeros(0, dtype=np.int64)}
+    for key in arrs:
+        if arrs[key]:
+            arrs[key] = np.concatenate(arrs[key]).astype(empties[key].dtype)
+        else:
+            arrs[key] = empties[key]
+    return arrs
 
-    ## create outputs for v and V, gzip V to be friendly
-    data.outfiles.vcf = os.path.join(data.dirs.outfiles, data.name+".vcf")
-    if full:
-        data.outfiles.VCF = os.path.join(data.dirs.outfiles, data.name+".vcf.gz")
 
-    ## get some db info
-    with h5py.File(data.clust_database, 'r') as io5:
-        ## will iterate optim loci at a time
-        optim = io5["seqs"].attrs["chunksize"][0]
-        nloci = io5["seqs"].shape[0]
-        ## get name and snp padding
-        anames = io5["seqs"].attrs["samples"]
-        snames = [i.name for i in samples]
-        names = [i for i in anames if i in snames]
-
-    ## get names index
-    sidx = np.array([i in snames for i in anames])
 
-    ## client for sending jobs to parallel engines, for this step we'll limit
-    ## to half of the available cpus if
-    lbview = ipyclient.load_balanced_view()
+def concat_vcf(data, names, full):
+    """
+    Merges VCF chunks into the VCF output and cleans up chunks. Chunks of
+    reference assemblies are each sorted by (chrom, pos), so they are k-way
+    merged into coordinate order. The full VCF is written as BGZF and 
+    indexed with tabix for region queries.
+    """
+    ## get vcf chunks
+    vcfchunks = glob.glob(data.outfiles.vcf+".[0-9]*")
+    vcfchunks.sort(key=lambda x: int(x.rsplit(".")[-1]))
+    if not full:
+        handles = [open(i, 'r') for i in vcfchunks]
+    else:
+        handles = [gzip.open(i, 'r') for i in vcfchunks]
 
-    ## send jobs in chunks
-    vasyncs = {}
-    total = 0
-    for chunk in xrange(0, nloci, optim):
-        vasyncs[chunk] = lbview.apply(vcfchunk, *(data, optim, sidx, chunk, full))
-        total += 1
+    ## Reference chroms are ordered as in the faidx, then anonymous loci of
+    ## denovo+reference assemblies by locus number. Anonymous loci of denovo
+    ## assemblies are already in order across chunks.
+    if data.paramsdict["assembly_method"] in ["reference", "denovo+reference"]:
+        chromidx = get_chromidx(data)
+        keyed = [((vcfkey(line, chromidx), line) for line in handle) \
+                 for handle in handles]
+        lines = (line for _, line in heapq.merge(*keyed))
+    else:
+        lines = itertools.chain(*handles)
 
-    ## tmp files get left behind and intensive processes are left running when a
-    ## a job is killed/interrupted during vcf build, so we try/except wrap.
-    try:
-        while 1:
-            keys = [i for (i, j) in vasyncs.items() if j.ready()]
-            ## check for failures
-            for job in keys:
-                if not vasyncs[job].successful():
-                    ## raise exception
-                    err = " error in vcf build chunk {}: {}"\
-                          .format(job, vasyncs[job].result())
-                    LOGGER.error(err)
-                    raise IPyradWarningExit(err)
-                else:
-                    ## free up memory
-                    del vasyncs[job]
+    ## open handle and write headers and merged lines
+    if not full:
+        outfile = data.outfiles.vcf
+    elif BGZFile:
+        outfile = data.outfiles.VCF
+    else:
+        outfile = data.outfiles.VCF+".tmp"
+    if BGZFile and full:
+        writer = BGZFile(outfile, 'wb')
+    else:
+        writer = open(outfile, 'w')
+    vcfheader(data, names, writer)
+    for line in lines:
+        writer.write(line)
+    writer.close()
 
-            finished = total - len(vasyncs) #sum([i.ready() for i in vasyncs.values()])
-            elapsed = datetime.timedelta(seconds=int(time.time()-start))
-            progressbar(total, finished, printstr.format(elapsed), spacer=data._spacer)
-            time.sleep(0.5)
-            if not vasyncs:
-                break
-        print("")
+    for handle in handles:
+        handle.close()
+    for chunk in vcfchunks:
+        os.remove(chunk)
 
-    except Exception as inst:
-        ## make sure all future jobs are aborted
-        keys = [i for (i, j) in vasyncs.items() if not j.ready()]
+    ## compress and index the full vcf
+    if full:
+        if not BGZFile:
+            pysam.tabix_compress(outfile, data.outfiles.VCF, force=True)
+            os.remove(outfile)
         try:
-            for job in keys:
-                #vasyncs[job].abort()
-                vasyncs[job].cancel()
-        except Exception:
-            pass
-        ## make sure all tmp files are destroyed
-        vcfchunks = glob.glob(os.path.join(data.dirs.outfiles, "*.vcf.[0-9]*"))
-        h5chunks = glob.glob(os.path.join(data.dirs.outfiles, ".tmp.[0-9]*.h5"))
-        for dfile in vcfchunks+h5chunks:
-            os.remove(dfile)
-        ## reraise the error
-        raise inst
+            pysam.tabix_index(data.outfiles.VCF, preset="vcf", force=True)
+        except (IOError, OSError):
+            ## positions beyond 2^29 need a CSI index
+            pysam.tabix_index(data.outfiles.VCF, preset="vcf", force=True, 
+                              min_shift=14)
 
 
-    ## writing full vcf file to disk
-    start = time.time()
-    printstr = " writing vcf file      | {} | s7 |"
-    res = lbview.apply(concat_vcf, *(data, names, full))
-    ogchunks = len(glob.glob(data.outfiles.vcf+".*"))
-    while 1:
-        elapsed = datetime.timedelta(seconds=int(time.time()-start))
-        curchunks = len(glob.glob(data.outfiles.vcf+".*"))
-        progressbar(ogchunks, ogchunks-curchunks, printstr.format(elapsed), spacer=data._spacer)
-        time.sleep(0.1)
-        if res.ready():
-            break
-    elapsed = datetime.timedelta(seconds=int(time.time()-start))
-    progressbar(1, 1, printstr.format(elapsed), spacer=data._spacer)
-    print("")
+
+def get_chromidx(data):
+    """ returns a dict of reference chrom names to their 1-indexed order """
+    chromidx = {}
+    if os.path.exists(data.paramsdict["reference_sequence"] + ".fai"):
+        fai = pd.read_csv(data.paramsdict["reference_sequence"] + ".fai", 
+                names=['scaffold', 'size', 'sumsize', 'a', 'b'],
+                sep="\t")
+        chromidx = {j:i+1 for i, j in enumerate(fai.scaffold)}
+    return chromidx
 
 
 
-def concat_vcf(data, names, full):
+def vcfkey(line, chromidx):
     """
-    Sorts, concatenates, and gzips VCF chunks. Also cleans up chunks.
+    Returns the sort key of a VCF row. Reference chroms sort first by their
+    faidx order, anonymous loci (locus_N) after by locus number.
     """
-    ## open handle and write headers
-    if not full:
-        writer = open(data.outfiles.vcf, 'w')
-    else:
-        writer = gzip.open(data.outfiles.VCF, 'w')
-    vcfheader(data, names, writer)
-    writer.close()
+    chrom, pos, _ = line.split("\t", 2)
+    if chrom in chromidx:
+        return (0, chromidx[chrom], int(pos))
+    return (1, int(chrom.rsplit("_", 1)[1]), int(pos))
 
-    ## get vcf chunks
-    vcfchunks = glob.glob(data.outfiles.vcf+".*")
-    vcfchunks.sort(key=lambda x: int(x.rsplit(".")[-1]))
 
-    ## concatenate
+
+def vcfchunk(data, cdata, full):
+    """
+    Vcf encoder of 'make_chunk_outputs()' that writes a chunk file.
+    Genotype columns are built as integer arrays for each locus and written
+    as GT:DP:CATG bytes by 'vcfgenos_numba()' straight to the chunk file.
+    """
+    ## get scaffold names
+    chunk = cdata.start
+    faidict = get_faidict(data, chunk, cdata.end - chunk)
+
+    ## write rows as they are built, the chunk is removed if it's empty.
+    ## Rows of reference assemblies are sorted by (chrom, pos) before they
+    ## are written, so chunks can be merged without an external sort.
+    vcfout = data.outfiles.vcf+".{}".format(chunk)
     if not full:
-        writer = open(data.outfiles.vcf, 'a')
+        writer = open(vcfout, 'w')
     else:
-        writer = gzip.open(data.outfiles.VCF, 'a')
+        writer = gzip.open(vcfout, 'w')
+    tosort = data.paramsdict["assembly_method"] in ["reference", "denovo+reference"]
+    sortrows = []
+    tot = 0
+
+    ## write loci that passed after trimming edges
+    for locid, chrom, poss, seq, catg in vcfloci(data, cdata, full):
+        ## CHROM and POS. If any < 0 this indicates an anonymous locus in 
+        ## denovo+ref assembly
+        if chrom > 0:
+            chromkey = (0, chrom)
+            chrom = faidict[chrom]
+        else:
+            chromkey = (1, locid)
+            chrom = faidict[(locid + 1) * -1]
 
-    ## what order do users want? The order in the original ref file?
-    ## Sorted by the size of chroms? that is the order in faidx.
-    ## If reference mapping then it's nice to sort the vcf data by
-    ## CHROM and POS. This is doing a very naive sort right now, so the
-    ## CHROM will be ordered, but not the pos within each chrom.
-    if data.paramsdict["assembly_method"] in ["reference", "denovo+reference"]:
-        ## Some unix sorting magic to get POS sorted within CHROM
-        ## First you sort by POS (-k 2,2), then you do a `stable` sort 
-        ## by CHROM. You end up with POS ordered and grouped correctly by CHROM
-        ## but relatively unordered CHROMs (locus105 will be before locus11).
-        cmd = ["cat"] + vcfchunks + [" | sort -k 2,2 -n | sort -k 1,1 -s"]
-        cmd = " ".join(cmd)
-        proc = sps.Popen(cmd, shell=True, stderr=sps.STDOUT, stdout=writer, close_fds=True)
-    else:
-        proc = sps.Popen(["cat"] + vcfchunks, stderr=sps.STDOUT, stdout=writer, close_fds=True)
+        ## get the info string column
+        tmp0 = np.sum(catg, axis=2)
+        nsamp = np.sum(tmp0 != 0, axis=0)
+        depth = np.sum(tmp0, axis=0)
+
+        ## ref and alt alleles and genotypes
+        alleles, genos = get_genos(seq, catg)
+
+        ## format the genotype columns to bytes
+        nbytes = genos.shape[0] * (genos.shape[1] * 64 + 1)
+        buff = np.zeros(nbytes, dtype=np.uint8)
+        ends = vcfgenos_numba(genos, catg.transpose(1, 0, 2).astype(np.int64), buff)
+        buff = buff[:ends[-1]].tostring()
+
+        ## write rows with the site columns in front
+        alts = alleles[:, 1:].view("S1")
+        last = 0
+        for row in xrange(genos.shape[0]):
+            line = "\t".join([
+                chrom, str(poss[row]), ".", 
+                alleles[row, 0:1].view("S1")[0],
+                ",".join([j for j in alts[row].tolist() if j]),
+                "13", "PASS", 
+                "NS={};DP={}".format(nsamp[row], depth[row]),
+                "GT:DP:CATG", 
+                buff[last:ends[row]]])
+            last = ends[row]
+            if tosort:
+                sortrows.append((chromkey + (poss[row],), line))
+            else:
+                writer.write(line)
+        tot += genos.shape[0]
 
-    err = proc.communicate()[0]
-    if proc.returncode:
-        raise IPyradWarningExit("err in concat_vcf: %s", err)
+    ## write sorted rows
+    sortrows.sort()
+    for _, line in sortrows:
+        writer.write(line)
     writer.close()
 
-    for chunk in vcfchunks:
-        os.remove(chunk)
+    ## Only keep the chunk if there is some data that passed filtering
+    if not tot:
+        os.remove(vcfout)
 
 
 
-def vcfchunk(data, optim, sidx, chunk, full):
+def vcfloci(data, cdata, full):
     """
-    Function called within make_vcf to run chunks on separate engines.
+    Yields the loci of a chunk that passed filtering as (locus id, chrom, 
+    positions, seqs, catgs), where chrom is the 1-indexed reference chrom
+    or <= 0 for anonymous loci, positions are the 1-indexed POS of each 
+    site, and seqs (samples, sites) and catgs (samples, sites, 4) are the 
+    data for sidx samples at sites within the edges, or only the snps if 
+    not full. Loci with no sites are skipped.
     """
-    ## empty array to be filled before writing
-    ## will not actually be optim*maxlen, extra needs to be trimmed
-    maxlen = data._hackersonly["max_fragment_length"] + 20
-
-    ## get data sliced (optim chunks at a time)
-    hslice = [chunk, chunk+optim]
-
-    ## read all taxa from disk (faster), then subsample taxa with sidx and
-    ## keepmask to greatly reduce the memory load
-    with h5py.File(data.database, 'r') as co5:
-        afilt = co5["filters"][hslice[0]:hslice[1], :]
-        keepmask = afilt.sum(axis=1) == 0
-        ## apply mask to edges
-        aedge = co5["edges"][hslice[0]:hslice[1], :]
-        aedge = aedge[keepmask, :]
-    del afilt
-    ## same memory subsampling.
-    with h5py.File(data.clust_database, 'r') as io5:
-        ## apply mask to edges to aseqs and acatg
-        #aseqs = io5["seqs"][hslice[0]:hslice[1], :, :].view(np.uint8)
-        ## need to read in seqs with upper b/c lowercase allele info
-        aseqs = np.char.upper(io5["seqs"][hslice[0]:hslice[1], :, :]).view(np.uint8)
-        aseqs = aseqs[keepmask, :]
-        aseqs = aseqs[:, sidx, :]
-        acatg = io5["catgs"][hslice[0]:hslice[1], :, :, :]
-        acatg = acatg[keepmask, :]
-        acatg = acatg[:, sidx, :, :]
-        achrom = io5["chroms"][hslice[0]:hslice[1]]
-        achrom = achrom[keepmask, :]        
-
-    LOGGER.info('acatg.shape %s', acatg.shape)
-    ## to save memory some columns are stored in diff dtypes until printing
+    ## the chunk's arrays subsampled with keepmask and sidx to greatly 
+    ## reduce the memory load
+    chunk = cdata.start
+    keepmask = cdata.keep
+    aedge = cdata.edges[keepmask, :]
     if not full:
-        with h5py.File(data.database, 'r') as co5:
-            snps = co5["snps"][hslice[0]:hslice[1], :]
-            snps = snps[keepmask, :]
-            snps = snps.sum(axis=2)
-        snpidxs = snps > 0
-        maxsnplen = snps.sum()
-
-    ## vcf info to fill, this is bigger than the actual array
-    nrows = maxsnplen
-    cols0 = np.zeros(nrows, dtype=np.int64) #h5py.special_dtype(vlen=bytes))
-    cols1 = np.zeros(nrows, dtype=np.uint32)
-    cols34 = np.zeros((nrows, 2), dtype="S5")
-    cols7 = np.zeros((nrows, 1), dtype="S20")
-
-    ## when nsamples is high this blows up memory (e.g., dim=(5M x 500))
-    ## so we'll instead create a list of arrays with 10 samples at a time.
-    ## maybe later replace this with a h5 array
-    tmph = os.path.join(data.dirs.outfiles, ".tmp.{}.h5".format(hslice[0]))
-    htmp = h5py.File(tmph, 'w')
-    htmp.create_dataset("vcf", shape=(nrows, sum(sidx)), dtype="S20")
-
-    ## which loci passed all filters
-    init = 0
+        snpidxs = cdata.snps[keepmask, :].sum(axis=2) > 0
+    ## upper seqs b/c lowercase allele info
+    aseqs = cdata.seqs.view(np.uint8)[keepmask, :]
+    aseqs = aseqs[:, cdata.sidx, :]
+    acatg = cdata.catgs[keepmask, :]
+    achrom = cdata.chroms[keepmask, :]
+    LOGGER.info('acatg.shape %s', acatg.shape)
 
-    ## write loci that passed after trimming edges, then write snp string
     locindex = np.where(keepmask)[0]
     for iloc in xrange(aseqs.shape[0]):
         edg = aedge[iloc]
@@ -2283,8 +2679,6 @@ def vcfchunk(data, optim, sidx, chunk, full):
             catg = acatg[iloc, :, edg[0]:edg[1]+1]
             if not full:
                 snpidx = snpidxs[iloc, edg[0]:edg[1]+1]
-                seq = seq[:, snpidx]
-                catg = catg[:, snpidx]
         else:
             seq = np.hstack([aseqs[iloc, :, edg[0]:edg[1]+1],
                              aseqs[iloc, :, edg[2]:edg[3]+1]])
@@ -2293,98 +2687,31 @@ def vcfchunk(data, optim, sidx, chunk, full):
             if not full:
                 snpidx = np.hstack([snpidxs[iloc, edg[0]:edg[1]+1],
                                     snpidxs[iloc, edg[2]:edg[3]+1]])
-                seq = seq[:, snpidx]
-                catg = catg[:, snpidx]
-
-        ## empty arrs to fill
-        alleles = np.zeros((nrows, 4), dtype=np.uint8)
-        genos = np.zeros((seq.shape[1], sum(sidx)), dtype="S4")
-        genos[:] = "./.:"
+        if full:
+            sites = np.arange(seq.shape[1])
+        else:
+            sites = np.where(snpidx)[0]
+            seq = seq[:, sites]
+            catg = catg[:, sites]
+        if not seq.shape[1]:
+            continue
 
-        ## ----  build string array ----
-        pos = 0
-        ## If any < 0 this indicates an anonymous locus in denovo+ref assembly
+        ## reference mapped loci are positioned on their chrom
         if achrom[iloc][0] > 0:
-            pos = achrom[iloc][1]
-            cols0[init:init+seq.shape[1]] = achrom[iloc][0]
-            cols1[init:init+seq.shape[1]] = pos + np.where(snpidx)[0] + 1
+            poss = achrom[iloc][1] + sites + 1
         else:
-            if full:
-                cols1[init:init+seq.shape[1]] = pos + np.arange(seq.shape[1]) + 1
-            else:
-                cols1[init:init+seq.shape[1]] = pos + np.where(snpidx)[0] + 1
-                cols0[init:init+seq.shape[1]] = (chunk + locindex[iloc] + 1) * -1
+            poss = sites + 1
+        yield chunk + locindex[iloc], achrom[iloc][0], poss, seq, catg
 
-        ## fill reference base
-        alleles = reftrick(seq, GETCONS)
 
-        ## get the info string column
-        tmp0 = np.sum(catg, axis=2)
-        tmp1 = tmp0 != 0
-        tmp2 = tmp1.sum(axis=1) > 0
-        nsamp = np.sum(tmp1, axis=0)
-        depth = np.sum(tmp0, axis=0)
-        list7 = [["NS={};DP={}".format(i, j)] for i, j in zip(nsamp, depth)]
-        if list7:
-            cols7[init:init+seq.shape[1]] = list7
-
-        ## default fill cons sites where no variants
-        genos[tmp1.T] = "0/0:"
-
-        ## fill cons genotypes for sites with alt alleles for taxa in order
-        mask = alleles[:, 1] == 46
-        mask += alleles[:, 1] == 45
-
-        obs = alleles[~mask, :]
-        alts = seq[:, ~mask]
-        who = np.where(mask == False)[0]
-        ## fill variable sites
-        for site in xrange(alts.shape[1]):
-            bases = alts[:, site]
-            #LOGGER.info("bases %s", bases)
-            ohere = obs[site][obs[site] != 0]
-            #LOGGER.info("ohere %s", ohere)
-            alls = np.array([DCONS[i] for i in bases], dtype=np.uint32)
-            #LOGGER.info("all %s", alls)
-            for jdx in xrange(ohere.shape[0]):
-                alls[alls == ohere[jdx]] = jdx
-
-            #LOGGER.info("all2 %s", alls)
-            ## fill into array
-            for cidx in xrange(catg.shape[0]):
-                if tmp2[cidx]:
-                    if alls[cidx][0] < 5:
-                        genos[who[site], cidx] = "/".join(alls[cidx].astype("S1").tolist())+":"
-                    else:
-                        genos[who[site], cidx] = "./.:"
-                    #LOGGER.info("genos filled: %s %s %s", who[site], cidx, genos)
-
-        ## build geno+depth strings
-        ## for each taxon enter 4 catg values
-        fulltmp = np.zeros((seq.shape[1], catg.shape[0]), dtype="S20")
-        for cidx in xrange(catg.shape[0]):
-            ## fill catgs from catgs
-            tmp0 = [str(i.sum()) for i in catg[cidx]]
-            tmp1 = [",".join(i) for i in catg[cidx].astype("S4").tolist()]
-            tmp2 = ["".join(i+j+":"+k) for i, j, k in zip(genos[:, cidx], tmp0, tmp1)]
-            ## fill tmp allcidx
-            fulltmp[:, cidx] = tmp2
-
-        ## write to h5 for this locus
-        htmp["vcf"][init:init+seq.shape[1], :] = fulltmp
-
-        cols34[init:init+seq.shape[1], 0] = alleles[:, 0].view("S1")
-        cols34[init:init+seq.shape[1], 1] = [",".join([j for j in i if j]) \
-                                    for i in alleles[:, 1:].view("S1").tolist()]
-
-        ## advance counter
-        init += seq.shape[1]
-
-    ## trim off empty rows if they exist
-    withdat = cols0 != 0
-    tot = withdat.sum()
 
-    ## get scaffold names
+def get_faidict(data, chunk, optim):
+    """
+    Returns a dict of chrom numbers to names. The faidict uses positive 
+    numbers for reference sequence mapped loci for the CHROM/POS info, and
+    it uses negative numbers for anonymous loci. Both are 1 indexed, which 
+    is where that last `+ 2` comes from.
+    """
     faidict = {}
     if (data.paramsdict["assembly_method"] in ["reference", "denovo+reference"]) and \
        (os.path.exists(data.paramsdict["reference_sequence"])):
@@ -2392,54 +2719,102 @@ def vcfchunk(data, optim, sidx, chunk, full):
                 names=['scaffold', 'size', 'sumsize', 'a', 'b'],
                 sep="\t")
         faidict = {i+1:j for i,j in enumerate(fai.scaffold)}
-    try:
-        ## This is hax, but it's the only way it will work. The faidict uses positive numbers
-        ## for reference sequence mapped loci for the CHROM/POS info, and it uses negative
-        ## numbers for anonymous loci. Both are 1 indexed, which is where that last `+ 2` comes from.
-        faidict.update({-i:"locus_{}".format(i-1) for i in xrange(chunk+1, chunk + optim + 2)})
-        chroms = [faidict[i] for i in cols0]
-    except Exception as inst:
-        LOGGER.error("Invalid chromosome dictionary indexwat: {}".format(inst))
-        LOGGER.debug("faidict {}".format([str(k)+"/"+str(v) for k, v in faidict.items() if "locus" in v]))
-        LOGGER.debug("chroms {}".format([x for x in cols0 if x < 0]))
-        raise
-    cols0 = np.array(chroms)
-    #else:
-    #    cols0 = np.array(["locus_{}".format(i) for i in cols0-1])
-
-    ## Only write if there is some data that passed filtering
-    if tot:
-        LOGGER.debug("Writing data to vcf")
-        if not full:
-            writer = open(data.outfiles.vcf+".{}".format(chunk), 'w')
-        else:
-            writer = gzip.open(data.outfiles.vcf+".{}".format(chunk), 'w')
+    faidict.update({-i:"locus_{}".format(i-1) for i in xrange(chunk+1, chunk + optim + 2)})
+    return faidict
+
+
+
+def get_genos(seq, catg):
+    """
+    Returns the (sites, 4) ref and alt alleles from 'reftrick()' and the
+    (sites, samples, 2) genotypes as indices of those alleles, -1 is missing.
+    """
+    ## fill reference base
+    alleles = reftrick(seq, GETCONS)
+    tmp1 = np.sum(catg, axis=2) != 0
+    tmp2 = tmp1.sum(axis=1) > 0
+
+    ## default fill cons sites where no variants
+    genos = np.zeros((seq.shape[1], seq.shape[0], 2), dtype=np.int8)
+    genos[~tmp1.T] = -1
+
+    ## fill cons genotypes for sites with alt alleles for taxa in order
+    mask = alleles[:, 1] == 46
+    mask += alleles[:, 1] == 45
+    who = np.where(~mask)[0]
+    if who.shape[0]:
+        ## (samples, sites, 2) base calls, then index in obs alleles
+        alls = DCONSARR[seq[:, who]]
+        obs = alleles[who]
+        match = alls[:, :, :, np.newaxis] == obs[np.newaxis, :, np.newaxis, :]
+        idxs = np.where(match.any(axis=3), match.argmax(axis=3), -1)
+        idxs[(idxs < 0).any(axis=2)] = -1
+        idxs[~tmp2] = genos[who][:, ~tmp2].transpose(1, 0, 2)
+        genos[who] = idxs.transpose(1, 0, 2)
+    return alleles, genos
+
+
+
+@numba.jit(nopython=True)
+def vcfgenos_numba(genos, catgs, buff):
+    """
+    Writes the GT:DP:CATG columns of each row as tab separated ascii into
+    buff and returns the end position of each row (newline included).
+    genos is (rows, samples, 2) allele indices with -1 as missing, and
+    catgs is (rows, samples, 4) base counts.
+    """
+    ends = np.zeros(genos.shape[0], dtype=np.int64)
+    pos = 0
+    for row in xrange(genos.shape[0]):
+        for sidx in xrange(genos.shape[1]):
+            if sidx:
+                buff[pos] = 9
+                pos += 1
+
+            ## genotype, e.g., 0/1 or ./.
+            if genos[row, sidx, 0] < 0:
+                buff[pos] = 46
+                buff[pos+2] = 46
+            else:
+                buff[pos] = 48 + genos[row, sidx, 0]
+                buff[pos+2] = 48 + genos[row, sidx, 1]
+            buff[pos+1] = 47
+            buff[pos+3] = 58
+            pos += 4
+
+            ## depth
+            depth = 0
+            for base in xrange(4):
+                depth += catgs[row, sidx, base]
+            pos = write_int(buff, pos, depth)
+            buff[pos] = 58
+            pos += 1
+
+            ## catg counts
+            for base in xrange(4):
+                if base:
+                    buff[pos] = 44
+                    pos += 1
+                pos = write_int(buff, pos, catgs[row, sidx, base])
+        buff[pos] = 10
+        pos += 1
+        ends[row] = pos
+    return ends
 
-        try:
-            ## write in iterations b/c it can be freakin huge.
-            ## for cols0 and cols1 the 'newaxis' slice and the transpose
-            ## are for turning the 1d arrays into column vectors.
-            np.savetxt(writer,
-                np.concatenate(
-                   (cols0[:tot][np.newaxis].T,
-                    cols1[:tot][np.newaxis].T,
-                    np.array([["."]]*tot, dtype="S1"),
-                    cols34[:tot, :],
-                    np.array([["13", "PASS"]]*tot, dtype="S4"),
-                    cols7[:tot, :],
-                    np.array([["GT:DP:CATG"]]*tot, dtype="S10"),
-                    htmp["vcf"][:tot, :],
-                    ),
-                    axis=1),
-                delimiter="\t", fmt="%s")
-        except Exception as inst:
-            LOGGER.error("Error building vcf file - ".format(inst))
-            raise
-        writer.close()
 
-    ## close and remove tmp h5
-    htmp.close()
-    os.remove(tmph)
+
+@numba.jit(nopython=True)
+def write_int(buff, pos, val):
+    """ writes a non-negative int as ascii digits into buff at pos """
+    ndig = 1
+    tmp = val
+    while tmp >= 10:
+        tmp //= 10
+        ndig += 1
+    for idx in xrange(ndig-1, -1, -1):
+        buff[pos+idx] = 48 + val % 10
+        val //= 10
+    return pos + ndig
 
 
 
@@ -2490,6 +2865,15 @@ def reftrick(iseq, consdict):
 
 
 
+## the per-locus filter stats in the stats cache, see 'filter_stacks()'
+STATS = ["efilter", "maxhets", "nindels", "nsnps"]
+
+## encoders run on each chunk of loci by 'chunk_outputs()', by sink name
+ENCODERS = {"loci": locichunk,
+            "vcf": vcfchunk,
+            "genos": genochunk,
+            "arrays": worker_make_arrays}
+
 GETCONS = np.array([[82, 71, 65],
                     [75, 71, 84],
                     [83, 71, 67],
@@ -2522,6 +2906,31 @@ DCONS = {67: [67, 67],
          78: [46, 46],
          45: [46, 46]}
 
+## uppercases bases of an |S1 array viewed as uint8.
+UPPERARR = np.arange(256, dtype=np.uint8)
+UPPERARR[ord("a"):ord("z")+1] -= 32
+
+## DCONS as an array indexed by base, unknown bases are missing (46).
+DCONSARR = np.zeros((256, 2), dtype=np.uint8)
+DCONSARR[:] = 46
+for _base, _calls in DCONS.items():
+    DCONSARR[_base] = _calls
+
+## STRUCTURE codes of each allele of a base as tab-prefixed tokens, padded
+## with zeros to three bytes. Unknown bases are missing (-9).
+STRUCTARR = np.zeros((256, 2, 3), dtype=np.uint8)
+STRUCTARR[:] = [ord(i) for i in "\t-9"]
+for _base, _calls in DUCT.items():
+    for _allele, _call in enumerate(_calls):
+        _code = {'A': '0', 'T': '1', 'G': '2', 'C': '3'}.get(_call, '-9')
+        STRUCTARR[ord(_base), _allele, :len(_code)+1] = [ord(i) for i in "\t"+_code]
+        STRUCTARR[ord(_base), _allele, len(_code)+1:] = 0
+
+## ambiguity code of a pair of bases, zero for pairs without one
+TRANSARR = np.zeros((256, 256), dtype=np.uint8)
+for _pair, _amb in TRANSFULL.items():
+    TRANSARR[ord(_pair[0]), ord(_pair[1])] = ord(_amb)
+
 # GETCONS = np.array([["C", "C", "C"],
 #                     ["A", "A", "A"],
 #                     ["T", "T", "T"],
@@ -2577,8 +2986,6 @@ def vcfheader(data, names, ofile):
 """.format(date=time.strftime("%Y/%m/%d"),
            version=__version__,
            reference=os.path.basename(reference),
-           mincov=data.paramsdict["min_samples_locus"],
-           maxsh=data.paramsdict["max_shared_Hs_locus"],
            names="\t".join(names))
     ## WRITE
     ofile.write(header)
@@ -223,7 +223,13 @@ class Assembly(object):
                         ("aligner", "bwa"),
                         ("min_SE_refmap_overlap", 10),
                         ("refmap_merge_PE", True),
-                        ("bwa_args", "")
+                        ("bwa_args", ""),
+                        ("ref_merge_across", False),
+                        ("cluster_across_shards", 0),
+                        ("incremental_across", False),
+                        ("catg_layout", "dense"),
+                        ("seqs_encoding", "S1"),
+                        ("chunk_autotune", "off"),
         ])
 
     def __str__(self):
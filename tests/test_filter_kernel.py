@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+""" checks the step 7 filter kernel on toy locus blocks. Expected values
+    are the outputs of the separate filter functions that it replaced
+    (get_edges, filter_minsamp, filter_maxhet, filter_indels, filter_maxsnp)
+"""
+
+import numpy as np
+from ipyrad.assemble.write_outfiles import site_numba, filter_numba, \
+    coverage_numba, pop_coverage, filter_stats, get_edge_params, \
+    get_filter_params
+
+
+R1 = "TGCAGACGTTACGATCAGGATCCATTGACGTA"
+R2 = "CCATGGTACCGATTAGCAACGTGC"
+PR1 = R1[:24]
+
+
+def mut(seq, site, base):
+    return seq[:site] + base + seq[site+1:]
+
+
+## (R1 left, R1 right, R2 left, R2 right, split), snp sites (-, *), and
+## the filters (indels, snps, hets, minsamp) of each locus
+SINGLE = {
+    "loci": [
+        [R1, R1, R1, R1[:28] + "NNNN"],
+        [R1, mut(mut(R1, 10, "G"), 20, "R"), mut(mut(R1, 15, "T"), 20, "R"),
+         mut(mut(R1, 15, "T"), 25, "-")],
+        [R1, "N"*32, "N"*32, "N"*32],
+        [R1, R1[:29] + "---", R1, "N"*32],
+        ],
+    "edges": [[5, 31, 0, 0, 0], [5, 31, 0, 0, 0], [0, 1, 0, 0, 0],
+              [5, 31, 0, 0, 0]],
+    "snps": [([], []), ([10], [15, 20]), ([], []), ([], [])],
+    "filters": [[0, 0, 0, 0], [1, 1, 1, 0], [0, 0, 0, 1], [0, 0, 0, 0]],
+    "coverage": [4, 4, 1, 3],
+    }
+
+PAIRED = {
+    "loci": [
+        [PR1+"nnnn"+R2, PR1+"nnnn"+R2, PR1+"nnnn"+mut(R2, 5, "C"), "N"*52],
+        [PR1+"nnnn"+R2, mut(PR1, 12, "-")+"nnnn"+R2,
+         PR1+"nnnn"+mut(R2, 9, "Y"), PR1+"nnnn"+mut(R2, 9, "Y")],
+        ],
+    "edges": [[5, 23, 28, 51, 24], [5, 23, 28, 51, 24]],
+    "snps": [([33], []), ([], [37])],
+    "filters": [[0, 0, 0, 0], [1, 0, 1, 0]],
+    "coverage": [3, 4],
+    }
+
+
+class Toy(object):
+    """ stands in for the Assembly attributes that are used """
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+
+def get_data(pair):
+    return Toy(populations={}, paramsdict={
+        "trim_loci": (0, 0, 0, 0),
+        "restriction_overhang": ("TGCAG", ""),
+        "min_samples_locus": 2,
+        "max_shared_Hs_locus": 1,
+        "max_SNPs_locus": (2, 2),
+        "max_Indels_locus": (0, 0),
+        "max_alleles_consens": 2,
+        "datatype": "pairgbs" if pair else "gbs"})
+
+
+
+def run_kernel(data, superints, splits):
+    hasdata, nhets, snpraw, nmask, gapmask = site_numba(superints)
+    edges, snps, efilter, maxhets, nindels, nsnps = filter_numba(
+        nmask, gapmask, nhets, snpraw, splits, *get_edge_params(data))
+    params = get_filter_params(data, superints.shape[1])
+    stats = {"efilter": efilter, "maxhets": maxhets, "nindels": nindels,
+             "nsnps": nsnps, "nalleles": np.zeros(superints.shape[0]),
+             "popcov": pop_coverage(hasdata, params[0])}
+    filters = filter_stats(stats, *params[1:])
+    return edges, snps, filters, coverage_numba(nmask, edges)
+
+
+
+def check_block(block, split):
+    data = get_data(split)
+    arr = np.array([[list(i) for i in loc] for loc in block["loci"]])
+    superints = np.char.upper(arr.astype("S1")).view(np.int8)
+    splits = np.zeros(superints.shape[0], dtype=np.uint16) + split
+    edges, snps, filters, coverage = run_kernel(data, superints, splits)
+
+    assert edges.tolist() == block["edges"]
+    for loc, (auta, pis) in zip(snps, block["snps"]):
+        assert np.where(loc[:, 0])[0].tolist() == auta
+        assert np.where(loc[:, 1])[0].tolist() == pis
+    assert filters[:, :4].astype(int).tolist() == block["filters"]
+    assert coverage.tolist() == block["coverage"]
+
+
+
+def test_single_end_block():
+    check_block(SINGLE, 0)
+
+
+def test_paired_block():
+    check_block(PAIRED, 24)
+
+
+def test_empty_chunk():
+    superints = np.zeros((0, 4, 32), dtype=np.int8)
+    splits = np.zeros(0, dtype=np.uint16)
+    edges, snps, filters, coverage = run_kernel(get_data(0), superints, splits)
+    assert edges.shape == (0, 5)
+    assert snps.shape == (0, 32, 2)
+    assert filters.shape == (0, 5)
+    assert coverage.shape == (0, )
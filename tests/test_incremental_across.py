@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+""" checks that step 6 can extend a clust database with new samples """
+
+import os
+import h5py
+import numpy as np
+from ipyrad.assemble.cluster_across import inc_fill_database
+
+
+MAXFRAG = 10
+MAXLEN = MAXFRAG + 20
+OLDSEQ = "ACGTACGTAC"
+
+
+class Toy(object):
+    """ stands in for the Assembly and Sample attributes that are used """
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+
+def make_database(tmpdir):
+    """ a 3 locus clust database of samples A and C """
+    data = Toy(name="toy",
+               tmpdir=str(tmpdir.mkdir("toy-tmpalign")),
+               clust_database=str(tmpdir.join("toy.clust.hdf5")),
+               _hackersonly={"max_fragment_length": MAXFRAG})
+
+    seqs = np.zeros((3, 2, MAXLEN), dtype="|S1")
+    seqs.fill("N")
+    seqs[:, :, :len(OLDSEQ)] = list(OLDSEQ)
+    catgs = np.zeros((3, 2, MAXLEN, 4), dtype=np.uint32)
+    catgs[:, :, :len(OLDSEQ)] = np.arange(1, 1+len(OLDSEQ))[:, None]
+    catgs[:, 1] *= 100
+    nalls = np.ones((3, 2), dtype=np.uint8)
+
+    with h5py.File(data.clust_database, 'w') as io5:
+        io5.create_dataset("seqs", data=seqs, chunks=(2, 2, MAXLEN),
+                           maxshape=(None, None, MAXLEN))
+        io5.create_dataset("catgs", data=catgs, chunks=(2, 2, MAXLEN, 4),
+                           maxshape=(None, None, MAXLEN, 4))
+        io5.create_dataset("nalleles", data=nalls, chunks=(2, 2),
+                           maxshape=(None, None))
+        io5.create_dataset("chroms", data=np.zeros((3, 3), dtype=np.int64),
+                           chunks=(2, 3), maxshape=(None, 3))
+        io5.create_dataset("splits", data=np.zeros(3, dtype=np.uint16),
+                           chunks=(2, ), maxshape=(None, ))
+        io5.create_dataset("duplicates", data=np.zeros(3, dtype=np.bool_),
+                           chunks=(2, ), maxshape=(None, ))
+        io5["seqs"].attrs["chunksize"] = (2, 2, MAXLEN)
+        for key in ["seqs", "catgs", "nalleles", "chroms"]:
+            io5[key].attrs["samples"] = ["A", "C"]
+    return data
+
+
+
+def make_sample(tmpdir, name, fill):
+    """ a new sample with two consens reads in its catg database """
+    sample = Toy(name=name, files=Toy(database=str(tmpdir.join(name+".h5"))))
+    with h5py.File(sample.files.database, 'w') as io5:
+        catg = np.zeros((2, MAXLEN, 4), dtype=np.uint32)
+        catg[:, :11] = fill
+        io5.create_dataset("catg", data=catg)
+        io5.create_dataset("nalleles", data=np.array([1, 2], dtype=np.uint8))
+    return sample
+
+
+
+def test_add_samples_keeps_sorted_samples(tmpdir):
+    data = make_database(tmpdir)
+    newsamples = [make_sample(tmpdir, "B", 7), make_sample(tmpdir, "D", 9)]
+
+    ## B hits locus 1, and a gap was inserted into the existing rows at 3
+    with open(os.path.join(data.tmpdir, "toy.profile_1.aligned"), 'w') as out:
+        out.write("1 0 0 3\nB_0\nACGTTACGTAC\n//\n//\n")
+    ## B and D form a new locus
+    with open(os.path.join(data.tmpdir, "align_1.fa"), 'w') as out:
+        out.write("D_0\nGGGGCCCCAA\nB_1\nGGGGCCCCAA\n")
+
+    inc_fill_database(data, ["A", "C"], newsamples)
+
+    with h5py.File(data.clust_database, 'r') as io5:
+        for key in ["seqs", "catgs", "nalleles", "chroms"]:
+            assert list(io5[key].attrs["samples"]) == ["A", "B", "C", "D"]
+        seqs = io5["seqs"][:]
+        catgs = io5["catgs"][:]
+        nalls = io5["nalleles"][:]
+        chroms = io5["chroms"][:]
+        splits = io5["splits"][:]
+
+    assert seqs.shape == (4, 4, MAXLEN)
+    assert splits.shape == (4, )
+
+    ## C was moved from column 1 to 2 without changes
+    assert seqs[0, 0, :10].tostring() == OLDSEQ
+    assert seqs[0, 2, :10].tostring() == OLDSEQ
+    assert np.all(seqs[0, [1, 3]] == "N")
+    assert catgs[0, 2, 0, 0] == 100
+    assert nalls[0, 2] == 1
+    assert not nalls[0, 1]
+
+    ## the inserted gap shifts the existing rows and their depths
+    assert seqs[1, 0, :11].tostring() == "ACG-TACGTAC"
+    assert seqs[1, 2, :11].tostring() == "ACG-TACGTAC"
+    assert seqs[1, 1, :11].tostring() == "ACGTTACGTAC"
+    assert catgs[1, 2, 3].sum() == 0
+    assert catgs[1, 2, 4, 0] == 400
+    assert catgs[1, 1, 0, 0] == 7
+    assert nalls[1, 1] == 1
+
+    ## the new locus is empty for existing samples and has no position
+    assert np.all(seqs[3, [0, 2]] == "N")
+    assert seqs[3, 1, :10].tostring() == "GGGGCCCCAA"
+    assert seqs[3, 3, :10].tostring() == "GGGGCCCCAA"
+    assert catgs[3, 3, 0, 0] == 9
+    assert nalls[3, 1] == 2
+    assert not np.any(catgs[3, [0, 2]])
+    assert not np.any(chroms)
+
+
+
+def test_add_samples_sorted_last(tmpdir):
+    ## existing columns are not moved if new samples sort after them
+    data = make_database(tmpdir)
+    newsamples = [make_sample(tmpdir, "E", 5)]
+    with open(os.path.join(data.tmpdir, "align_1.fa"), 'w') as out:
+        out.write("E_1\nGGGGCCCCAA\n")
+
+    inc_fill_database(data, ["A", "C"], newsamples)
+
+    with h5py.File(data.clust_database, 'r') as io5:
+        assert list(io5["seqs"].attrs["samples"]) == ["A", "C", "E"]
+        seqs = io5["seqs"][:]
+        catgs = io5["catgs"][:]
+    assert seqs.shape == (4, 3, MAXLEN)
+    assert seqs[2, 1, :10].tostring() == OLDSEQ
+    assert catgs[2, 1, 0, 0] == 100
+    assert np.all(seqs[:3, 2] == "N")
+    assert np.all(seqs[3, :2] == "N")
+    assert seqs[3, 2, :10].tostring() == "GGGGCCCCAA"
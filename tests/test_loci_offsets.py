@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+""" checks that the precomputed .loci and .alleles.loci chunk sizes match the
+    text of each locus, and that chunks written at their offsets give the
+    same file as concatenating the chunk files as was done before.
+"""
+
+import numpy as np
+from collections import Counter
+from ipyrad.assemble.write_outfiles import padnames, enter_singles, \
+    enter_pairs, get_alleles, get_loci_sizes, coverage_numba, pwrite
+
+
+ANAMES = ["a", "bb", "ccc"]
+SMASK = np.array([False, True, False])
+
+
+def make_chunk(rows, edges, keep):
+    """ phased seqs and snps of a chunk of loci from lists of row strings """
+    lseqs = np.array([[list(i) for i in loc] for loc in rows], dtype="S1")
+    snps = np.zeros((lseqs.shape[0], lseqs.shape[2], 2), dtype=np.bool_)
+    snps[:, 3, 0] = True
+    snps[:, 4, 1] = True
+    return {"lseqs": lseqs,
+            "seqs": np.char.upper(lseqs),
+            "snps": snps,
+            "edges": np.array(edges, dtype=np.int16),
+            "keep": np.array(keep)}
+
+
+## single end, the middle locus is filtered and the last has no data for
+## "ccc" inside the edges
+SINGLE = make_chunk([
+    ["TACGRACGTAGG", "TACGAACGTAGG", "TACGGACGTAGG"],
+    ["TACGAACGTAGG", "TACGAACGTAGG", "TACGAACGTAGG"],
+    ["TACGAAcGTAGG", "TACGAACGTAGG", "TNNNNNNNNNNN"],
+    ], [[1, 9, 0, 0, 0]] * 3, [True, False, True])
+
+## paired, R2 starts after the spacer at 6
+PAIRED = make_chunk([
+    ["TACGkAnnnnGGCATC", "TACGTAnnnnGGCATC", "TACGTAnnnnGGCATC"],
+    ["TACGGAnnnnGGCATC", "TACGTAnnnnGGCATC", "NNNNNNNNNNNNNNNN"],
+    ], [[1, 5, 10, 14, 6]] * 2, [True, True])
+
+## nothing passed
+EMPTY = make_chunk([["TACGAACGTAGG"] * 3], [[1, 9, 0, 0, 0]], [False])
+
+
+
+def build_text(chunk, start, pnames, snppad):
+    """ the loci and alleles text of a chunk from the locus builders """
+    store = []
+    lstore = []
+    for iloc in np.where(chunk["keep"])[0]:
+        edg = chunk["edges"][iloc]
+        enter = enter_pairs if edg[4] else enter_singles
+        for seqs, out in [(chunk["seqs"], store), (chunk["lseqs"], lstore)]:
+            args = [iloc, pnames, snppad, edg, seqs, chunk["snps"], SMASK,
+                    np.zeros(3, dtype=np.int32), Counter(), start]
+            out.append(enter(*args)[0])
+    return store, lstore
+
+
+
+def get_sizes(chunk, start, pnames, snppad):
+    keep = np.where(chunk["keep"])[0]
+    nmask = chunk["seqs"][:, ~SMASK] == "N"
+    coverage = coverage_numba(nmask, chunk["edges"].astype(np.int64))
+    return get_loci_sizes(keep + start, chunk["edges"][keep], coverage[keep],
+                          len(pnames[0]), len(snppad))
+
+
+
+def test_locus_sizes():
+    pnames, snppad = padnames(ANAMES)
+    for chunk in [SINGLE, PAIRED]:
+        store, lstore = build_text(chunk, 10, pnames, snppad)
+        locisize, allelesize = get_sizes(chunk, 10, pnames, snppad)
+        assert locisize.tolist() == [len(i) + 1 for i in store]
+        assert allelesize.tolist() == \
+            [len(get_alleles(i + "\n").lstrip("\n")) for i in lstore]
+
+
+
+def test_chunks_at_offsets(tmpdir):
+    pnames, snppad = padnames(ANAMES)
+    chunks = [(0, SINGLE), (9, PAIRED), (11, EMPTY)]
+
+    ## the old output concatenated a file of each chunk, empty chunks were
+    ## a blank line that is no longer written
+    oldloci = ""
+    oldalleles = ""
+    for start, chunk in chunks:
+        store, lstore = build_text(chunk, start, pnames, snppad)
+        if store:
+            oldloci += "\n".join(store) + "\n"
+            oldalleles += get_alleles("\n".join(lstore) + "\n")
+
+    ## offsets from the sizes, then write chunks out of order. Locus ids
+    ## 9 and 10 change the width of the snp line.
+    offsets = []
+    ofs = aofs = 0
+    for start, chunk in chunks:
+        locisize, allelesize = get_sizes(chunk, start, pnames, snppad)
+        offsets.append((ofs, aofs))
+        ofs += locisize.sum()
+        aofs += allelesize.sum()
+    assert ofs == len(oldloci)
+    assert aofs == len(oldalleles)
+
+    lociname = str(tmpdir.join("toy.loci"))
+    allelename = str(tmpdir.join("toy.alleles.loci"))
+    for fname, size in [(lociname, ofs), (allelename, aofs)]:
+        with open(fname, 'w') as out:
+            out.truncate(size)
+    for (start, chunk), (ofs, aofs) in reversed(zip(chunks, offsets)):
+        store, lstore = build_text(chunk, start, pnames, snppad)
+        pwrite(lociname, "".join(i + "\n" for i in store), ofs)
+        if lstore:
+            allelestr = get_alleles("".join(i + "\n" for i in lstore))
+            pwrite(allelename, allelestr.lstrip("\n"), aofs)
+    assert open(lociname).read() == oldloci
+    assert open(allelename).read() == oldalleles
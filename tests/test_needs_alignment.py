@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+""" checks which step 6 clusters may skip the aligner """
+
+from ipyrad.assemble.cluster_across import needs_alignment
+
+
+SEED = "TGCAGGATCCATTGACGTACCGTAGGCTAACGTTGCATGCAAGTCCGATTAGCACTGGTA"
+
+
+def test_identical_skip_aligner():
+    assert not needs_alignment([SEED])
+    assert not needs_alignment([SEED, SEED.lower()])
+
+
+def test_missing_bases_skip_aligner():
+    ## Ns are not differences
+    seq = "NNNN" + SEED[4:30] + "N" + SEED[31:]
+    assert not needs_alignment([SEED, seq])
+
+
+def test_substitutions_are_aligned():
+    ## a snp cannot be told apart from a shifted tail, so it is aligned
+    seq = SEED[:10] + "C" + SEED[11:]
+    assert needs_alignment([SEED, seq])
+
+
+def test_indel_same_length_is_aligned():
+    ## an internal deletion plus a 3' extension of the same total length
+    seq = SEED[:20] + SEED[21:] + "G"
+    assert len(seq) == len(SEED)
+    assert needs_alignment([SEED, seq])
+
+
+def test_deletion_near_3prime_is_aligned():
+    ## a 1bp deletion at site 55 of 60 in a trimmed read
+    seq = SEED[:55] + SEED[56:] + "A"
+    assert len(seq) == len(SEED)
+    assert needs_alignment([SEED, seq])
+
+
+def test_insertion_near_3prime_is_aligned():
+    ## a 1bp insertion at site 50 of 60 in a trimmed read
+    seq = SEED[:50] + "T" + SEED[50:-1]
+    assert len(seq) == len(SEED)
+    assert needs_alignment([SEED, seq])
+
+
+def test_indel_at_last_site_is_aligned():
+    ## a deletion of the last base and a 1bp 3' extension
+    seq = SEED[:59] + "G"
+    assert len(seq) == len(SEED)
+    assert needs_alignment([SEED, seq])
+
+
+def test_paired_splitter_position():
+    seq1 = SEED[:30] + "nnnn" + SEED[30:]
+    seq2 = SEED[:31] + "nnnn" + SEED[31:]
+    assert not needs_alignment([seq1, seq1])
+    assert needs_alignment([seq1, seq2])
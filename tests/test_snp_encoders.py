@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+""" checks the STRUCTURE and geno encoders on a toy snp block. Expected
+    rows are the outputs of the old per-base write_str and write_geno.
+"""
+
+import os
+import h5py
+import numpy as np
+from ipyrad.assemble.write_outfiles import encode_structure, encode_geno, \
+    write_str, write_geno
+
+
+ROWS = ["ACGRT", "GCGA-", "RNTAY", "ATGGC"]
+BLOCK = np.array([list(i) for i in ROWS], dtype="S1")
+
+STRUCTURE = [
+    ["0\t3\t2\t2\t1", "2\t3\t2\t0\t-9", "2\t-9\t1\t0\t1", "0\t1\t2\t2\t3"],
+    ["0\t3\t2\t0\t1", "2\t3\t2\t0\t-9", "0\t-9\t1\t0\t3", "0\t1\t2\t2\t3"],
+    ]
+GENO = "2012\n2290\n2202\n1220\n0912\n"
+
+
+class Toy(object):
+    """ stands in for the Assembly attributes that are used """
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+
+def test_encode_structure():
+    for allele in [0, 1]:
+        rows = encode_structure(BLOCK, allele)
+        assert [i[1:] for i in rows] == STRUCTURE[allele]
+        assert all([i.startswith("\t") for i in rows])
+
+
+
+def test_encode_geno():
+    assert encode_geno(BLOCK) == GENO
+
+
+
+def test_empty_block():
+    empty = np.zeros((4, 0), dtype="S1")
+    assert encode_structure(empty, 0) == ["", "", "", ""]
+    assert encode_geno(empty) == ""
+
+
+
+def test_write_str_and_geno(tmpdir):
+    outdir = str(tmpdir)
+    data = Toy(name="toy",
+               dirs=Toy(outfiles=outdir),
+               paramsdict={"max_alleles_consens": 2},
+               outfiles=Toy(**{i: os.path.join(outdir, "toy."+i) for i in \
+                               ["str", "ustr", "geno", "ugeno"]}))
+
+    ## snps fill 5 of 7 columns, the unlinked snps array is empty
+    with h5py.File(os.path.join(outdir, "tmp-toy.h5"), 'w') as io5:
+        snparr = np.zeros((4, 7), dtype="S1")
+        snparr[:, :5] = BLOCK
+        io5.create_dataset("snparr", data=snparr)
+        io5.create_dataset("bisarr", data=np.zeros((4, 7), dtype="S1"))
+        io5["snparr"].attrs["end"] = 5
+        io5["bisarr"].attrs["end"] = 0
+
+    pnames = ["s{}  ".format(i) for i in range(4)]
+    write_str(data, None, pnames)
+    write_geno(data, None)
+
+    expect = []
+    for name, row0, row1 in zip(pnames, *STRUCTURE):
+        expect += [name + "\t\t\t\t\t" + row0, name + "\t\t\t\t\t" + row1]
+    assert open(data.outfiles.str).read() == "\n".join(expect) + "\n"
+    expect = "".join([name + "\t\t\t\t\t\n" for name in pnames for _ in "01"])
+    assert open(data.outfiles.ustr).read() == expect
+    assert open(data.outfiles.geno).read() == GENO
+    assert open(data.outfiles.ugeno).read() == ""
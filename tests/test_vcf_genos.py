@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+""" checks the VCF genotype columns on toy loci. Expected cells are the
+    per-cell string formatting of the old vcfchunk, except that CATG counts
+    are no longer truncated to four characters.
+"""
+
+import numpy as np
+from ipyrad.assemble.write_outfiles import get_genos, vcfgenos_numba, vcfloci
+
+
+SEQS = ["ACGTAC", "ACRTAC", "GCGTAY", "NNNNNN", "GCGTAT"]
+CATG = {"C": (10, 0, 0, 0), "A": (0, 10, 0, 0), "T": (0, 0, 10, 0),
+        "G": (0, 0, 0, 10), "R": (0, 5, 0, 6), "Y": (4, 0, 4, 0),
+        "N": (0, 0, 0, 0)}
+
+REFALT = ["AG", "C", "GA", "T", "A", "CT"]
+CELLS = [
+    "0/0:10:0,10,0,0\t0/0:10:0,10,0,0\t1/1:10:0,0,0,10\t./.:0:0,0,0,0\t1/1:10:0,0,0,10",
+    "0/0:10:10,0,0,0\t0/0:10:10,0,0,0\t0/0:10:10,0,0,0\t./.:0:0,0,0,0\t0/0:10:10,0,0,0",
+    "0/0:10:0,0,0,10\t0/1:11:0,5,0,6\t0/0:10:0,0,0,10\t./.:0:0,0,0,0\t0/0:10:0,0,0,10",
+    "0/0:10:0,0,10,0\t0/0:10:0,0,10,0\t0/0:10:0,0,10,0\t./.:0:0,0,0,0\t0/0:10:0,0,10,0",
+    "0/0:12345:0,12345,0,0\t0/0:10:0,10,0,0\t0/0:10:0,10,0,0\t./.:0:0,0,0,0\t0/0:10:0,10,0,0",
+    "0/0:10:10,0,0,0\t0/0:10:10,0,0,0\t1/0:8:4,0,4,0\t./.:0:0,0,0,0\t1/1:10:0,0,10,0",
+    ]
+
+
+class Toy(object):
+    """ stands in for the Assembly and chunk attributes that are used """
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+
+def format_cells(seq, catg):
+    alleles, genos = get_genos(seq, catg)
+    buff = np.zeros(genos.shape[0] * (genos.shape[1] * 64 + 1), dtype=np.uint8)
+    ends = vcfgenos_numba(genos, catg.transpose(1, 0, 2).astype(np.int64), buff)
+    text = buff[:ends[-1]].tostring() if ends.shape[0] else ""
+    return alleles, text.split("\n")[:-1]
+
+
+
+def test_genotype_cells():
+    seq = np.array([list(i) for i in SEQS]).view(np.uint8)
+    catg = np.array([[CATG[j] for j in i] for i in SEQS], dtype=np.uint32)
+    catg[0, 4] = (0, 12345, 0, 0)
+    alleles, cells = format_cells(seq, catg)
+    assert ["".join(i).strip("\x00.") for i in alleles.view("S1").tolist()] \
+        == REFALT
+    assert cells == CELLS
+
+
+
+def test_no_sites():
+    seq = np.zeros((5, 0), dtype=np.uint8)
+    catg = np.zeros((5, 0, 4), dtype=np.uint32)
+    alleles, cells = format_cells(seq, catg)
+    assert alleles.shape == (0, 4)
+    assert cells == []
+
+
+
+def get_chunk():
+    """ three paired loci, the second is filtered, the third is mapped. Seqs
+        are for all samples, catgs are already for the sidx samples. """
+    seqs = np.zeros((3, 3, 14), dtype="S1")
+    seqs.fill("A")
+    snps = np.zeros((3, 14, 2), dtype=np.bool_)
+    snps[[0, 0, 2, 2], [2, 10, 3, 11], 0] = True
+    return Toy(start=10,
+               keep=np.array([True, False, True]),
+               edges=np.array([[1, 4, 9, 12, 6]] * 3, dtype=np.int16),
+               snps=snps,
+               seqs=seqs,
+               catgs=np.ones((3, 2, 14, 4), dtype=np.uint32),
+               chroms=np.array([[0, 0, 0], [0, 0, 0], [2, 100, 114]]),
+               sidx=np.array([True, False, True]))
+
+
+
+def test_vcfloci_paired_snps():
+    data = Toy(paramsdict={"datatype": "pairddrad"})
+    loci = list(vcfloci(data, get_chunk(), 0))
+    assert [i[0] for i in loci] == [10, 12]
+    assert [i[1] for i in loci] == [0, 2]
+    assert [i[2].tolist() for i in loci] == [[2, 6], [103, 107]]
+    assert [i[3].shape for i in loci] == [(2, 2), (2, 2)]
+    assert [i[4].shape for i in loci] == [(2, 2, 4), (2, 2, 4)]
+
+
+
+def test_vcfloci_paired_full():
+    ## the old full output dropped the rows of anonymous loci
+    data = Toy(paramsdict={"datatype": "pairddrad"})
+    loci = list(vcfloci(data, get_chunk(), 1))
+    assert [i[0] for i in loci] == [10, 12]
+    assert [i[2].tolist() for i in loci] == \
+        [range(1, 9), range(101, 109)]
+    assert [i[3].shape for i in loci] == [(2, 8), (2, 8)]